@@ -0,0 +1,190 @@
+"""Per-request resource accounting.
+
+request_handler starts a RequestAccounting for every request and makes it the
+current one while the request is handled. Code that doesn't know about requests,
+like the timed SQLite cursors and the caches, records into whichever is current
+with note_sql and note_cache. Outside of a request they do nothing.
+
+    with phase("serialize"):
+        body = json.dumps(data)
+
+Phases may overlap, a phase inside another counts towards both.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter, thread_time
+
+# Different statements recorded per request, so dynamic SQL can't grow it forever.
+MAX_STATEMENTS = 100
+
+_current: ContextVar = ContextVar("request_accounting", default=None)
+
+
+class RequestAccounting:
+    """Where the time of a single request went."""
+
+    __slots__ = (
+        "started",
+        "cpu_started",
+        "phases",
+        "running",
+        "sql_count",
+        "sql_time",
+        "statements",
+        "cache_hits",
+        "cache_misses",
+    )
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.cpu_started = thread_time()
+        self.phases = {}  # name -> seconds
+        self.running = {}  # name -> start of the phases not finished yet
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = {}  # sql -> times executed
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def elapsed(self) -> float:
+        return perf_counter() - self.started
+
+    def cpu_time(self) -> float:
+        """CPU time of the thread handling the request, I/O waits excluded."""
+        return thread_time() - self.cpu_started
+
+    def enter_phase(self, name: str) -> float:
+        start = perf_counter()
+        self.running[name] = start
+        return start
+
+    def exit_phase(self, name: str, start: float) -> None:
+        self.running.pop(name, None)
+        duration = perf_counter() - start
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+        return None
+
+    def add_sql(self, sql: str, duration: float) -> None:
+        self.sql_count += 1
+        self.sql_time += duration
+        count = self.statements.get(sql)
+        if count is not None:
+            self.statements[sql] = count + 1
+        elif len(self.statements) < MAX_STATEMENTS:
+            self.statements[sql] = 1
+        return None
+
+    def repeated_statements(self, threshold: int) -> list:
+        """(sql, count) of the statements executed at least threshold times, which
+        usually means a query runs once per row of another (N+1)."""
+        return [
+            (sql, count)
+            for sql, count in self.statements.items()
+            if count >= threshold
+        ]
+
+    def server_timing(self) -> str:
+        """The value of a Server-Timing header, durations are in milliseconds.
+        Phases still running, like the handler sending the response, are included
+        up to now."""
+        now = perf_counter()
+        phases = dict(self.phases)
+        for name, start in self.running.items():
+            phases[name] = phases.get(name, 0.0) + now - start
+        metrics = [
+            f"{name};dur={duration * 1000:.2f}" for name, duration in phases.items()
+        ]
+        metrics.append(
+            f'db;dur={self.sql_time * 1000:.2f};desc="{self.sql_count} queries"'
+        )
+        if self.cache_hits or self.cache_misses:
+            metrics.append(
+                f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"'
+            )
+        metrics.append(f"cpu;dur={self.cpu_time() * 1000:.2f}")
+        metrics.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(metrics)
+
+    def summary(self) -> dict:
+        """Everything recorded, in milliseconds, for logs."""
+        return {
+            "total_ms": round(self.elapsed() * 1000, 3),
+            "cpu_ms": round(self.cpu_time() * 1000, 3),
+            "phases_ms": {
+                name: round(duration * 1000, 3)
+                for name, duration in self.phases.items()
+            },
+            "sql_count": self.sql_count,
+            "sql_ms": round(self.sql_time * 1000, 3),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+        }
+
+
+def begin() -> tuple:
+    """Starts accounting for a request, returns (accounting, token for end)."""
+    accounting = RequestAccounting()
+    return accounting, _current.set(accounting)
+
+
+def end(token) -> None:
+    _current.reset(token)
+    return None
+
+
+def current() -> RequestAccounting | None:
+    return _current.get()
+
+
+def note_sql(sql: str, duration: float) -> None:
+    accounting = _current.get()
+    if accounting is not None:
+        accounting.add_sql(sql, duration)
+    return None
+
+
+def note_cache(hit: bool) -> None:
+    accounting = _current.get()
+    if accounting is None:
+        return None
+    if hit:
+        accounting.cache_hits += 1
+    else:
+        accounting.cache_misses += 1
+    return None
+
+
+@contextmanager
+def phase(name: str):
+    """Adds the time spent in the block to the current request's phase."""
+    accounting = _current.get()
+    if accounting is None:
+        yield
+        return
+    start = accounting.enter_phase(name)
+    try:
+        yield
+    finally:
+        accounting.exit_phase(name, start)
+
+
+def timed_phase(name: str):
+    """Decorator, adds the time spent in the function to the phase."""
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            accounting = _current.get()
+            if accounting is None:
+                return function(*args, **kwargs)
+            start = accounting.enter_phase(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                accounting.exit_phase(name, start)
+
+        return wrapper
+
+    return decorator
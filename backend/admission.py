@@ -0,0 +1,191 @@
+"""
+Admission control, in front of request_handler.route.
+
+The server handles one request at a time, so when it's overloaded connections wait
+in the listen backlog, and by the time a request is handled its client may have
+given up already. Every request is put in a route class before it's routed:
+
+- static: files, GET /session and GET /metrics. Cheap, shed last.
+- api: every other handler, including the tasks API.
+- search: GET /api/tasks with a query, which has to match every task of the user.
+- auth: logging in, creating an account and changing the password, which hash with
+  bcrypt. Expensive, shed first.
+
+The classes are set in route_classes and search_routes in backend/router/routes.py.
+
+The time a new connection will wait is estimated as the connections waiting in the
+backlog times the mean time a request takes. While that is over the target of a
+class, its requests are answered with 503 and a Retry-After of about that long,
+before their body is read or any other work is done, which leaves the server to the
+classes with higher targets. Every class also has a cap on the requests it has in
+flight, which matters once requests are handled concurrently.
+
+The backlog is read with TCP_INFO, which is only available on Linux. Elsewhere only
+the caps apply.
+
+Configured with environment variables:
+- ADMISSION_CONTROL: '0' admits every request (default: 1)
+- ADMISSION_TARGETS_MS: targets of the classes, like 'static=2000,auth=250'
+  (default: static=2000,api=500,search=350,auth=250)
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import struct
+import threading
+from http import HTTPStatus
+from math import ceil
+from typing import TYPE_CHECKING
+from backend.metrics import counter, gauge
+
+if TYPE_CHECKING:
+    from backend.router.RequestHandler import request_handler
+
+# Weight of the newest request in the mean request duration.
+DURATION_SMOOTHING = 0.1
+# The accept queue length of a listening socket is tcpi_unacked in struct tcp_info.
+_TCP_INFO_LENGTH = 104
+_TCP_INFO_UNACKED = 24
+
+
+class RouteClass:
+    """Requests of a class are shed once the estimated wait is over target seconds,
+    or once max_in_flight of them are being handled."""
+
+    def __init__(self, name: str, target: float, max_in_flight: int):
+        self.name = name
+        self.target = target
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.shed = 0
+
+
+DEFAULT_ROUTE_CLASSES = (
+    RouteClass("static", 2.0, 64),
+    RouteClass("api", 0.5, 16),
+    RouteClass("search", 0.35, 8),
+    RouteClass("auth", 0.25, 4),
+)
+
+
+def queued_connections(listening: socket.socket) -> int | None:
+    """The connections waiting to be accepted, None where that can't be read."""
+    if not hasattr(socket, "TCP_INFO"):
+        return None
+    try:
+        info = listening.getsockopt(
+            socket.IPPROTO_TCP, socket.TCP_INFO, _TCP_INFO_LENGTH
+        )
+    except OSError:
+        return None
+    return struct.unpack_from("I", info, _TCP_INFO_UNACKED)[0]
+
+
+class AdmissionController:
+    def __init__(self, route_classes=DEFAULT_ROUTE_CLASSES, *, enabled: bool = True):
+        self.classes = {route_class.name: route_class for route_class in route_classes}
+        self.enabled = enabled
+        self.mean_duration = 0.0
+        # The last estimate, for the metrics.
+        self.queue_delay = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, duration: float) -> None:
+        """Adds the duration of a handled request to the mean."""
+        self.mean_duration += DURATION_SMOOTHING * (duration - self.mean_duration)
+        return None
+
+    def estimate_queue_delay(self, listening: socket.socket) -> float:
+        """Seconds a connection accepted now would wait for the ones before it."""
+        queued = queued_connections(listening)
+        self.queue_delay = 0.0 if queued is None else queued * self.mean_duration
+        return self.queue_delay
+
+    def admit(self, name: str, listening: socket.socket) -> float | None:
+        """
+        Returns None and counts the request as in flight if it's admitted, which
+        has to be followed by release. Otherwise returns the seconds the client
+        should wait before trying again.
+        """
+        route_class = self.classes[name]
+        delay = self.estimate_queue_delay(listening) if self.enabled else 0.0
+        with self._lock:
+            if self.enabled and (
+                delay > route_class.target
+                or route_class.in_flight >= route_class.max_in_flight
+            ):
+                route_class.shed += 1
+                return delay
+            route_class.in_flight += 1
+        return None
+
+    def release(self, name: str) -> None:
+        with self._lock:
+            self.classes[name].in_flight -= 1
+        return None
+
+
+def parse_targets(value: str) -> dict:
+    """Parses 'class=ms,class=ms' into {class: seconds}."""
+    targets = {}
+    for pair in value.split(","):
+        if not pair.strip():
+            continue
+        name, _, milliseconds = pair.partition("=")
+        targets[name.strip()] = float(milliseconds) / 1000
+    return targets
+
+
+controller = AdmissionController(
+    enabled=os.environ.get("ADMISSION_CONTROL", "1") != "0"
+)
+for _name, _target in parse_targets(
+    os.environ.get("ADMISSION_TARGETS_MS", "")
+).items():
+    controller.classes[_name].target = _target
+
+gauge(
+    "admission_queue_delay_seconds",
+    "Estimated wait of a new connection when the last request was admitted.",
+    function=lambda: controller.queue_delay,
+)
+gauge(
+    "admission_in_flight_requests",
+    "Requests being handled, by route class.",
+    ("class",),
+    function=lambda: {
+        (name,): route_class.in_flight
+        for name, route_class in controller.classes.items()
+    },
+)
+counter(
+    "admission_shed_requests_total",
+    "Requests answered with 503 by admission control, by route class.",
+    ("class",),
+    function=lambda: {
+        (name,): route_class.shed
+        for name, route_class in controller.classes.items()
+    },
+)
+
+
+def server_admit(self: request_handler, route_class: str) -> bool:
+    """
+    Returns True if the request may be routed, release has to be called once it
+    was. Otherwise sends a 503 response with Retry-After and returns False.
+    """
+    wait = controller.admit(route_class, self.server.socket)
+    if wait is None:
+        return True
+    self.response_headers["Retry-After"] = max(1, ceil(wait))
+    self.send_http_response(
+        HTTPStatus.SERVICE_UNAVAILABLE, "The server is overloaded, try again later."
+    )
+    return False
+
+
+def release(route_class: str) -> None:
+    controller.release(route_class)
+    return None
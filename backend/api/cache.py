@@ -0,0 +1,101 @@
+"""
+In-process cache for encoded API responses.
+
+Every entry is stored with the version of the user's data it was built from, and
+is only served for that version. Versions are kept by the caller somewhere every
+process sees, like the task_versions table, and read on every request: a write
+handled by another process (say, the new one during a SIGHUP handoff) makes this
+process's entries stale too. ETags are derived from the version the same way in
+every process, so conditional requests are answered without the cache.
+
+Entries are grouped per user so that a write seen in this process can drop all of
+that user's cached responses at once, freeing them before they're evicted.
+"""
+
+import threading
+import zlib
+from collections import OrderedDict
+
+from backend.accounting import note_cache
+
+# Rough per-entry bookkeeping cost on top of the body itself.
+ENTRY_OVERHEAD_BYTES = 200
+
+
+class ResponseCache:
+    """
+    LRU cache of encoded response bodies, bounded by their total size.
+
+    Keys are (user_id, *rest) tuples so entries can be invalidated per user.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()  # key -> (version, body)
+        self._user_keys = {}  # user_id -> set of keys
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(key, version):
+        """Returns the ETag of the response stored under key at the version."""
+        # hash() of a string differs between processes, crc32 doesn't.
+        return f'"{version}-{zlib.crc32(repr(key).encode()):x}"'
+
+    def get(self, key, version):
+        """Returns the body cached for key at the version, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                note_cache(False)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            note_cache(True)
+            return entry[1]
+
+    def put(self, key, version, body):
+        """
+        Caches the body under key at the version.
+
+        The body is dropped if a body of a later version is cached already, or if
+        it is larger than max_entry_bytes.
+        """
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            user_id = key[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > version:
+                return
+            self._remove(key)
+            self._entries[key] = (version, body)
+            self._user_keys.setdefault(user_id, set()).add(key)
+            self.size_bytes += len(body) + ENTRY_OVERHEAD_BYTES
+            while self.size_bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        """Drops every cached response of the user."""
+        with self._lock:
+            for key in list(self._user_keys.get(user_id, ())):
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size_bytes -= len(entry[1]) + ENTRY_OVERHEAD_BYTES
+        user_keys = self._user_keys.get(key[0])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._user_keys[key[0]]
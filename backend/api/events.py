@@ -0,0 +1,260 @@
+"""
+Task changes pushed to clients as Server-Sent Events, for GET /api/tasks/stream.
+
+The server handles one request at a time, so a stream can't keep its request
+running. The handler sends the headers and hands the connection to the hub, whose
+single thread writes the events of every stream. The server leaves handed over
+connections open, see request_handler.hand_over_connection.
+
+Every committed task change is published by a tasks_db change listener as one
+event, with the task as its data ({"id": ...} for deletes, {} for imports, after
+which the client should reload the list):
+
+    id: 18c2f3a9b10.42
+    event: update
+    data: {"id": 7, "title": "Milk", "completed": true, ...}
+
+The last MAX_BUFFERED_EVENTS events of every user with a stream are kept, so a
+client reconnecting with Last-Event-ID gets the ones it missed. If they're gone
+already, or the id is from another process, the stream starts with a 'reset' event
+instead and the client reloads the list. Comment lines are sent every
+HEARTBEAT_INTERVAL seconds so dead connections are noticed and proxies keep idle
+ones open.
+
+Events only reach streams served by the process the change happened in.
+"""
+
+import json
+import logging
+import selectors
+import socket
+import threading
+from collections import OrderedDict, deque
+from time import monotonic, time
+from backend.db import tasks as tasks_db
+from backend.metrics import counter, gauge
+
+logger = logging.getLogger(__name__)
+
+MAX_STREAMS_PER_USER = 5
+MAX_BUFFERED_EVENTS = 100
+# Users whose events are kept for resuming, the least recently active are dropped.
+MAX_BUFFERED_USERS = 10_000
+HEARTBEAT_INTERVAL = 15
+# Milliseconds the client waits before reconnecting.
+RECONNECT_DELAY = 3000
+# A stream whose client reads slower than this many bytes behind is closed.
+MAX_PENDING_BYTES = 256 * 1024
+
+# Ids from an earlier process mean nothing to this one, so they carry its start.
+_EPOCH = f"{int(time() * 1000):x}"
+
+
+class _History:
+    """The last events of a user, numbered from 1 for every user."""
+
+    def __init__(self):
+        self.events = deque(maxlen=MAX_BUFFERED_EVENTS)  # (sequence, event)
+        self.sequence = 0
+
+
+class _Stream:
+    def __init__(self, connection: socket.socket, user_id: int):
+        self.connection = connection
+        self.user_id = user_id
+        self.pending = bytearray()
+
+
+def encode_event(event_id: str, event: str, data) -> bytes:
+    return (
+        f"id: {event_id}\nevent: {event}\ndata: "
+        f"{json.dumps(data, separators=(',', ':'))}\n\n"
+    ).encode()
+
+
+class EventHub:
+    """In-process publish/subscribe of task changes, fanned out per user."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}  # user id -> list of _Stream
+        self._history = OrderedDict()  # user id -> _History
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_read, self._wakeup_write = socket.socketpair()
+        self._wakeup_read.setblocking(False)
+        self._wakeup_write.setblocking(False)
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ)
+        self._thread = None
+        self.published = 0
+        self.dropped_streams = 0
+
+    # -- Publishing
+    def publish(self, action: str, user_id: int, task) -> None:
+        with self._lock:
+            history = self._history.get(user_id)
+            if history is None:
+                # Nobody has streamed this user's tasks, nobody can miss them.
+                return None
+            self._history.move_to_end(user_id)
+            history.sequence += 1
+            event = encode_event(f"{_EPOCH}.{history.sequence}", action, task or {})
+            history.events.append((history.sequence, event))
+            for stream in self._streams.get(user_id, ()):
+                stream.pending += event
+            self.published += 1
+        self._wake()
+        return None
+
+    # -- Subscribing
+    def has_room(self, user_id: int) -> bool:
+        with self._lock:
+            return len(self._streams.get(user_id, ())) < MAX_STREAMS_PER_USER
+
+    def subscribe(
+        self, user_id: int, connection: socket.socket, last_event_id: str | None
+    ) -> None:
+        """Takes over the connection, the response headers have to be sent."""
+        stream = _Stream(connection, user_id)
+        stream.pending += f"retry: {RECONNECT_DELAY}\n\n".encode()
+        with self._lock:
+            history = self._history.get(user_id)
+            if history is None:
+                history = self._history[user_id] = _History()
+            self._history.move_to_end(user_id)
+            if last_event_id:
+                stream.pending += self._replay(history, last_event_id)
+            self._streams.setdefault(user_id, []).append(stream)
+            # Once the stream is added, so the history dropped isn't this one.
+            if len(self._history) > MAX_BUFFERED_USERS:
+                self._forget_idle_user()
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="event-hub", daemon=True
+                )
+                self._thread.start()
+        connection.setblocking(False)
+        self._selector.register(connection, selectors.EVENT_READ, stream)
+        self._wake()
+        return None
+
+    @staticmethod
+    def _replay(history: _History, last_event_id: str) -> bytes:
+        """The events after last_event_id, or a reset event if they're gone."""
+        epoch, _, sequence = last_event_id.partition(".")
+        try:
+            sequence = int(sequence)
+        except ValueError:
+            sequence = -1
+        oldest = history.events[0][0] if history.events else history.sequence + 1
+        if epoch != _EPOCH or not oldest - 1 <= sequence <= history.sequence:
+            return encode_event(
+                f"{_EPOCH}.{history.sequence}", "reset", {}
+            )
+        return b"".join(
+            event for number, event in history.events if number > sequence
+        )
+
+    def _forget_idle_user(self) -> None:
+        """Drops the events of the least recently active user without a stream."""
+        for user_id in self._history:
+            if user_id not in self._streams:
+                del self._history[user_id]
+                return None
+        return None
+
+    def streams(self) -> int:
+        with self._lock:
+            return sum(len(streams) for streams in self._streams.values())
+
+    # -- Writing
+    def _wake(self) -> None:
+        try:
+            self._wakeup_write.send(b"\0")
+        except (BlockingIOError, OSError):
+            # Already woken
+            pass
+        return None
+
+    def _run(self) -> None:
+        next_heartbeat = monotonic() + HEARTBEAT_INTERVAL
+        while True:
+            timeout = max(0, next_heartbeat - monotonic())
+            for key, _ in self._selector.select(timeout):
+                if key.data is None:
+                    try:
+                        while self._wakeup_read.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                # Clients never send anything on a stream, so a readable
+                # connection was closed by them.
+                self._close(key.data)
+            if monotonic() >= next_heartbeat:
+                next_heartbeat = monotonic() + HEARTBEAT_INTERVAL
+                with self._lock:
+                    for streams in self._streams.values():
+                        for stream in streams:
+                            stream.pending += b": heartbeat\n\n"
+            self._flush()
+
+    def _flush(self) -> None:
+        closed = []
+        with self._lock:
+            for streams in self._streams.values():
+                for stream in streams:
+                    if not stream.pending:
+                        continue
+                    try:
+                        sent = stream.connection.send(stream.pending)
+                    except BlockingIOError:
+                        sent = 0
+                    except OSError:
+                        closed.append(stream)
+                        continue
+                    del stream.pending[:sent]
+                    if len(stream.pending) > MAX_PENDING_BYTES:
+                        logger.warning(
+                            "Closed a stream that fell behind",
+                            extra={"user_id": stream.user_id},
+                        )
+                        self.dropped_streams += 1
+                        closed.append(stream)
+        for stream in closed:
+            self._close(stream)
+        return None
+
+    def _close(self, stream: _Stream) -> None:
+        with self._lock:
+            streams = self._streams.get(stream.user_id, [])
+            if stream not in streams:
+                return None
+            streams.remove(stream)
+            if not streams:
+                del self._streams[stream.user_id]
+        try:
+            self._selector.unregister(stream.connection)
+        except (KeyError, ValueError):
+            pass
+        stream.connection.close()
+        return None
+
+
+hub = EventHub()
+tasks_db.add_change_listener(hub.publish)
+
+gauge(
+    "task_event_streams",
+    "Open GET /api/tasks/stream connections.",
+    function=hub.streams,
+)
+counter(
+    "task_events_published_total",
+    "Task change events published to streaming users.",
+    function=lambda: hub.published,
+)
+counter(
+    "task_event_streams_dropped_total",
+    "Streams closed because their client fell too far behind.",
+    function=lambda: hub.dropped_streams,
+)
@@ -0,0 +1,146 @@
+"""
+Streaming response helpers.
+
+Large responses are produced by generators and written to the client as they
+are produced, so a response never has to be held in memory as a whole. Bodies
+are sent with chunked transfer-encoding since their length isn't known upfront.
+"""
+
+import json
+import logging
+from contextlib import closing, nullcontext
+
+logger = logging.getLogger(__name__)
+
+# Small pieces are joined until they reach this size before being written, which
+# keeps the number of chunks (and writes) low without holding much in memory.
+STREAM_BUFFER_SIZE = 16 * 1024
+
+
+def buffer_chunks(pieces, size=STREAM_BUFFER_SIZE):
+    """
+    Join small byte strings into chunks of at least the given size.
+
+    Args:
+        pieces: Iterable of bytes
+        size: Minimum size of every chunk but the last
+
+    Yields:
+        bytes
+    """
+    buffer = []
+    buffered = 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield b"".join(buffer)
+            buffer.clear()
+            buffered = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def iter_json_object_with_array(key, items):
+    """
+    Encode {key: [items...]} piece by piece.
+
+    The output is byte-for-byte what json.dumps({key: list(items)}) returns, but
+    only one item is encoded at a time.
+
+    Args:
+        key: Name of the array field
+        items: Iterable of JSON-serializable objects
+
+    Yields:
+        bytes
+    """
+    encode = json.JSONEncoder().encode
+    yield b'{' + encode(key).encode('utf-8') + b': ['
+    separator = b''
+    for item in items:
+        yield separator + encode(item).encode('utf-8')
+        separator = b', '
+    yield b']}'
+
+
+def iter_json_object_with_encoded_array(key, batches):
+    """
+    Wrap already encoded items as {key: [items...]}.
+
+    Args:
+        key: Name of the array field
+        batches: Iterable of bytes, each one or more JSON values separated by
+            commas
+
+    Yields:
+        bytes
+    """
+    yield b'{' + json.dumps(key).encode('utf-8') + b':['
+    separator = b''
+    for batch in batches:
+        yield separator + batch
+        separator = b','
+    yield b']}'
+
+
+def iter_ndjson(items):
+    """
+    Encode items as newline-delimited JSON, one line per item.
+
+    Args:
+        items: Iterable of JSON-serializable objects
+
+    Yields:
+        bytes
+    """
+    encode = json.JSONEncoder().encode
+    for item in items:
+        yield encode(item).encode('utf-8') + b'\n'
+
+
+def send_chunked_response(handler, status, chunks, content_type):
+    """
+    Send a response whose body is written as it is generated.
+
+    The first chunk is produced before the status line is sent, so errors such
+    as a failing query still propagate to the caller and can become a normal
+    error response. Errors after that point can only abort the connection.
+
+    Args:
+        handler: HTTP request handler instance
+        status: HTTP status code
+        chunks: Iterable of bytes
+        content_type: Value of the Content-Type header
+    """
+    chunks = iter(chunks)
+    with closing(chunks) if hasattr(chunks, 'close') else nullcontext():
+        first = next(chunks, b'')
+
+        handler.send_response(status)
+        for header, value in handler.response_headers.items():
+            handler.send_header(header, value)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.send_header('Connection', 'close')
+        handler.end_headers()
+
+        try:
+            _write_chunk(handler, first)
+            for chunk in chunks:
+                _write_chunk(handler, chunk)
+        except Exception:
+            # Not sending the terminating chunk lets the client know the body
+            # is incomplete.
+            logger.error("Aborted a streamed response", exc_info=True)
+            handler.close_connection = True
+            return
+        handler.wfile.write(b'0\r\n\r\n')
+
+
+def _write_chunk(handler, chunk):
+    # An empty chunk would terminate the body early.
+    if not chunk:
+        return
+    handler.wfile.write(b'%x\r\n%b\r\n' % (len(chunk), chunk))
+
@@ -6,34 +6,115 @@ Handlers follow the existing request_handler pattern used in the codebase.
 """
 
 import json
+import os
 import re
 from http import HTTPStatus
 from urllib.parse import parse_qs, urlparse
 from backend.db import tasks as tasks_db
+from backend.api import events
+from backend.api.cache import ResponseCache
+from backend.accounting import phase
+from backend.metrics import counter, gauge
+from backend.api.streaming import (
+    buffer_chunks,
+    iter_json_object_with_array,
+    iter_json_object_with_encoded_array,
+    iter_ndjson,
+    send_chunked_response,
+)
+from backend.router.request_body import MalformedBodyError, RequestBodyError
+from backend.schema import (
+    compile_schema,
+    ListOf,
+    NotRequired,
+    Nullable,
+    Object,
+)
+
+
+# Unknown fields are ignored by the API, so they're allowed through.
+TASK_CREATE_SCHEMA = compile_schema(Object({
+    "title": str,
+    "labels": NotRequired(ListOf(str)),
+}, allow_extra=True))
+TASK_UPDATE_SCHEMA = compile_schema(Object({
+    "title": NotRequired(Nullable(str)),
+    "completed": NotRequired(Nullable(bool)),
+    "labels": NotRequired(Nullable(ListOf(str))),
+}, allow_extra=True))
+# Exported lines also carry 'id', which is ignored on import.
+TASK_IMPORT_SCHEMA = compile_schema(Object({
+    "title": str,
+    "labels": NotRequired(ListOf(str)),
+    "completed": NotRequired(bool),
+    "createdAt": NotRequired(str),
+    "updatedAt": NotRequired(str),
+}, allow_extra=True))
+
+# Encoded GET /api/tasks bodies, served while the user's tasks version is the same.
+# Changes seen by this process drop them right away.
+tasks_list_cache = ResponseCache(
+    max_bytes=32 * 1024 * 1024, max_entry_bytes=1024 * 1024
+)
+tasks_db.add_change_listener(
+    lambda action, user_id, task: tasks_list_cache.invalidate_user(user_id)
+)
+gauge(
+    "tasks_list_cache_bytes",
+    "Size of the cached GET /api/tasks bodies.",
+    function=lambda: tasks_list_cache.size_bytes,
+)
+counter(
+    "tasks_list_cache_hits_total",
+    "GET /api/tasks responses served from the cache.",
+    function=lambda: tasks_list_cache.hits,
+)
+counter(
+    "tasks_list_cache_misses_total",
+    "GET /api/tasks responses that had to be built.",
+    function=lambda: tasks_list_cache.misses,
+)
+counter(
+    "tasks_list_cache_evictions_total",
+    "GET /api/tasks bodies evicted to stay under max_bytes.",
+    function=lambda: tasks_list_cache.evictions,
+)
+
+# GET /api/tasks bodies are encoded by SQLite instead of through a dict per task,
+# unless SQL_JSON_RESPONSES=0. See benchmarks/json_assembly.py.
+SQL_JSON_RESPONSES = (
+    tasks_db.HAS_JSON_FUNCTIONS
+    and os.environ.get("SQL_JSON_RESPONSES", "1") != "0"
+)
+
+MAX_IMPORT_LINE_LENGTH = 8 * 1024
+# Imports can be large, so they get longer than the firewall's default to arrive.
+IMPORT_BODY_TIMEOUT = 120
+# Only the first errors are listed so a bad file can't make the response huge.
+MAX_REPORTED_IMPORT_ERRORS = 100
 
 
 def read_json_body(handler):
     """
-    Read and parse JSON from request body.
+    Parse JSON from the request body.
+    
+    The body is read lazily by the request handler and only once, so calling
+    this again returns the same object.
     
     Args:
         handler: HTTP request handler instance
     
     Returns:
-        Parsed JSON dictionary or None if invalid
+        Parsed JSON, {} if there is no body, or None if invalid
+    
+    Raises:
+        RequestBodyError: If the body is too large or didn't arrive in time
     """
-    existing_body = getattr(handler, "parsed_request_body", None)
-    if isinstance(existing_body, (dict, list)):
-        return existing_body
     try:
-        content_length = int(handler.headers.get('Content-Length', 0))
-        if content_length == 0:
-            return {}
-        
-        body = handler.rfile.read(content_length)
-        return json.loads(body.decode('utf-8'))
-    except (ValueError, json.JSONDecodeError):
+        body = handler.parsed_request_body
+    except MalformedBodyError:
         return None
+    return {} if body is None else body
 
 
 def send_json_response(handler, status, data):
@@ -45,14 +126,44 @@ def send_json_response(handler, status, data):
         status: HTTP status code
         data: Dictionary to serialize as JSON
     """
-    body = json.dumps(data).encode('utf-8')
+    with phase('serialize'):
+        body = json.dumps(data).encode('utf-8')
+    send_json_bytes(handler, status, body)
+
+
+def send_json_bytes(handler, status, body):
+    """
+    Send an already encoded JSON response.
+    
+    Args:
+        handler: HTTP request handler instance
+        status: HTTP status code
+        body: JSON document as bytes
+    """
     handler.send_response(status)
+    for header, value in handler.response_headers.items():
+        handler.send_header(header, value)
     handler.send_header('Content-Type', 'application/json')
     handler.send_header('Content-Length', len(body))
+    handler.send_header('Connection', 'close')
     handler.end_headers()
     handler.wfile.write(body)
 
 
+def send_not_modified_response(handler):
+    """
+    Send a 304 response, the client's cached copy is still current.
+    
+    Args:
+        handler: HTTP request handler instance
+    """
+    handler.send_response(HTTPStatus.NOT_MODIFIED)
+    for header, value in handler.response_headers.items():
+        handler.send_header(header, value)
+    handler.send_header('Connection', 'close')
+    handler.end_headers()
+
+
 def send_error_response(handler, status, message):
     """
     Send an error JSON response.
@@ -65,6 +176,20 @@ def send_error_response(handler, status, message):
     send_json_response(handler, status, {"error": message})
 
 
+def send_schema_error_response(handler, violations):
+    """
+    Send a 400 JSON response describing why the body failed its schema.
+    
+    Args:
+        handler: HTTP request handler instance
+        violations: Non-empty list of SchemaViolation from a compiled schema
+    """
+    send_json_response(handler, HTTPStatus.BAD_REQUEST, {
+        "error": str(violations[0]),
+        "details": [violation._asdict() for violation in violations],
+    })
+
+
 def get_authenticated_user_id(handler):
     if not getattr(handler, "is_logged_in", False):
         return None
@@ -78,22 +203,172 @@ def get_authenticated_user_id(handler):
 # INTERNAL HANDLERS
 # ========================================
 
+def _is_etag_current(handler, etag):
+    """Whether the request's If-None-Match already names the etag."""
+    if_none_match = handler.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+def _cache_when_complete(chunks, key, version):
+    """Pass the chunks through, caching the whole body once it completes."""
+    parts = []
+    size = 0
+    for chunk in chunks:
+        if parts is not None:
+            size += len(chunk)
+            if size > tasks_list_cache.max_entry_bytes:
+                parts = None
+            else:
+                parts.append(chunk)
+        yield chunk
+    if parts is not None:
+        tasks_list_cache.put(key, version, b''.join(parts))
+
+
 def _get_tasks_list(handler, user_id):
     """GET /api/tasks?query=<string>"""
     try:
-        # Parse query parameters
-        parsed = urlparse(handler.path)
-        query_params = parse_qs(parsed.query)
+        # Parse query parameters, the firewall moves them out of handler.path
+        query_string = getattr(handler, 'parameters', None)
+        if query_string is None:
+            query_string = urlparse(handler.path).query
+        query_params = parse_qs(query_string)
         search_query = query_params.get('query', [None])[0]
         
-        # Fetch tasks from database
-        tasks = tasks_db.get_tasks(user_id=user_id, query=search_query)
+        # The version changes on every write, in any process, so the ETag can
+        # be checked before the cache or the tasks
+        cache_key = (user_id, search_query)
+        version = tasks_db.get_tasks_version(user_id)
+        etag = tasks_list_cache.etag(cache_key, version)
+        handler.response_headers['ETag'] = etag
+        handler.response_headers['Cache-Control'] = 'private, no-cache'
+        if _is_etag_current(handler, etag):
+            send_not_modified_response(handler)
+            return
+        
+        cached_body = tasks_list_cache.get(cache_key, version)
+        if cached_body is not None:
+            send_json_bytes(handler, HTTPStatus.OK, cached_body)
+            return
+        
+        # Tasks go from the cursor to the socket a batch at a time
+        if SQL_JSON_RESPONSES:
+            tasks = tasks_db.iter_tasks_json(user_id=user_id, query=search_query)
+            body = iter_json_object_with_encoded_array("tasks", tasks)
+        else:
+            tasks = tasks_db.iter_tasks(user_id=user_id, query=search_query)
+            body = iter_json_object_with_array("tasks", tasks)
+        body = buffer_chunks(body)
+        body = _cache_when_complete(body, cache_key, version)
+        
+        send_chunked_response(handler, HTTPStatus.OK, body, 'application/json')
+    except Exception as e:
+        handler.response_headers.pop('ETag', None)
+        handler.response_headers.pop('Cache-Control', None)
+        send_error_response(handler, HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
+
+
+def _get_tasks_export(handler, user_id):
+    """GET /api/tasks/export"""
+    try:
+        tasks = tasks_db.iter_tasks(user_id=user_id)
+        body = buffer_chunks(iter_ndjson(tasks))
         
-        send_json_response(handler, HTTPStatus.OK, {"tasks": tasks})
+        handler.response_headers['Content-Disposition'] = (
+            'attachment; filename="tasks.ndjson"'
+        )
+        send_chunked_response(handler, HTTPStatus.OK, body, 'application/x-ndjson')
     except Exception as e:
         send_error_response(handler, HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
 
 
+def _get_tasks_stream(handler, user_id):
+    """GET /api/tasks/stream, see backend/api/events.py"""
+    if not events.hub.has_room(user_id):
+        send_error_response(
+            handler, HTTPStatus.TOO_MANY_REQUESTS, "Too many open streams"
+        )
+        return
+    
+    handler.send_response(HTTPStatus.OK)
+    for header, value in handler.response_headers.items():
+        handler.send_header(header, value)
+    handler.send_header('Content-Type', 'text/event-stream')
+    handler.send_header('Cache-Control', 'no-cache')
+    # Proxies such as nginx would otherwise hold the events back
+    handler.send_header('X-Accel-Buffering', 'no')
+    handler.send_header('Connection', 'close')
+    handler.end_headers()
+    events.hub.subscribe(
+        user_id,
+        handler.hand_over_connection(),
+        handler.headers.get('Last-Event-ID'),
+    )
+
+
+def _parse_import_line(line):
+    """
+    Parse and validate one line of an NDJSON import.
+    
+    Returns:
+        (task, None) if the line is valid, else (None, error message)
+    """
+    if line is None:
+        return None, "Line is too long"
+    try:
+        task = json.loads(line)
+    except (ValueError, UnicodeDecodeError):
+        return None, "Invalid JSON"
+    violations = TASK_IMPORT_SCHEMA(task)
+    if violations:
+        return None, str(violations[0])
+    if not task['title'].strip():
+        return None, "Title is required"
+    return task, None
+
+
+def _post_tasks_import(handler, user_id):
+    """
+    POST /api/tasks/import
+    
+    Tasks are committed a batch at a time while the body is read. If reading it
+    fails partway, the tasks committed so far stay, and the error response is
+    the report with 'imported' counting them and 'error' saying what stopped the
+    import, so a client can retry with the lines after those.
+    """
+    report = {"imported": 0, "failed": 0, "errors": []}
+    handler.request_body.timeout = IMPORT_BODY_TIMEOUT
+    
+    def valid_tasks():
+        lines = handler.request_body.iter_lines(MAX_IMPORT_LINE_LENGTH)
+        for line_number, line in enumerate(lines, 1):
+            if line is not None and not line.strip():
+                continue
+            task, error = _parse_import_line(line)
+            if error is None:
+                yield task
+                continue
+            report["failed"] += 1
+            if len(report["errors"]) < MAX_REPORTED_IMPORT_ERRORS:
+                report["errors"].append({"line": line_number, "error": error})
+    
+    def committed(count):
+        report["imported"] += count
+    
+    try:
+        tasks_db.import_tasks(valid_tasks(), user_id=user_id, on_commit=committed)
+        send_json_response(handler, HTTPStatus.OK, report)
+    except RequestBodyError as e:
+        report["error"] = str(e)
+        send_json_response(handler, e.status, report)
+    except Exception as e:
+        report["error"] = str(e)
+        send_json_response(handler, HTTPStatus.INTERNAL_SERVER_ERROR, report)
+
+
 def _post_task_create(handler, user_id):
     """POST /api/tasks"""
     try:
@@ -102,20 +377,24 @@ def _post_task_create(handler, user_id):
             send_error_response(handler, HTTPStatus.BAD_REQUEST, "Invalid JSON")
             return
         
-        title = data.get('title', '').strip()
+        violations = TASK_CREATE_SCHEMA(data)
+        if violations:
+            send_schema_error_response(handler, violations)
+            return
+        
+        title = data['title'].strip()
         if not title:
             send_error_response(handler, HTTPStatus.BAD_REQUEST, "Title is required")
             return
         
         labels = data.get('labels', [])
-        if not isinstance(labels, list):
-            send_error_response(handler, HTTPStatus.BAD_REQUEST, "Labels must be an array")
-            return
         
         # Create task in database
         task = tasks_db.create_task(user_id=user_id, title=title, labels=labels)
         
         send_json_response(handler, HTTPStatus.CREATED, task)
+    except RequestBodyError as e:
+        send_error_response(handler, e.status, str(e))
     except ValueError as e:
         send_error_response(handler, HTTPStatus.BAD_REQUEST, str(e))
     except Exception as e:
@@ -130,24 +409,16 @@ def _patch_task_update(handler, task_id, user_id):
             send_error_response(handler, HTTPStatus.BAD_REQUEST, "Invalid JSON")
             return
         
+        violations = TASK_UPDATE_SCHEMA(data)
+        if violations:
+            send_schema_error_response(handler, violations)
+            return
+        
         # Extract update fields
         title = data.get('title')
         completed = data.get('completed')
         labels = data.get('labels')
         
-        # Validate types
-        if title is not None and not isinstance(title, str):
-            send_error_response(handler, HTTPStatus.BAD_REQUEST, "Title must be a string")
-            return
-        
-        if completed is not None and not isinstance(completed, bool):
-            send_error_response(handler, HTTPStatus.BAD_REQUEST, "Completed must be a boolean")
-            return
-        
-        if labels is not None and not isinstance(labels, list):
-            send_error_response(handler, HTTPStatus.BAD_REQUEST, "Labels must be an array")
-            return
-        
         # Update task in database
         task = tasks_db.update_task(
             task_id=task_id,
@@ -162,6 +433,8 @@ def _patch_task_update(handler, task_id, user_id):
             return
         
         send_json_response(handler, HTTPStatus.OK, task)
+    except RequestBodyError as e:
+        send_error_response(handler, e.status, str(e))
     except ValueError as e:
         send_error_response(handler, HTTPStatus.BAD_REQUEST, str(e))
     except Exception as e:
@@ -207,11 +480,26 @@ def api_tasks_handler(handler):
         _get_tasks_list(handler, user_id)
         return
     
+    # GET /api/tasks/export
+    if method == 'GET' and path == '/api/tasks/export':
+        _get_tasks_export(handler, user_id)
+        return
+    
+    # GET /api/tasks/stream
+    if method == 'GET' and path == '/api/tasks/stream':
+        _get_tasks_stream(handler, user_id)
+        return
+    
     # POST /api/tasks
     if method == 'POST' and path == '/api/tasks':
         _post_task_create(handler, user_id)
         return
     
+    # POST /api/tasks/import
+    if method == 'POST' and path == '/api/tasks/import':
+        _post_tasks_import(handler, user_id)
+        return
+    
     # PATCH /api/tasks/<id>
     if method == 'PATCH':
         match = re.match(r'^/api/tasks/(\d+)$', path)
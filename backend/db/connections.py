@@ -0,0 +1,278 @@
+"""
+The connections to the application database: one writer thread and a pool of
+read connections.
+
+SQLite allows one writer at a time. Every write is a function taking a connection,
+handed to Database.submit and run by the writer thread, which owns the only
+connection that writes. Writes queued while a batch runs make up the next batch
+(up to MAX_WRITE_BATCH): each runs in its own savepoint, so a failing write only
+undoes itself, and the batch is committed once. A burst of writes then costs one
+commit instead of one each, and no write waits on a lock held by another
+connection of this process, so writes queue in order instead of failing with
+'database is locked'.
+
+submit returns a concurrent.futures.Future, resolved with what the function
+returned once its batch is committed, or with what it raised. write() waits for it
+in threaded code, write_async() is awaited in asyncio code:
+
+    row = get_database().write(
+        lambda connection: connection.execute(sql, parameters).fetchone()
+    )
+
+Write functions must not commit or roll back, the writer does. They run in the
+context of the caller, so their statements are counted in its RequestAccounting.
+
+Reads use one of DB_READ_CONNECTIONS connections, opened when needed and set to
+query_only. The database is in WAL mode, so they see every committed write and
+neither blocks nor waits for the writer:
+
+    with get_database().read() as connection:
+        rows = connection.execute(sql, parameters).fetchall()
+"""
+
+import contextvars
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+from backend.db.timing import TimedConnection
+from backend.metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SQLITE3_PATH = "./data/todo.db"
+DEFAULT_READ_CONNECTIONS = 4
+MAX_WRITE_BATCH = 64
+# Seconds a connection waits for the lock of another process, such as the one
+# being replaced on a restart.
+BUSY_TIMEOUT = 5
+
+WRITE_WAIT = histogram(
+    "db_write_wait_seconds",
+    "Time from submitting a write to its batch being committed.",
+)
+WRITE_BATCH_SIZE = histogram(
+    "db_write_batch_size",
+    "Writes committed together by the writer thread.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+
+class DatabaseClosedError(RuntimeError):
+    """Raised when writing to a database that has been closed."""
+    pass
+
+
+def _connect(path: Path) -> TimedConnection:
+    connection = sqlite3.connect(
+        str(path),
+        factory=TimedConnection,
+        timeout=BUSY_TIMEOUT,
+        check_same_thread=False,
+    )
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+class _Write:
+    __slots__ = ("work", "future", "context", "submitted")
+
+    def __init__(self, work):
+        self.work = work
+        self.future = Future()
+        self.context = contextvars.copy_context()
+        self.submitted = perf_counter()
+
+
+class Database:
+    def __init__(self, path: str, *, read_connections: int | None = None):
+        self.path = Path(path).resolve()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not os.access(self.path.parent, os.W_OK):
+            raise RuntimeError(
+                f"No write permission for database directory: {self.path.parent}"
+            )
+        # Read here rather than on import, like SQLITE3_PATH in get_database.
+        if read_connections is None:
+            read_connections = int(
+                os.environ.get("DB_READ_CONNECTIONS", DEFAULT_READ_CONNECTIONS)
+            )
+        self.read_connections = max(1, read_connections)
+        self._writes = queue.Queue()
+        self._idle_readers = queue.LifoQueue()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        # Held while queueing, so no write is queued behind the closing sentinel.
+        self._closing_lock = threading.Lock()
+        self._closed = False
+        # Opened here so a database that can't be opened fails at startup.
+        self._writer_connection = _connect(self.path)
+        self._writer_connection.isolation_level = None
+        self._writer_connection.execute("PRAGMA journal_mode = WAL")
+        self._writer = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._writer.start()
+
+    # -- Writing
+    def submit(self, work) -> Future:
+        """Queues work(connection) for the writer thread."""
+        write = _Write(work)
+        with self._closing_lock:
+            if self._closed:
+                raise DatabaseClosedError("The database has been closed.")
+            self._writes.put(write)
+        return write.future
+
+    def write(self, work):
+        """Runs work(connection) on the writer thread, returning once committed."""
+        return self.submit(work).result()
+
+    async def write_async(self, work):
+        """write() for asyncio code, the event loop isn't blocked meanwhile."""
+        import asyncio
+
+        return await asyncio.wrap_future(self.submit(work))
+
+    def _run(self) -> None:
+        connection = self._writer_connection
+        while True:
+            write = self._writes.get()
+            if write is None:
+                break
+            batch = [write]
+            while len(batch) < MAX_WRITE_BATCH:
+                try:
+                    write = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if write is None:
+                    # Closing, the rest of the batch still gets committed.
+                    self._writes.put(None)
+                    break
+                batch.append(write)
+            # A write cancelled while queued (its write_async caller was) is
+            # skipped, its future can't be resolved anymore.
+            batch = [
+                write for write in batch
+                if write.future.set_running_or_notify_cancel()
+            ]
+            if batch:
+                self._run_batch(connection, batch)
+        connection.close()
+        # Nothing is queued after the sentinel, but a write left behind would
+        # never be answered, so it's failed rather than waited on forever.
+        while True:
+            try:
+                write = self._writes.get_nowait()
+            except queue.Empty:
+                break
+            if write is not None and write.future.set_running_or_notify_cancel():
+                write.future.set_exception(
+                    DatabaseClosedError("The database has been closed.")
+                )
+        return None
+
+    def _run_batch(self, connection: TimedConnection, batch: list) -> None:
+        results = []
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            for write in batch:
+                connection.execute("SAVEPOINT write")
+                try:
+                    results.append((write.context.run(write.work, connection), None))
+                except BaseException as err:
+                    connection.execute("ROLLBACK TO write")
+                    results.append((None, err))
+                connection.execute("RELEASE write")
+            connection.execute("COMMIT")
+        except BaseException as err:
+            logger.error("A batch of %s writes failed", len(batch), exc_info=True)
+            try:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+            except sqlite3.Error:
+                # The writer must outlive a broken batch, or every later write
+                # would wait forever.
+                logger.error("Rolling back the failed batch failed", exc_info=True)
+            results = [(None, err)] * len(batch)
+
+        WRITE_BATCH_SIZE.observe(len(batch))
+        committed = perf_counter()
+        for write, (result, error) in zip(batch, results):
+            WRITE_WAIT.observe(committed - write.submitted)
+            if error is None:
+                write.future.set_result(result)
+            else:
+                write.future.set_exception(error)
+        return None
+
+    # -- Reading
+    @contextmanager
+    def read(self):
+        """A read connection, returned to the pool after the with block."""
+        connection = self._acquire_reader()
+        try:
+            yield connection
+        finally:
+            if connection.in_transaction:
+                connection.rollback()
+            self._idle_readers.put(connection)
+
+    def _acquire_reader(self) -> TimedConnection:
+        try:
+            return self._idle_readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._readers_lock:
+            if len(self._readers) < self.read_connections:
+                connection = _connect(self.path)
+                connection.execute("PRAGMA query_only = ON")
+                self._readers.append(connection)
+                return connection
+        # Every connection is in use, the first one returned is taken.
+        return self._idle_readers.get()
+
+    # -- Closing
+    def close(self) -> None:
+        """Commits the queued writes, then closes every connection."""
+        with self._closing_lock:
+            if self._closed:
+                return None
+            self._closed = True
+            self._writes.put(None)
+        self._writer.join()
+        with self._readers_lock:
+            for connection in self._readers:
+                connection.close()
+            self._readers.clear()
+        return None
+
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def get_database() -> Database:
+    """The database at SQLITE3_PATH, opened on first use."""
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = Database(
+                    os.environ.get("SQLITE3_PATH", DEFAULT_SQLITE3_PATH)
+                )
+    return _database
+
+
+def close_database() -> None:
+    """Commits the queued writes and closes the database, on shutdown."""
+    global _database
+    with _database_lock:
+        if _database is not None:
+            _database.close()
+            _database = None
+    return None
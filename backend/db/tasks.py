@@ -11,6 +11,9 @@ import os
 from datetime import datetime
 from pathlib import Path
 
+from backend.db.connections import get_database
+from backend.db.timing import TimedConnection
+
 
 def get_db_path():
     """Get database path from environment or use default."""
@@ -18,18 +21,36 @@ def get_db_path():
 
 
 def get_connection():
-    """Get a database connection."""
+    """
+    Get a connection of its own, for scripts and benchmarks. The server reads and
+    writes through backend.db.connections.
+    """
     db_path = get_db_path()
     Path(db_path).parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+# Called with (action, user_id, task) after a write has been committed. The action
+# is 'create', 'update', 'delete' or 'import'. The task is the task dictionary,
+# only {"id": task_id} for deletes, and None for imports.
+_change_listeners = []
+
+
+def add_change_listener(listener):
+    """Register a callable that is notified of every committed task change."""
+    _change_listeners.append(listener)
+
+
+def _notify_change(action, user_id, task):
+    for listener in _change_listeners:
+        listener(action, user_id, task)
+
+
 def init_tasks_table():
-    """Create tasks table if it doesn't exist."""
-    conn = get_connection()
-    try:
+    """Create the tasks and task_versions tables if they don't exist."""
+    def create(conn):
         conn.execute("""
             CREATE TABLE IF NOT EXISTS tasks (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -41,15 +62,165 @@ def init_tasks_table():
                 updated_at TEXT NOT NULL
             )
         """)
-        conn.commit()
-    finally:
-        conn.close()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS task_versions (
+                user_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        """)
+    
+    get_database().write(create)
+
+
+# -- Versions
+# Every change of a user's tasks bumps their version in the same transaction, so
+# it's the same in every process using the database, unlike change listeners.
+
+def _bump_version(conn, user_id):
+    conn.execute("""
+        INSERT INTO task_versions (user_id, version) VALUES (?, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+    """, [user_id])
+
+
+def get_tasks_version(user_id):
+    """
+    Get the version of a user's tasks, which changes whenever they do.
+    
+    Args:
+        user_id: User ID
+    
+    Returns:
+        The version, 0 if the user's tasks never changed
+    """
+    with get_database().read() as conn:
+        row = conn.execute(
+            "SELECT version FROM task_versions WHERE user_id = ?", [user_id]
+        ).fetchone()
+    return row[0] if row else 0
+
+
+def row_to_task(row):
+    """Convert a tasks row into the task dictionary sent to clients."""
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "completed": bool(row["completed"]),
+        "labels": json.loads(row["labels_json"]) if row["labels_json"] else [],
+        "createdAt": row["created_at"],
+        "updatedAt": row["updated_at"]
+    }
+
+
+def _tasks_query(columns, user_id, query):
+    """The SELECT of a user's tasks, optionally filtered by query, in list order."""
+    sql = f"""
+        SELECT {columns}
+        FROM tasks
+        WHERE user_id = ?
+    """
+    params = [user_id]
+    
+    if query:
+        sql += """ AND (
+            title LIKE ? OR labels_json LIKE ?
+        )"""
+        search_term = f"%{query}%"
+        params.extend([search_term, search_term])
+    
+    # Sort: incomplete first, then by created_at DESC within each group
+    sql += """
+        ORDER BY completed ASC, created_at DESC
+    """
+    return sql, params
+
+
+def iter_tasks(user_id=1, query=None):
+    """
+    Yield the tasks of a user one at a time, optionally filtered by query.
+    
+    Rows are read from the cursor as they are consumed, so memory use doesn't
+    grow with the number of tasks. The read connection is returned to the pool
+    once the generator is exhausted or closed.
+    
+    Args:
+        user_id: User ID (default 1)
+        query: Optional search string to filter by title or labels
+    
+    Yields:
+        Task dictionaries sorted by completion status and date
+    """
+    sql, params = _tasks_query(
+        "id, user_id, title, labels_json, completed, created_at, updated_at",
+        user_id,
+        query,
+    )
+    with get_database().read() as conn:
+        for row in conn.execute(sql, params):
+            yield row_to_task(row)
+
+
+# The task dictionary of row_to_task, encoded by SQLite. labels_json is already
+# JSON, so json() passes it through instead of it being decoded and encoded again.
+TASK_JSON_COLUMN = """
+    json_object(
+        'id', id,
+        'title', title,
+        'completed', json(CASE WHEN completed THEN 'true' ELSE 'false' END),
+        'labels', json(CASE WHEN labels_json = '' THEN '[]' ELSE labels_json END),
+        'createdAt', created_at,
+        'updatedAt', updated_at
+    )
+"""
+# About one STREAM_BUFFER_SIZE chunk of tasks.
+TASK_JSON_BATCH_SIZE = 100
+
+
+def _has_json_functions():
+    try:
+        sqlite3.connect(":memory:").execute("SELECT json_object('a', 1)").close()
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+# SQLite has the JSON functions built in since 3.38, older builds may lack them.
+HAS_JSON_FUNCTIONS = _has_json_functions()
+
+
+def iter_tasks_json(user_id=1, query=None, batch_size=TASK_JSON_BATCH_SIZE):
+    """
+    Yield the tasks of a user as JSON encoded by SQLite, optionally filtered by
+    query. The same tasks in the same order as iter_tasks, without a Python
+    object per task.
+    
+    Args:
+        user_id: User ID (default 1)
+        query: Optional search string to filter by title or labels
+        batch_size: Tasks fetched from the cursor at a time
+    
+    Yields:
+        bytes, the JSON objects of up to batch_size tasks separated by commas
+    """
+    sql, params = _tasks_query(TASK_JSON_COLUMN, user_id, query)
+    with get_database().read() as conn:
+        cursor = conn.cursor()
+        # Plain tuples, the single column is all there is
+        cursor.row_factory = None
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield ",".join([row[0] for row in rows]).encode('utf-8')
 
 
 def get_tasks(user_id=1, query=None):
     """
     Get all tasks for a user, optionally filtered by query.
     
+    Prefer iter_tasks for responses, this holds every task in memory.
+    
     Args:
         user_id: User ID (default 1)
         query: Optional search string to filter by title or labels
@@ -57,45 +228,7 @@ def get_tasks(user_id=1, query=None):
     Returns:
         List of task dictionaries sorted by completion status and date
     """
-    conn = get_connection()
-    try:
-        sql = """
-            SELECT id, user_id, title, labels_json, completed, created_at, updated_at
-            FROM tasks
-            WHERE user_id = ?
-        """
-        params = [user_id]
-        
-        if query:
-            sql += """ AND (
-                title LIKE ? OR labels_json LIKE ?
-            )"""
-            search_term = f"%{query}%"
-            params.extend([search_term, search_term])
-        
-        # Sort: incomplete first, then by created_at DESC within each group
-        sql += """
-            ORDER BY completed ASC, created_at DESC
-        """
-        
-        cursor = conn.execute(sql, params)
-        rows = cursor.fetchall()
-        
-        tasks = []
-        for row in rows:
-            task = {
-                "id": row["id"],
-                "title": row["title"],
-                "completed": bool(row["completed"]),
-                "labels": json.loads(row["labels_json"]) if row["labels_json"] else [],
-                "createdAt": row["created_at"],
-                "updatedAt": row["updated_at"]
-            }
-            tasks.append(task)
-        
-        return tasks
-    finally:
-        conn.close()
+    return list(iter_tasks(user_id=user_id, query=query))
 
 
 def create_task(user_id=1, title="", labels=None):
@@ -113,36 +246,87 @@ def create_task(user_id=1, title="", labels=None):
     if not title or not title.strip():
         raise ValueError("Task title cannot be empty")
     
-    conn = get_connection()
-    try:
-        now = datetime.utcnow().isoformat() + "Z"
-        labels_json = json.dumps(labels if labels else [])
-        
+    now = datetime.utcnow().isoformat() + "Z"
+    labels_json = json.dumps(labels if labels else [])
+    
+    def insert(conn):
         cursor = conn.execute("""
             INSERT INTO tasks (user_id, title, labels_json, completed, created_at, updated_at)
             VALUES (?, ?, ?, 0, ?, ?)
         """, [user_id, title.strip(), labels_json, now, now])
-        
-        conn.commit()
-        task_id = cursor.lastrowid
+        _bump_version(conn, user_id)
         
         # Fetch the created task
-        cursor = conn.execute("""
+        return conn.execute("""
             SELECT id, user_id, title, labels_json, completed, created_at, updated_at
             FROM tasks WHERE id = ?
-        """, [task_id])
-        
-        row = cursor.fetchone()
-        return {
-            "id": row["id"],
-            "title": row["title"],
-            "completed": bool(row["completed"]),
-            "labels": json.loads(row["labels_json"]),
-            "createdAt": row["created_at"],
-            "updatedAt": row["updated_at"]
-        }
+        """, [cursor.lastrowid]).fetchone()
+    
+    task = row_to_task(get_database().write(insert))
+    _notify_change("create", user_id, task)
+    return task
+
+
+def import_tasks(tasks, user_id=1, batch_size=1000, on_commit=None):
+    """
+    Insert many tasks, committing them in batches.
+    
+    Tasks are consumed from the iterable as they are inserted, so only one batch
+    is held in memory at a time. The tasks must already be validated. If the
+    iterable raises, the batches committed before stay committed and the batch
+    being collected is dropped.
+    
+    Args:
+        tasks: Iterable of task dictionaries in the exported format
+        user_id: User ID (default 1)
+        batch_size: Number of tasks per transaction
+        on_commit: Called with the number of tasks of every committed batch
+    
+    Returns:
+        Number of tasks inserted
+    """
+    now = datetime.utcnow().isoformat() + "Z"
+    imported = 0
+    batch = []
+    try:
+        for task in tasks:
+            created_at = task.get("createdAt") or now
+            batch.append((
+                user_id,
+                task["title"].strip(),
+                json.dumps(task.get("labels") or []),
+                1 if task.get("completed") else 0,
+                created_at,
+                task.get("updatedAt") or created_at,
+            ))
+            if len(batch) >= batch_size:
+                _insert_task_rows(batch, user_id)
+                imported += len(batch)
+                if on_commit is not None:
+                    on_commit(len(batch))
+                batch = []
+        if batch:
+            _insert_task_rows(batch, user_id)
+            imported += len(batch)
+            if on_commit is not None:
+                on_commit(len(batch))
     finally:
-        conn.close()
+        # Batches are committed as they go, so a failed import is still a change
+        if imported:
+            _notify_change("import", user_id, None)
+    return imported
+
+
+def _insert_task_rows(rows, user_id):
+    """Insert a user's task rows in a single transaction."""
+    def insert(conn):
+        conn.executemany("""
+            INSERT INTO tasks (user_id, title, labels_json, completed, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+        _bump_version(conn, user_id)
+    
+    get_database().write(insert)
 
 
 def update_task(task_id, user_id=1, title=None, completed=None, labels=None):
@@ -159,15 +343,14 @@ def update_task(task_id, user_id=1, title=None, completed=None, labels=None):
     Returns:
         Updated task dictionary or None if not found
     """
-    conn = get_connection()
-    try:
+    def update(conn):
         # Check if task exists and belongs to user
         cursor = conn.execute("""
             SELECT id FROM tasks WHERE id = ? AND user_id = ?
         """, [task_id, user_id])
         
         if not cursor.fetchone():
-            return None
+            return None, False
         
         # Build update query dynamically
         updates = []
@@ -187,56 +370,37 @@ def update_task(task_id, user_id=1, title=None, completed=None, labels=None):
             updates.append("labels_json = ?")
             params.append(json.dumps(labels))
         
-        if not updates:
-            # No updates, just return current task
-            cursor = conn.execute("""
-                SELECT id, user_id, title, labels_json, completed, created_at, updated_at
-                FROM tasks WHERE id = ?
-            """, [task_id])
-            row = cursor.fetchone()
-            return {
-                "id": row["id"],
-                "title": row["title"],
-                "completed": bool(row["completed"]),
-                "labels": json.loads(row["labels_json"]),
-                "createdAt": row["created_at"],
-                "updatedAt": row["updated_at"]
-            }
-        
-        # Update timestamp
-        now = datetime.utcnow().isoformat() + "Z"
-        updates.append("updated_at = ?")
-        params.append(now)
-        
-        # Add WHERE clause params
-        params.extend([task_id, user_id])
-        
-        sql = f"""
-            UPDATE tasks
-            SET {', '.join(updates)}
-            WHERE id = ? AND user_id = ?
-        """
+        if updates:
+            # Update timestamp
+            now = datetime.utcnow().isoformat() + "Z"
+            updates.append("updated_at = ?")
+            params.append(now)
+            
+            # Add WHERE clause params
+            params.extend([task_id, user_id])
+            
+            sql = f"""
+                UPDATE tasks
+                SET {', '.join(updates)}
+                WHERE id = ? AND user_id = ?
+            """
+            conn.execute(sql, params)
+            _bump_version(conn, user_id)
         
-        conn.execute(sql, params)
-        conn.commit()
-        
-        # Fetch updated task
+        # Fetch updated task, or the current one if there were no updates
         cursor = conn.execute("""
             SELECT id, user_id, title, labels_json, completed, created_at, updated_at
             FROM tasks WHERE id = ?
         """, [task_id])
-        
-        row = cursor.fetchone()
-        return {
-            "id": row["id"],
-            "title": row["title"],
-            "completed": bool(row["completed"]),
-            "labels": json.loads(row["labels_json"]),
-            "createdAt": row["created_at"],
-            "updatedAt": row["updated_at"]
-        }
-    finally:
-        conn.close()
+        return cursor.fetchone(), bool(updates)
+    
+    row, updated = get_database().write(update)
+    if row is None:
+        return None
+    task = row_to_task(row)
+    if updated:
+        _notify_change("update", user_id, task)
+    return task
 
 
 def delete_task(task_id, user_id=1):
@@ -250,18 +414,18 @@ def delete_task(task_id, user_id=1):
     Returns:
         True if deleted, False if not found
     """
-    conn = get_connection()
-    try:
-        cursor = conn.execute("""
+    def delete(conn):
+        deleted = conn.execute("""
             DELETE FROM tasks
             WHERE id = ? AND user_id = ?
-        """, [task_id, user_id])
-        
-        conn.commit()
-        return cursor.rowcount > 0
-    finally:
-        conn.close()
-
-
-# Initialize table on module import
-init_tasks_table()
+        """, [task_id, user_id]).rowcount
+        if deleted:
+            _bump_version(conn, user_id)
+        return deleted
+    
+    deleted = get_database().write(delete)
+    
+    if deleted > 0:
+        _notify_change("delete", user_id, {"id": task_id})
+        return True
+    return False
@@ -0,0 +1,215 @@
+"""
+sqlite3 connections that time every statement they execute.
+
+Pass factory=TimedConnection to sqlite3.connect. Every database access goes
+through one, both the dbWrapper helpers and backend/db/tasks.py, and its cursors,
+including the ones Connection.execute creates, record how long each statement
+takes:
+- in the sqlite_query_duration_seconds histogram,
+- in the accounting of the request being handled,
+- in per-statement totals, see top_statements,
+- and in the slow query log when it took SLOW_QUERY_THRESHOLD_MS or longer. The
+  first time a statement is slow, its EXPLAIN QUERY PLAN is logged with it.
+
+Statements are grouped by their shape, the SQL with whitespace collapsed and any
+literal values replaced by '?', so statements that only differ in inlined values
+count as one. Parameters are only logged as their types, never their values.
+
+Only execute() is timed. SQLite produces the rest of the rows of a SELECT while
+they are fetched, which isn't included.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+from time import perf_counter
+
+from backend.accounting import note_sql
+from backend.metrics import histogram
+
+logger = logging.getLogger("backend.db.slow_queries")
+
+SLOW_QUERY_THRESHOLD = (
+    float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", "100")) / 1000
+)
+# Different shapes kept in the totals, so dynamic SQL can't grow them forever.
+MAX_SHAPES = 1000
+
+OPERATIONS = frozenset(
+    {"select", "insert", "update", "delete", "create", "replace"}
+)
+
+SQL_DURATION = histogram(
+    "sqlite_query_duration_seconds",
+    "Time spent executing SQLite statements, until their first row.",
+    ("operation",),
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0),
+)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def statement_operation(sql: str) -> str:
+    """The lowercased first keyword of the statement, 'other' for anything not in
+    OPERATIONS. Keeps the label values few."""
+    words = sql.split(None, 1)
+    if not words:
+        return "other"
+    keyword = words[0].lower()
+    return keyword if keyword in OPERATIONS else "other"
+
+
+# The same few statements run over and over, so their shapes are cached.
+@lru_cache(maxsize=MAX_SHAPES)
+def statement_shape(sql: str) -> str:
+    """The statement with its whitespace collapsed and literals replaced by '?'."""
+    return _LITERALS.sub("?", " ".join(sql.split()))
+
+
+def parameters_shape(parameters) -> str:
+    """The types of the bound parameters, like '(int, str)' or '{id: int}'."""
+    if isinstance(parameters, dict):
+        types = (
+            f"{name}: {type(value).__name__}" for name, value in parameters.items()
+        )
+        return "{" + ", ".join(types) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return "(many)"
+
+
+class _StatementTotals:
+    """Count, total and slowest time of every statement shape."""
+
+    def __init__(self):
+        self._totals = {}  # shape -> [count, total seconds, max seconds]
+        self._explained = set()
+        self._lock = threading.Lock()
+
+    def add(self, shape: str, duration: float) -> None:
+        with self._lock:
+            totals = self._totals.get(shape)
+            if totals is None:
+                if len(self._totals) >= MAX_SHAPES:
+                    return None
+                totals = self._totals[shape] = [0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += duration
+            if duration > totals[2]:
+                totals[2] = duration
+        return None
+
+    def first_time_slow(self, shape: str) -> bool:
+        """True only the first time it's called for the shape."""
+        with self._lock:
+            if shape in self._explained or len(self._explained) >= MAX_SHAPES:
+                return False
+            self._explained.add(shape)
+            return True
+
+    def top(self, limit: int) -> list:
+        with self._lock:
+            items = [(shape, *totals) for shape, totals in self._totals.items()]
+        items.sort(key=lambda item: item[2], reverse=True)
+        return [
+            {
+                "statement": shape,
+                "count": count,
+                "total_ms": round(total * 1000, 3),
+                "mean_ms": round(total / count * 1000, 3),
+                "max_ms": round(slowest * 1000, 3),
+            }
+            for shape, count, total, slowest in items[:limit]
+        ]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals.clear()
+            self._explained.clear()
+        return None
+
+
+statement_totals = _StatementTotals()
+
+
+def top_statements(limit: int = 20) -> list:
+    """The statement shapes that took the most time in total, slowest first."""
+    return statement_totals.top(limit)
+
+
+def explain(connection: sqlite3.Connection, sql: str, parameters=()) -> str:
+    """
+    The EXPLAIN QUERY PLAN of the statement with the parameters, one step per
+    line. Empty if the statement can't be explained.
+    """
+    try:
+        # A plain cursor, so the EXPLAIN itself isn't timed.
+        rows = sqlite3.Connection.cursor(connection).execute(
+            f"EXPLAIN QUERY PLAN {sql}", parameters
+        ).fetchall()
+    except sqlite3.Error:
+        return ""
+    depths = {0: -1}
+    lines = []
+    for step, parent, _, detail in rows:
+        depths[step] = depths.get(parent, -1) + 1
+        lines.append("  " * depths[step] + detail)
+    return "\n".join(lines)
+
+
+def _record(cursor: sqlite3.Cursor, sql: str, parameters, duration: float) -> None:
+    SQL_DURATION.labels(statement_operation(sql)).observe(duration)
+    note_sql(sql, duration)
+    shape = statement_shape(sql)
+    statement_totals.add(shape, duration)
+    if duration < SLOW_QUERY_THRESHOLD:
+        return None
+    # Statements run by executemany have no single set of parameters to explain.
+    if parameters is not None and statement_totals.first_time_slow(shape):
+        logger.warning(
+            "Slow query (%.1fms) %s %s\nQuery plan:\n%s",
+            duration * 1000,
+            shape,
+            parameters_shape(parameters),
+            explain(cursor.connection, sql, parameters) or "unavailable",
+        )
+    else:
+        logger.warning(
+            "Slow query (%.1fms) %s %s",
+            duration * 1000,
+            shape,
+            parameters_shape(parameters),
+        )
+    return None
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=(), /):
+        start = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(self, sql, parameters, perf_counter() - start)
+
+    def executemany(self, sql, parameters, /):
+        start = perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            # The parameters may be a generator that was used up.
+            _record(self, sql, None, perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute doesn't go through cursor(), so these are routed there.
+    def execute(self, sql, parameters=(), /):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters, /):
+        return self.cursor().executemany(sql, parameters)
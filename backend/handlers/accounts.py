@@ -1,10 +1,10 @@
+from __future__ import annotations
+
 from sqlite3 import (
     Error as SqlErr,
     IntegrityError as SqlIntegrityErr,
 )
 from secrets import token_urlsafe
-import bcrypt
-import email_validator
 import json
 from backend.handlers.dbWrapper import (
     server_interact_with_row,
@@ -16,9 +16,11 @@ from backend.handlers.dbWrapper import (
 import logging
 from http import HTTPStatus
 from typing import TYPE_CHECKING
-from valid8r import from_type, Maybe
 import string
-from backend.router.firewall import ROLES 
+from backend.router.firewall import ROLES
+from backend.schema import compile_schema, CompiledSchema, ListOf, MapOf
+from backend.metrics import histogram
+from time import perf_counter
 
 if TYPE_CHECKING:
     from backend.router.RequestHandler import request_handler
@@ -30,35 +32,39 @@ USER_FIELDS = {"user_email", "user_password", "username"}
 PASSWORD_MAX_LENGTH, USERNAME_MAX_LENGTH = 30, 30
 PASSWORD_MIN_LENGTH, USERNAME_MIN_LENGTH = 8, 3
 
+# Schemas are compiled once here, not per request.
+ACCOUNT_SCHEMA = compile_schema(
+    {"email": str, "username": str, "password": str}
+)
+SESSION_SCHEMA = compile_schema({"email": str, "password": str})
+# field: [new_value, old_value]
+ACCOUNT_UPDATE_SCHEMA = compile_schema(
+    MapOf(ListOf(str, min_length=2, max_length=2), max_length=len(USER_FIELDS))
+)
+
 
 def server_validate_schema(
-    self, annotation, *, send_failure_message=True
-) -> None | Maybe:
+    self, schema: CompiledSchema, *, send_failure_message=True
+) -> None | dict | list:
     """
-    Validates the schema, sending an HTTP response on failure.
-    Returns None.
+    Validates the parsed request body against the compiled schema, sending an
+    HTTP response on failure.
+    Returns the parsed request body if it's valid, else returns None.
     """
-    parser = from_type(annotation)
-    # Implement a schema validator yourself to avoid all these annoyances and
-    # preformance issues, # UPDATE
-    result = parser(json.dumps(self.parsed_request_body))
-    if result.value_or(None) is None:
-        logger.debug("Schema failed")
-        print("Class A")
-        if send_failure_message:
-            self.send_http_response(
-                HTTPStatus.BAD_REQUEST, result.error_or("")
-            )
-            return None
-        else:
-            self.send_http_response(HTTPStatus.BAD_REQUEST)
-            return None
-    print("Class B")
-    return result
+    violations = schema(self.parsed_request_body)
+    if not violations:
+        return self.parsed_request_body
+    logger.debug("Schema failed: %s", violations)
+    if send_failure_message:
+        self.send_http_response(
+            HTTPStatus.BAD_REQUEST, "\n".join(map(str, violations))
+        )
+        return None
+    self.send_http_response(HTTPStatus.BAD_REQUEST)
+    return None
 
 
 def invalid_information(self, msg: str = "Invalid Information"):
-    print("bruh")
     destroy_session(self)
     self.send_http_response(HTTPStatus.BAD_REQUEST, msg)
     return None
@@ -78,13 +84,15 @@ def post_account_handler(self: request_handler) -> None:
     >>> }
     """
 
+    if server_validate_schema(self, ACCOUNT_SCHEMA) is None:
+        return None
+
     try:
         user_email: str = self.parsed_request_body["email"].strip().lower()
         username: str = self.parsed_request_body["username"].strip()
         user_password: str = self.parsed_request_body["password"].strip()
     except (KeyError, ValueError, TypeError) as err:
-        print("Failed")
-        print(err)
+        logger.debug("Account fields could not be read: %s", err)
         invalid_information(self)
         return None
 
@@ -93,13 +101,11 @@ def post_account_handler(self: request_handler) -> None:
         or not is_valid_username(username)
         or not is_valid_password(user_password)
     ):
-        print("Hmmm")
+        logger.debug("Account fields are not valid")
         invalid_information(self)
         return None
 
-    user_password = bcrypt.hashpw(
-        user_password.encode(), bcrypt.gensalt()
-    ).decode()
+    user_password = hash_password(user_password)
 
     # --- Creating the account
     server_insert_row(
@@ -124,11 +130,7 @@ def post_session_handler(self: request_handler) -> None:
     >>> }
     """
 
-    if server_validate_schema(self, dict[str, str]) is None:
-        return None
-
-    if len(self.parsed_request_body) > 2:
-        invalid_information(self)
+    if server_validate_schema(self, SESSION_SCHEMA) is None:
         return None
 
     try:
@@ -147,7 +149,7 @@ def post_session_handler(self: request_handler) -> None:
         return None
     stored_password = results["password"]
 
-    if bcrypt.checkpw(target_password.encode(), stored_password.encode()):
+    if check_password(target_password, stored_password):
         if create_session(self, target_email):
             self.send_http_response(HTTPStatus.CREATED)
             return None
@@ -181,6 +183,37 @@ def get_account_handler(self: request_handler) -> None:
     return None
 
 
+# bcrypt runs on the thread handling the request, so this is how long requests wait
+# on it.
+BCRYPT_DURATION = histogram(
+    "bcrypt_duration_seconds",
+    "Time spent hashing and checking passwords, by operation.",
+    ("operation",),
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0),
+)
+
+
+def hash_password(password: str) -> str:
+    # Imported on first use, backend.startup preloads it once the server is up.
+    import bcrypt
+
+    start = perf_counter()
+    try:
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    finally:
+        BCRYPT_DURATION.labels("hash").observe(perf_counter() - start)
+
+
+def check_password(password: str, stored_password: str) -> bool:
+    import bcrypt
+
+    start = perf_counter()
+    try:
+        return bcrypt.checkpw(password.encode(), stored_password.encode())
+    finally:
+        BCRYPT_DURATION.labels("check").observe(perf_counter() - start)
+
+
 def patch_account_handler(self: request_handler) -> None:
     """
     ### Expected Schema:
@@ -190,7 +223,7 @@ def patch_account_handler(self: request_handler) -> None:
     >>> }
     """
 
-    if server_validate_schema(self, dict[str, list[str, str]]) is None:
+    if server_validate_schema(self, ACCOUNT_UPDATE_SCHEMA) is None:
         return None
 
     fields = list(self.parsed_request_body.keys())
@@ -204,12 +237,8 @@ def patch_account_handler(self: request_handler) -> None:
         pass_idx = fields.index("password")
         if not is_valid_password(new_values[pass_idx]):
             self.send_http_response(HTTPStatus.BAD_REQUEST)
-        old_values[pass_idx] = bcrypt.hashpw(
-            old_values[pass_idx].encode, bcrypt.gensalt()
-        ).decode()
-        new_values[pass_idx] = bcrypt.hashpw(
-            new_values[pass_idx].encode, bcrypt.gensalt()
-        ).decode()
+        old_values[pass_idx] = hash_password(old_values[pass_idx])
+        new_values[pass_idx] = hash_password(new_values[pass_idx])
 
     if "username" in fields:
         username_idx = fields.index("username")
@@ -321,22 +350,18 @@ def is_valid_username(username: str) -> bool:
     """
     if not isinstance(username, str):
         logger.debug("Username is not valid")
-        print("Username is not valid instance(username, str):")
         return False
     if (
         len(username) > USERNAME_MAX_LENGTH
         or len(username) < USERNAME_MIN_LENGTH
     ):
         logger.debug("Username is not valid")
-        print("Username is not valid ername) > USERNAME_MAX_LENGTH or")
         return False
     for char in username:
         if char not in VALID_USERNAME_CHARACTERS:
             logger.debug("Username is not valid")
-            print("Username is not valid ername.isalnum() and not")
             return False
     logger.debug("Username is valid")
-    print("valid user")
     return True
 
 
@@ -363,21 +388,21 @@ def is_valid_password(password: str) -> bool:
     for char in password:
         if char not in VALID_PASSWORD_CHARACTERS:
             logger.debug("Password is not valid")
-            print("Password is not valid ername.isalnum() and not")
             return False
     logger.debug("Password is valid")
-    print("Valid pass")
     return True
 
 
 def is_valid_email(email: str) -> bool:
+    # Imported on first use since importing it takes tens of milliseconds.
+    import email_validator
+
     if not isinstance(email, str):
         logger.debug("Email is not valid")
         return False
     try:
         email_validator.validate_email(email)
         logger.debug("Email is valid")
-        print("Valid mail")
         return True
     except email_validator.EmailNotValidError:
         logger.debug("Email is not valid")
@@ -3,62 +3,39 @@ from sqlite3 import (
     Row,
     Error as SqlErr,
     IntegrityError as SqlIntegrityErr,
-    connect,
-    Cursor,
 )
 import logging
 from http import HTTPStatus
-from dotenv import load_dotenv
-from os import environ
-from os.path import dirname
-import os
-from pathlib import Path
+from backend.db.connections import get_database
 
-load_dotenv(dirname(__file__) + r"\..\..\.env")
 logger = logging.getLogger(__name__)
 
-# Get database path from environment with default fallback
-SQLITE3_PATH = environ.get("SQLITE3_PATH", "./data/todo.db")
-
-# Validate database path and ensure directory exists
-try:
-    db_path = Path(SQLITE3_PATH).resolve()
-    db_path.parent.mkdir(parents=True, exist_ok=True)
-    
-    if not os.access(db_path.parent, os.W_OK):
-        raise RuntimeError(f"No write permission for database directory: {db_path.parent}")
-    
-    db = connect(str(db_path))
-except Exception as e:
-    logger.error(f"Failed to initialize database at {SQLITE3_PATH}: {e}")
-    raise
-
-db.row_factory = Row
-cursor = db.cursor()
+# Reads go through the read connections of backend.db.connections and writes
+# through its writer thread, see there. Nothing is opened on import, so importing
+# the handlers stays cheap.
 
 
 def init_accounts_table() -> None:
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS accounts (
-            session_id TEXT UNIQUE,
-            password TEXT NOT NULL,
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT NOT NULL UNIQUE,
-            username TEXT NOT NULL UNIQUE,
-            creation_time INTEGER NOT NULL DEFAULT(strftime('%s', 'now')),
-            session_id_creation_time INTEGER,
-            role INTEGER NOT NULL DEFAULT 1,
-            labels TEXT
+    get_database().write(
+        lambda connection: connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS accounts (
+                session_id TEXT UNIQUE,
+                password TEXT NOT NULL,
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT NOT NULL UNIQUE,
+                username TEXT NOT NULL UNIQUE,
+                creation_time INTEGER NOT NULL DEFAULT(strftime('%s', 'now')),
+                session_id_creation_time INTEGER,
+                role INTEGER NOT NULL DEFAULT 1,
+                labels TEXT
+            )
+            """
         )
-        """
     )
-    db.commit()
-
+    return None
 
-init_accounts_table()
 
-# UPDATE: ADD BUFFERING FOR DB TRANSACTIONS (backendMemory["DBBuffer"], executemany())
 # UPDATE: ADD LOGGING FOR DB TRANSACTIONS (logger) -- also configure it
 
 
@@ -67,21 +44,22 @@ def interact_with_row(
     column: str,
     identifier: Any,
     action: Literal["delete", "select"],
-) -> Cursor:
+) -> list[Row]:
     """Wrapper for interacting with rows.
-    Returns the cursor.
+    Returns the rows.
 
     This does not enforce correctness. The caller is still responsible for passing in
     valid information. This will log errors then propagate them.
     """
+    sql = f"{action} * FROM {table} WHERE {column} = ?"
     try:
-        cursor.execute(
-            f"{action} * FROM {table} WHERE {column} = ?", (identifier,)
+        if action == "select":
+            with get_database().read() as connection:
+                return connection.execute(sql, (identifier,)).fetchall()
+        return get_database().write(
+            lambda connection: connection.execute(sql, (identifier,)).fetchall()
         )
-        db.commit()
-        return cursor
     except SqlErr as err:
-        db.rollback()
         logger.error(
             f"Experienced an SQL error while doing {action} on a row",
             exc_info=True,
@@ -114,9 +92,11 @@ def update_cells(
         execution_append = (
             f"AND {second_search_column} = {second_search_value}"
         )
-    try:
+
+    def update(connection) -> None:
+        # Every cell is updated, or none of them
         for i in range(len(value)):
-            cursor.execute(
+            cursor = connection.execute(
                 f"UPDATE {table} SET {column[i]} = ? WHERE {search_column[i]} = ?"
                 f"{execution_append}",
                 (value[i], search_value[i]),
@@ -125,10 +105,14 @@ def update_cells(
                 raise ValueError(
                     f"{search_value[i]} couldn't be found in {search_column[i]}"
                 )
-        db.commit()
         return None
+
+    try:
+        get_database().write(update)
+        return None
+    except SqlIntegrityErr:
+        raise
     except SqlErr as err:
-        db.rollback()
         logger.error(
             "Experienced an SQL error while updating cells", exc_info=True
         )
@@ -155,58 +139,39 @@ def update_cell(
     This does not enforce correctness. The caller is still responsible for
     passing in valid information. This will log errors then propogate them.
     """
-    execution_append = ""
-    if second_search_column is not None:
-        execution_append = (
-            f"AND {second_search_column} = {second_search_value}"
-        )
-    try:
-        cursor.execute(
-            f"UPDATE {table} SET {column} = ? WHERE {search_column} = ?"
-            f"{execution_append}",
-            (value, search_value),
-        )
-        if strict and len(cursor.fetchall()) > 1:
-            raise ValueError(
-                f"{search_value} couldn't be found in {search_column}"
-            )
-        db.commit()
-        return None
-    except SqlIntegrityErr:
-        db.rollback()
-        raise err
-    except SqlErr as err:
-        db.rollback()
-        logger.error(
-            "Experienced an SQL error while updating cells", exc_info=True
-        )
-        raise err
+    update_cells(
+        table,
+        [search_column],
+        [search_value],
+        [column],
+        [value],
+        strict=strict,
+        second_search_column=second_search_column,
+        second_search_value=second_search_value,
+    )
+    return None
 
 
 def insert_row(
     table: str, columns: tuple[str], values: tuple[Any, ...]
-) -> Cursor:
-    """Wrapper for adding rows
+) -> list[Row]:
+    """Wrapper for adding rows. Returns the rows of the statement.
 
     This does not enforce correctness. The caller is still responsible for passing in
     valid information. This will log errors then propogate them.
     """
+    if len(columns) != len(values):
+        raise ValueError("Column/value length mismatch")
+    column_list = ", ".join(columns)
+    placeholders = ", ".join("?" for _ in values)
+    sql = f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})"
     try:
-        if len(columns) != len(values):
-            raise ValueError("Column/value length mismatch")
-        column_list = ", ".join(columns)
-        placeholders = ", ".join("?" for _ in values)
-        cursor.execute(
-            f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})",
-            values,
+        return get_database().write(
+            lambda connection: connection.execute(sql, values).fetchall()
         )
-        db.commit()
-        return cursor
     except SqlIntegrityErr:
-        db.rollback()
-        raise err
+        raise
     except SqlErr as err:
-        db.rollback()
         logger.error(
             "Experienced an SQL error while inserting a row", exc_info=True
         )
@@ -235,10 +200,12 @@ def server_interact_with_row(
     passing in valid information. This will log errors then propagate them.
     """
     try:
-        cursor = interact_with_row(table, column, identifier, action)
-        rows = cursor.fetchall()
+        rows = interact_with_row(table, column, identifier, action)
         if strict and len(rows) > 1:
-            print("I knewww it")
+            logger.warning(
+                "Expected one row, got several",
+                extra={"table": table, "column": column, "rows": len(rows)},
+            )
             self.send_http_response(HTTPStatus.NOT_FOUND)
             return None
         if send_response_on_success:
@@ -276,8 +243,7 @@ def server_insert_row(
     valid information. This will log errors then propagate them.
     """
     try:
-        cursor = insert_row(table, columns, values)
-        rows = cursor.fetchall()
+        rows = insert_row(table, columns, values)
         if strict and len(rows) > 1:
             self.send_http_response(HTTPStatus.NOT_FOUND)
             return None
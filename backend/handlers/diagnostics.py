@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import json
+from http import HTTPStatus
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qs
+from backend import metrics
+from backend.db.timing import top_statements
+from backend.profiling import ProfilingError, allocations, sampler
+from backend.router.firewall import backendMemory, sharedMemory
+
+if TYPE_CHECKING:
+    from backend.router.RequestHandler import request_handler
+
+# Every handler here is for developers only, see the routes.
+MAX_DIFF_LIMIT = 500
+MAX_STATEMENTS_LIMIT = 1000
+DIFF_KEY_TYPES = {"lineno", "filename", "traceback"}
+
+
+def server_read_number_parameter(
+    self: request_handler, name: str, default: float, maximum: float
+) -> float | None:
+    """
+    Returns the query parameter as a number, or default if it isn't given. Sends a
+    400 response and returns None if it isn't a number between 0 and maximum.
+    """
+    values = parse_qs(self.parameters or "").get(name)
+    if not values:
+        return default
+    try:
+        value = float(values[0])
+    except ValueError:
+        value = -1
+    if not 0 < value <= maximum:
+        self.send_http_response(
+            HTTPStatus.BAD_REQUEST, f"'{name}' must be between 0 and {maximum}."
+        )
+        return None
+    return value
+
+
+def send_json(self: request_handler, data, status=HTTPStatus.OK) -> None:
+    self.send_http_response(status, json.dumps(data), body_type="application/json")
+    return None
+
+
+def get_metrics_handler(self: request_handler) -> None:
+    """Sends every metric in the Prometheus text format."""
+    self.send_http_response(
+        HTTPStatus.OK, metrics.render(), body_type=metrics.CONTENT_TYPE
+    )
+    return None
+
+
+def post_profiler_start_handler(self: request_handler) -> None:
+    """Starts the stack sampler, '?interval_ms=' sets how often it samples."""
+    interval = server_read_number_parameter(self, "interval_ms", 10, 1000)
+    if interval is None:
+        return None
+    try:
+        sampler.start(interval / 1000)
+    except ProfilingError as err:
+        self.send_http_response(HTTPStatus.CONFLICT, str(err))
+        return None
+    send_json(self, {"running": True, "interval_ms": sampler.interval * 1000})
+    return None
+
+
+def post_profiler_stop_handler(self: request_handler) -> None:
+    """Stops the stack sampler and sends the collapsed stacks."""
+    try:
+        stacks = sampler.stop()
+    except ProfilingError as err:
+        self.send_http_response(HTTPStatus.CONFLICT, str(err))
+        return None
+    self.response_headers["X-Samples"] = sampler.samples
+    self.send_http_response(HTTPStatus.OK, stacks)
+    return None
+
+
+def post_tracemalloc_snapshot_handler(self: request_handler) -> None:
+    """Starts tracing allocations if needed and takes a new baseline snapshot."""
+    send_json(self, allocations.snapshot())
+    return None
+
+
+def get_tracemalloc_diff_handler(self: request_handler) -> None:
+    """
+    Sends the allocation sites that grew the most since the baseline.
+    '?limit=' caps how many are sent and '?group=' is 'lineno', 'filename' or
+    'traceback'.
+    """
+    limit = server_read_number_parameter(self, "limit", 25, MAX_DIFF_LIMIT)
+    if limit is None:
+        return None
+    key_type = parse_qs(self.parameters or "").get("group", ["lineno"])[0]
+    if key_type not in DIFF_KEY_TYPES:
+        self.send_http_response(HTTPStatus.BAD_REQUEST, "Unknown 'group'.")
+        return None
+    try:
+        differences = allocations.diff(int(limit), key_type)
+    except ProfilingError as err:
+        self.send_http_response(HTTPStatus.CONFLICT, str(err))
+        return None
+    send_json(self, {**allocations.status(), "differences": differences})
+    return None
+
+
+def post_tracemalloc_stop_handler(self: request_handler) -> None:
+    """Stops tracing allocations, which frees the memory tracemalloc uses."""
+    allocations.stop()
+    send_json(self, allocations.status())
+    return None
+
+
+def get_memory_containers_handler(self: request_handler) -> None:
+    """Sends the container_statistics of every container of both memories."""
+    send_json(
+        self,
+        {
+            memory.memoryName: memory.memory_statistics()
+            for memory in (backendMemory, sharedMemory)
+        },
+    )
+    return None
+
+
+def get_sql_statements_handler(self: request_handler) -> None:
+    """Sends the statements that took the most time in total, '?limit=' caps how
+    many."""
+    limit = server_read_number_parameter(self, "limit", 20, MAX_STATEMENTS_LIMIT)
+    if limit is None:
+        return None
+    send_json(self, {"statements": top_statements(int(limit))})
+    return None
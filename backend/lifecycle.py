@@ -0,0 +1,213 @@
+"""
+Shutting the server down without dropping requests, and restarting it without
+closing its socket.
+
+SIGTERM and SIGINT drain the server: the serve loop stops taking connections once
+the request being handled is done, connections already waiting in the listen
+backlog are answered with 503 and Retry-After, then backend.main flushes the
+caches and the database and exits. If the request doesn't finish within
+DRAIN_TIMEOUT seconds, the process exits anyway.
+
+SIGHUP restarts with zero downtime: the cache snapshot is saved, a new process is
+started with the same command and inherits the listening socket (its descriptor
+is passed in LISTEN_FD), and once it reports that it's ready through the pipe in
+READY_FD this process drains like on SIGTERM. Connections keep queueing on the
+socket the whole time, the new process picks them up. If it doesn't get ready
+within HANDOFF_TIMEOUT seconds it's killed and this process keeps serving.
+
+Process managers that consider the service stopped once its first process exits
+should restart with SIGTERM instead.
+"""
+
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+from http import HTTPStatus
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DRAIN_TIMEOUT = 30
+HANDOFF_TIMEOUT = 30
+# Seconds clients are told to wait before retrying while the server drains.
+RETRY_AFTER = 1
+
+
+def inherited_socket() -> socket.socket | None:
+    """The listening socket passed down by the process being replaced, if any."""
+    descriptor = os.environ.pop("LISTEN_FD", None)
+    if descriptor is None:
+        return None
+    return socket.socket(fileno=int(descriptor))
+
+
+def notify_ready() -> None:
+    """Tells the process being replaced that this one is serving."""
+    descriptor = os.environ.pop("READY_FD", None)
+    if descriptor is None:
+        return None
+    try:
+        os.write(int(descriptor), b"1")
+    finally:
+        os.close(int(descriptor))
+    return None
+
+
+class Lifecycle:
+    """
+    Drains and hands off a socketserver server running serve_forever on the main
+    thread. The server gets a 'draining' attribute, request_handler answers with
+    503 while it's True.
+    """
+
+    def __init__(
+        self,
+        server,
+        *,
+        drain_timeout: float | None = None,
+        before_handoff=None,
+    ):
+        self.server = server
+        # Read here rather than on import, backend.main imports this before .env.
+        if drain_timeout is None:
+            drain_timeout = float(
+                os.environ.get("DRAIN_TIMEOUT", DEFAULT_DRAIN_TIMEOUT)
+            )
+        self.drain_timeout = drain_timeout
+        # Called before the new process starts, so it can load what this saved.
+        self.before_handoff = before_handoff
+        self.draining = False
+        self.handed_off = False
+        self._lock = threading.Lock()
+        server.draining = False
+
+    def install_signal_handlers(self) -> None:
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        signal.signal(signal.SIGINT, self._on_stop_signal)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._on_restart_signal)
+        return None
+
+    def _on_stop_signal(self, signum, frame) -> None:
+        if self.draining:
+            logger.warning("Already draining, signal %s again to force exit", signum)
+            signal.signal(signum, signal.SIG_DFL)
+            return None
+        logger.info("Draining after signal %s", signum)
+        self.drain()
+        return None
+
+    def _on_restart_signal(self, signum, frame) -> None:
+        # Signal handlers interrupt the main thread, which may be handling a
+        # request, so the handoff runs elsewhere.
+        threading.Thread(target=self.hand_off, name="handoff", daemon=True).start()
+        return None
+
+    def drain(self) -> None:
+        """Stops the serve loop once the request being handled is done, exiting
+        the process if that takes longer than drain_timeout."""
+        with self._lock:
+            if self.draining:
+                return None
+            self.draining = True
+            self.server.draining = True
+        threading.Thread(target=self._stop_serving, name="drain", daemon=True).start()
+        return None
+
+    def _stop_serving(self) -> None:
+        stopped = threading.Event()
+
+        def shutdown():
+            self.server.shutdown()
+            stopped.set()
+
+        threading.Thread(target=shutdown, daemon=True).start()
+        if stopped.wait(self.drain_timeout):
+            return None
+        logger.error(
+            "A request was still running after %ss, exiting without it",
+            self.drain_timeout,
+        )
+        logging.shutdown()
+        os._exit(1)
+
+    def hand_off(self) -> bool:
+        """Starts the new process on this socket and drains once it's ready.
+        Returns False if it didn't get ready, this process keeps serving then."""
+        with self._lock:
+            if self.draining:
+                return False
+        if self.before_handoff is not None:
+            self.before_handoff()
+
+        # Only needed for restarts, so startup doesn't import it.
+        import subprocess
+
+        listening = self.server.socket.fileno()
+        os.set_inheritable(listening, True)
+        ready_read, ready_write = os.pipe()
+        environment = dict(
+            os.environ, LISTEN_FD=str(listening), READY_FD=str(ready_write)
+        )
+        try:
+            process = subprocess.Popen(
+                [sys.executable, *sys.orig_argv[1:]],
+                env=environment,
+                pass_fds=(listening, ready_write),
+            )
+        except OSError:
+            logger.error("Could not start the new process", exc_info=True)
+            os.close(ready_read)
+            os.close(ready_write)
+            return False
+        os.close(ready_write)
+        try:
+            readable, _, _ = select.select([ready_read], [], [], HANDOFF_TIMEOUT)
+            ready = bool(readable) and os.read(ready_read, 1) == b"1"
+        finally:
+            os.close(ready_read)
+        if not ready:
+            logger.error("The new process %s didn't get ready", process.pid)
+            process.kill()
+            return False
+
+        logger.info("Handed the socket off to process %s", process.pid)
+        self.handed_off = True
+        self.drain()
+        return True
+
+    def finish(self) -> None:
+        """
+        Called after serve_forever returns. Connections already queued on the
+        socket are answered with 503, unless the socket was handed off, the new
+        process serves them then. Closes this process's copy of the socket.
+        """
+        if not self.handed_off:
+            self._reject_backlog()
+        self.server.server_close()
+        return None
+
+    def _reject_backlog(self) -> None:
+        self.server.socket.setblocking(False)
+        while True:
+            try:
+                connection, address = self.server.socket.accept()
+            except (BlockingIOError, OSError):
+                return None
+            try:
+                connection.sendall(
+                    (
+                        f"HTTP/1.1 {HTTPStatus.SERVICE_UNAVAILABLE.value} "
+                        f"{HTTPStatus.SERVICE_UNAVAILABLE.phrase}\r\n"
+                        f"Retry-After: {RETRY_AFTER}\r\n"
+                        "Content-Length: 0\r\n"
+                        "Connection: close\r\n\r\n"
+                    ).encode()
+                )
+            except OSError:
+                pass
+            finally:
+                connection.close()
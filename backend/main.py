@@ -3,19 +3,50 @@ Main entry point for the To-Do App backend server.
 
 Environment Variables:
   - SQLITE3_PATH: Path to SQLite database file (default: ./data/todo.db)
+  - DB_READ_CONNECTIONS: Connections reading the database at once, writes go
+    through a single writer thread (default: 4)
   - PORT: Server port number (default: 8000)
   - BASE_URL: Server listening address (default: localhost)
+  - MEMORY_BACKEND: 'local' or 'sqlite', where shared cache state lives (default: local)
+  - MEMORY_SQLITE_PATH: Database of the 'sqlite' memory backend (default: ./data/memory.db)
+  - MEMORY_SNAPSHOT_PATH: Where the cache is saved on shutdown and loaded from on
+    startup, empty to disable (default: ./data/memory.snapshot)
+  - SERVER_TIMING: '1' adds a Server-Timing header to every response (default: off)
+  - SLOW_REQUEST_THRESHOLD_MS: Requests slower than this are logged (default: 500)
+  - SLOW_REQUEST_SAMPLE_RATE: Share of the slow requests that are logged (default: 1)
+  - SLOW_QUERY_THRESHOLD_MS: SQL statements slower than this are logged (default: 100)
+  - LOG_LEVEL, LOG_LEVELS, LOG_RATE_LIMIT: see backend/structured_logging.py
+  - SQL_JSON_RESPONSES: '0' encodes task lists in Python instead of SQLite (default: 1)
+  - ADMISSION_CONTROL, ADMISSION_TARGETS_MS: see backend/admission.py
+  - REQUESTS_RATE_LIMITING_CAP, GET_REQUESTS_RATE_LIMITING_CAP: Requests a client
+    may make every 30 seconds, GET requests have their own cap (default: 50, 500)
+  - DRAIN_TIMEOUT: Seconds a request may take to finish on shutdown (default: 30)
+
+SIGTERM and Ctrl+C drain the server and exit, SIGHUP restarts it without closing
+its socket, see backend/lifecycle.py.
 """
 
+import logging
 import os
 import sys
 from pathlib import Path
-from dotenv import load_dotenv
 from http.server import HTTPServer
-from backend.router.RequestHandler import request_handler
+from backend.lifecycle import Lifecycle, inherited_socket, notify_ready
+from backend.memory_snapshot import SnapshotError, load_snapshot, save_snapshot
+from backend.startup import (
+    bootstrap_database,
+    import_server,
+    load_environment,
+    preload_modules,
+)
+from backend.structured_logging import configure_logging
+
+# The server's modules are imported by main, once the environment is loaded, see
+# backend.startup for the order.
+
+logger = logging.getLogger(__name__)
 
-# Load environment variables from .env file
-load_dotenv()
+LISTEN_BACKLOG = 128
 
 
 def get_env(key: str, default: str | None = None) -> str:
@@ -63,35 +94,123 @@ def validate_sqlite_path(db_path: str) -> Path:
     return db_path_obj
 
 
+def load_memory_snapshot(snapshot_path: str) -> None:
+    """Warms the cache up from the snapshot of the previous run, if there is one."""
+    if not snapshot_path or not os.path.exists(snapshot_path):
+        return
+    from backend.router.firewall import backendMemory
+    from backend.router.RequestHandler import is_loaded_file_current
+
+    try:
+        loaded = load_snapshot(
+            backendMemory,
+            snapshot_path,
+            validators={"loaded_files": is_loaded_file_current},
+        )
+        logger.info("Loaded %s cache entries from %s", loaded, snapshot_path)
+    except (OSError, SnapshotError) as e:
+        # A cold cache is only slower, it's no reason not to start.
+        logger.warning("Could not load the cache snapshot: %s", e)
+
+
+def save_memory_snapshot(snapshot_path: str) -> None:
+    if not snapshot_path:
+        return
+    from backend.router.firewall import backendMemory
+
+    try:
+        saved = save_snapshot(backendMemory, snapshot_path)
+        logger.info("Saved %s cache entries to %s", saved, snapshot_path)
+    except OSError as e:
+        logger.error("Could not save the cache snapshot: %s", e)
+
+
+class Server(HTTPServer):
+    """Leaves the connections taken by request_handler.hand_over_connection open."""
+
+    def __init__(self, *args, **kwargs):
+        self.handed_over = set()
+        super().__init__(*args, **kwargs)
+
+    def shutdown_request(self, request):
+        if request in self.handed_over:
+            self.handed_over.discard(request)
+            return None
+        super().shutdown_request(request)
+        return None
+
+
+def create_server(base_url: str, port: int, request_handler) -> HTTPServer:
+    """Listens on the socket inherited from the process being replaced if there
+    is one, otherwise binds base_url:port."""
+    listening = inherited_socket()
+    if listening is None:
+        server = Server((base_url, port), request_handler, bind_and_activate=False)
+        # Connections over the backlog are dropped and retried by the client seconds
+        # later. Queued ones are seen, and shed early if need be, by backend.admission.
+        server.request_queue_size = LISTEN_BACKLOG
+        try:
+            server.server_bind()
+            server.server_activate()
+        except OSError:
+            server.server_close()
+            raise
+        return server
+    server = Server(
+        listening.getsockname()[:2], request_handler, bind_and_activate=False
+    )
+    server.socket.close()
+    server.socket = listening
+    server.server_address = listening.getsockname()
+    return server
+
+
 def main():
     """Initialize and start the HTTP server."""
+    load_environment()
+    configure_logging()
     # Get and validate configuration
     sqlite3_path = get_env("SQLITE3_PATH", "./data/todo.db")
     port = int(get_env("PORT", "8000"))
     base_url = get_env("BASE_URL", "localhost")
+    snapshot_path = get_env("MEMORY_SNAPSHOT_PATH", "./data/memory.snapshot")
     
     # Validate database path before starting server
     try:
         db_path = validate_sqlite_path(sqlite3_path)
-        print(f"✓ Database path validated: {db_path}")
+        logger.info("Database path validated: %s", db_path)
     except RuntimeError as e:
-        print(f"✗ Database validation failed: {e}", file=sys.stderr)
+        logger.critical("Database validation failed: %s", e)
         sys.exit(1)
-    
+    bootstrap_database()
+    request_handler = import_server()
+
     # Create and start server
     try:
-        server = HTTPServer((base_url, port), request_handler)
-        server.allow_reuse_address = True
-        print(f"✓ Server starting on {base_url}:{port}")
-        print(f"✓ Database: {db_path}")
-        server.serve_forever()
+        server = create_server(base_url, port, request_handler)
     except OSError as e:
-        print(f"✗ Failed to start server: {e}", file=sys.stderr)
+        logger.critical("Failed to start server: %s", e)
         sys.exit(1)
-    except KeyboardInterrupt:
-        print("\nServer shutting down...")
-        sys.exit(0)
+    lifecycle = Lifecycle(
+        server, before_handoff=lambda: save_memory_snapshot(snapshot_path)
+    )
+    load_memory_snapshot(snapshot_path)
+    lifecycle.install_signal_handlers()
+    preload_modules()
+    logger.info("Server starting on %s:%s", *server.server_address[:2])
+    notify_ready()
+    # Returns once the lifecycle drained the server, after the last request.
+    server.serve_forever()
+
+    logger.info("Server shutting down")
+    lifecycle.finish()
+    if not lifecycle.handed_off:
+        # Otherwise it was saved before the new process started, which loaded it.
+        save_memory_snapshot(snapshot_path)
+    from backend.db.connections import close_database
 
+    close_database()
+    sys.exit(0)
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,17 @@
 """Provides a fast, no-dependancy, local cache to use for any purpose by just creating a
 instance of the Memory class."""
 
+import heapq
+import logging
+import sys
+import threading
+from collections import OrderedDict
 from time import time
+from typing import Any, NamedTuple
+
+from backend.accounting import note_cache
+
+logger = logging.getLogger(__name__)
 
 
 class BackendMemoryError(Exception):
@@ -46,8 +56,13 @@ class Payload:
     Payload data, expiration time, and note can be directly accesed and
     modified reliably. Container and identifier information are much more
     sensitive, they shouldn't be modified, although they can be read.
+
+    There is one payload per entry in memory, so it uses __slots__ instead of a
+    per-instance __dict__ to keep it small.
     """
 
+    __slots__ = ("data", "expiration_time", "note", "_container", "_identifier")
+
     def __init__(
         self,
         container: str,
@@ -94,6 +109,405 @@ class Payload:
         return self.expiration_time <= int(time())
 
 
+# -- Eviction
+# Containers can be given a capacity, by entry count and/or estimated bytes. When a
+# container goes over capacity, expired entries are dropped first and then the
+# container's eviction policy picks which live entries to evict.
+
+
+class ExpiryIndex:
+    """
+    The payloads of a container grouped by the second they expire in.
+
+    Every second that has payloads sits in a heap, so the next payloads to
+    expire are found in O(log n) while each payload only costs a single list
+    slot. Removed and overwritten payloads are left in place and skipped later;
+    the index is compacted once those make up most of it.
+    """
+
+    __slots__ = ("_buckets", "_seconds", "queued")
+
+    def __init__(self):
+        self._buckets = {}
+        self._seconds = []
+        self.queued = 0
+
+    def add(self, payload: Payload) -> None:
+        second = payload.expiration_time
+        bucket = self._buckets.get(second)
+        if bucket is None:
+            bucket = self._buckets[second] = []
+            heapq.heappush(self._seconds, second)
+        bucket.append(payload)
+        self.queued += 1
+
+    def pop_due(self, now: int) -> list:
+        """Removes and returns every payload queued to expire by now.
+
+        Some of them may no longer be in the container.
+        """
+        due = []
+        while self._seconds and self._seconds[0] <= now:
+            due.extend(self._buckets.pop(heapq.heappop(self._seconds)))
+        self.queued -= len(due)
+        return due
+
+    def earliest(self, entries: dict) -> Payload:
+        """Returns the payload still in entries that is queued to expire first."""
+        while True:
+            second = self._seconds[0]
+            bucket = self._buckets[second]
+            for index, payload in enumerate(bucket):
+                if entries.get(payload._identifier) is not payload:
+                    continue
+                del bucket[:index]
+                self.queued -= index
+                if payload.expiration_time == second:
+                    return payload
+                # The expiration time was changed after it was queued.
+                del bucket[0]
+                self.queued -= 1
+                self.add(payload)
+                break
+            else:
+                self.queued -= len(bucket)
+                del bucket[:]
+            if not bucket:
+                del self._buckets[heapq.heappop(self._seconds)]
+
+    def compact(self, entries: dict) -> None:
+        """Drops payloads that are no longer in entries."""
+        for second, bucket in list(self._buckets.items()):
+            bucket[:] = [
+                payload
+                for payload in bucket
+                if entries.get(payload._identifier) is payload
+            ]
+            if not bucket:
+                del self._buckets[second]
+        self._seconds = list(self._buckets)
+        heapq.heapify(self._seconds)
+        self.queued = sum(map(len, self._buckets.values()))
+
+
+class EvictionPolicy:
+    """
+    The base class for eviction policies.
+
+    A policy is told about every entry that is added, accessed or removed so it
+    can always name the next victim in constant or logarithmic time. Policies are
+    created with the container's ExpiryIndex and entries.
+    """
+
+    name = ""
+
+    def added(self, identifier: str, payload: Payload) -> None:
+        pass
+
+    def accessed(self, identifier: str) -> None:
+        pass
+
+    def removed(self, identifier: str) -> None:
+        pass
+
+    def victim(self) -> str:
+        """Returns the identifier that should be evicted next."""
+        raise NotImplementedError
+
+
+class LRUPolicy(EvictionPolicy):
+    """Evicts the least recently used entry."""
+
+    name = "lru"
+
+    def __init__(self, expiry: ExpiryIndex, entries: dict):
+        self._order = OrderedDict()
+
+    def added(self, identifier, payload):
+        self._order[identifier] = None
+        self._order.move_to_end(identifier)
+
+    def accessed(self, identifier):
+        if identifier in self._order:
+            self._order.move_to_end(identifier)
+
+    def removed(self, identifier):
+        self._order.pop(identifier, None)
+
+    def victim(self):
+        return next(iter(self._order))
+
+
+class LFUPolicy(EvictionPolicy):
+    """
+    Evicts the least frequently used entry, the oldest one if there is a tie.
+
+    Entries are kept in buckets by their use count so every operation is O(1).
+    """
+
+    name = "lfu"
+
+    def __init__(self, expiry: ExpiryIndex, entries: dict):
+        self._counts = {}
+        self._buckets = {}
+        self._min_count = 0
+
+    def added(self, identifier, payload):
+        self._counts[identifier] = 1
+        self._buckets.setdefault(1, OrderedDict())[identifier] = None
+        self._min_count = 1
+
+    def accessed(self, identifier):
+        use_count = self._counts.get(identifier)
+        if use_count is None:
+            return
+        bucket = self._buckets[use_count]
+        del bucket[identifier]
+        if not bucket:
+            del self._buckets[use_count]
+            if self._min_count == use_count:
+                self._min_count = use_count + 1
+        self._counts[identifier] = use_count + 1
+        self._buckets.setdefault(use_count + 1, OrderedDict())[identifier] = None
+
+    def removed(self, identifier):
+        use_count = self._counts.pop(identifier, None)
+        if use_count is None:
+            return
+        bucket = self._buckets[use_count]
+        del bucket[identifier]
+        if not bucket:
+            del self._buckets[use_count]
+
+    def victim(self):
+        if self._min_count not in self._buckets:
+            self._min_count = min(self._buckets)
+        return next(iter(self._buckets[self._min_count]))
+
+
+class TTLFirstPolicy(EvictionPolicy):
+    """Evicts the entry closest to expiring, it would have been gone soonest."""
+
+    name = "ttl"
+
+    def __init__(self, expiry: ExpiryIndex, entries: dict):
+        self._expiry = expiry
+        self._entries = entries
+
+    def victim(self):
+        return self._expiry.earliest(self._entries)._identifier
+
+
+EVICTION_POLICIES = {
+    policy.name: policy for policy in (LRUPolicy, LFUPolicy, TTLFirstPolicy)
+}
+
+# The shallow size of a payload and its dict slot, added to every estimate.
+PAYLOAD_OVERHEAD_BYTES = sys.getsizeof(Payload("", "", None)) + 100
+
+
+def estimate_size(identifier: str, data) -> int:
+    """A cheap estimate of the bytes an entry takes up. Containers inside the data
+    are not followed."""
+    return sys.getsizeof(identifier) + sys.getsizeof(data) + PAYLOAD_OVERHEAD_BYTES
+
+
+# -- Secondary indexes
+# An index maps a key computed from the data to the identifiers holding it, which
+# makes reverse lookups O(1) instead of a scan of the container. The data of an
+# indexed container must be replaced through add_data, not mutated in place,
+# otherwise the index goes stale.
+
+DATA_INDEX = "data"
+
+
+class SecondaryIndex:
+    """Maps key_function(data) to the set of identifiers with that key.
+
+    Entries whose key is None are not indexed.
+    """
+
+    __slots__ = ("key_function", "identifiers")
+
+    def __init__(self, key_function):
+        self.key_function = key_function
+        self.identifiers = {}
+
+    def key(self, identifier: str, data):
+        """Returns the key of the data, raises DataError if it can't be indexed.
+        Nothing is changed, so it can be checked before anything is."""
+        key = self.key_function(data)
+        if key is None:
+            return None
+        try:
+            hash(key)
+        except TypeError:
+            raise DataError(f"Index key '{key}' of '{identifier}' is not hashable.")
+        return key
+
+    def add_key(self, identifier: str, key) -> None:
+        if key is None:
+            return
+        self.identifiers.setdefault(key, set()).add(identifier)
+
+    def removed(self, identifier: str, data) -> None:
+        key = self.key_function(data)
+        if key is None:
+            return
+        identifiers = self.identifiers.get(key)
+        if identifiers is None:
+            return
+        identifiers.discard(identifier)
+        if not identifiers:
+            del self.identifiers[key]
+
+    def lookup(self, key) -> set:
+        try:
+            return self.identifiers.get(key, set())
+        except TypeError:
+            return set()
+
+
+class _ContainerState:
+    """Bookkeeping that Memory keeps next to every container."""
+
+    __slots__ = (
+        "max_entries",
+        "max_bytes",
+        "policy",
+        "expiry",
+        "indexes",
+        "size_bytes",
+        "evictions",
+        "expirations",
+        "hits",
+        "misses",
+    )
+
+    def __init__(
+        self,
+        max_entries: int | None,
+        max_bytes: int | None,
+        policy: EvictionPolicy | None,
+        expiry: ExpiryIndex,
+        indexes: dict | None = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.expiry = expiry
+        self.indexes = indexes or {}
+        self.size_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.hits = 0
+        self.misses = 0
+
+    def is_over_capacity(self, entries: int) -> bool:
+        return (self.max_entries is not None and entries > self.max_entries) or (
+            self.max_bytes is not None and self.size_bytes > self.max_bytes
+        )
+
+
+
+# -- Computing
+# get_or_compute stores whatever a compute function returns. SingleFlight makes
+# sure that, with several threads, an identifier is only computed by one of them
+# at a time.
+
+
+class Computed(NamedTuple):
+    """Can be returned by a get_or_compute compute function to store a note along
+    with the data."""
+
+    data: Any
+    note: str = ""
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Runs at most one computation per key at a time.
+
+    Callers asking for a key that is already being computed wait for that result,
+    or its error, instead of computing it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def run(self, key, compute):
+        """Returns compute(), or the result of the computation already running for
+        key."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            return flight.wait()
+        return self._lead(key, flight, compute)
+
+    def start(self, key, compute) -> bool:
+        """
+        Runs compute in a background thread, unless key is already being computed.
+
+        Returns False if it was already being computed. Errors are logged, nobody
+        waits for them.
+        """
+        # The flight is registered before the thread starts, so callers racing
+        # here start one thread between them.
+        with self._lock:
+            if key in self._flights:
+                return False
+            flight = self._flights[key] = _Flight()
+
+        def background():
+            try:
+                self._lead(key, flight, compute)
+            except Exception:
+                logger.error("Failed to recompute %s", key, exc_info=True)
+
+        try:
+            threading.Thread(target=background, daemon=True).start()
+        except RuntimeError as error:
+            # No thread to run it, so nobody may wait for it.
+            flight.error = error
+            self._finish(key, flight)
+            raise
+        return True
+
+    def _lead(self, key, flight: _Flight, compute):
+        try:
+            flight.result = compute()
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            self._finish(key, flight)
+        return flight.result
+
+    def _finish(self, key, flight: _Flight) -> None:
+        with self._lock:
+            del self._flights[key]
+        flight.done.set()
+
+
 class Memory:
     """
     Non-presistent local memory with time-based expiry and seperation of
@@ -103,15 +517,24 @@ class Memory:
     percision too.
 
     Memory only contains alive data, once somethings expiry time has passed it
-    becomes unreachable through function-based access.
+    becomes unreachable through function-based access. Expired data is removed
+    whenever data is added to its container.
     It is heavily encourged to only use CRUD operations for data in memory
     using the given functions, otherwise unexpected behaviour may occur.
+
+    Containers can be bounded with max_entries and/or max_bytes, see
+    add_container. Bounded containers evict entries using their policy.
     """
 
     def __init__(self, name):
         self.memory = {
             "process_information": {},
         }
+        self.container_states = {
+            "process_information": _ContainerState(
+                None, None, None, ExpiryIndex()
+            ),
+        }
 
         self.container_guides = {"process_information": """
             The backend and frontend may exchange several times to complete a
@@ -134,25 +557,47 @@ class Memory:
         note: str = "",
         overwrite: bool = False,
     ) -> None:
-        """Creates a data entry and location inside the given container."""
+        """Creates a data entry and location inside the given container.
+
+        If the container is bounded this may evict other entries.
+        """
         # Safety checks for container and identifier
         if container not in self.memory:
             raise ObjectNotFoundError(
                 f"Container '{container}' does not exist."
             )
-        self.clean_container(container)
-        if identity in self.memory[container] and not overwrite:
+        state = self.container_states[container]
+        self._expire_due(container)
+        existing = self.memory[container].get(identity)
+        if existing is not None and not overwrite:
             raise ObjectAlreadyExistsError(
                 f"Can not overwrite. Identifier '{identity}' is already used."
             )
 
-        # Container specific procedures
-        # None currently, add the option to add them.
+        # Every check runs before the existing entry is touched, so data that
+        # can't be added leaves it as it was.
+        size = estimate_size(identity, data)
+        if state.max_bytes is not None and size > state.max_bytes:
+            raise DataError(
+                f"Data for '{identity}' is larger than container '{container}'"
+                " allows."
+            )
+        keys = [
+            (index, index.key(identity, data)) for index in state.indexes.values()
+        ]
+        if existing is not None:
+            self._remove_entry(container, identity)
+        for index, key in keys:
+            index.add_key(identity, key)
 
         # Payload construction and actually storing the value in memory now
-        self.memory[container][identity] = Payload(
-            container, identity, data, ttl, note=note
-        )
+        payload = Payload(container, identity, data, ttl, note=note)
+        self.memory[container][identity] = payload
+        state.size_bytes += size
+        state.expiry.add(payload)
+        if state.policy is not None:
+            state.policy.added(identity, payload)
+            self._enforce_capacity(container)
         return
 
     def retrieve_data(self, container: str, identifier: str):
@@ -165,32 +610,50 @@ class Memory:
                 f"Container '{container}' does not exist."
             )
         payload = self.memory.get(container).get(identifier)
+        state = self.container_states[container]
         if not payload:
+            state.misses += 1
+            note_cache(False)
             raise ObjectNotFoundError(f"""Identifer '{identifier}'
                 does not exist in container '{container}'""")
         if payload.is_expired():
-            del self.memory[container][identifier]
+            self._remove_entry(container, identifier)
+            state.expirations += 1
+            state.misses += 1
+            note_cache(False)
             raise DataExpiredError(
                 f"""Data at location: container, '{container}'; identifier,
                 '{identifier}'."""
             )
+        state.hits += 1
+        note_cache(True)
+        if state.policy is not None:
+            state.policy.accessed(identifier)
         return payload.data
 
     def retrieve_identifiers_from_data(
         self, container: str, data: str
     ) -> list:
-        """Returns a list of all the identifiers of the given data."""
+        """Returns a list of all the identifiers of the given data.
+
+        This is O(1) if the container was created with index_data, otherwise it
+        scans the container.
+        """
         if container not in self.memory:
             raise ObjectNotFoundError(
                 f"Container '{container}' does not exist."
             )
-        self.clean_container(container)
-
-        identifiers = []
-
-        for identifier, payload in self.memory[container].items():
-            if payload.data == data:
-                identifiers.append(identifier)
+        data_index = self.container_states[container].indexes.get(DATA_INDEX)
+        if data_index is not None:
+            identifiers = self._live_identifiers(
+                container, data_index.lookup(data)
+            )
+        else:
+            self.clean_container(container)
+            identifiers = []
+            for identifier, payload in self.memory[container].items():
+                if payload.data == data:
+                    identifiers.append(identifier)
         if not identifiers:
             raise ObjectNotFoundError(
                 f"""Data, '{data}', does not exist inside container
@@ -202,11 +665,19 @@ class Memory:
         """
         Returns True if data exists in the given container,
         else returns False.
+
+        This is O(1) if the container was created with index_data, otherwise it
+        scans the container.
         """
         if container not in self.memory:
             raise ObjectNotFoundError(
                 f"Container '{container}' does not exist."
             )
+        data_index = self.container_states[container].indexes.get(DATA_INDEX)
+        if data_index is not None:
+            return bool(
+                self._live_identifiers(container, data_index.lookup(data))
+            )
         self.clean_container(container)
 
         for payload in self.memory[container].values():
@@ -214,16 +685,52 @@ class Memory:
                 return True
         return False
 
+    def retrieve_identifiers_from_index(
+        self, container: str, index: str, key
+    ) -> list:
+        """Returns the identifiers whose data has the given key in the index.
+
+        Returns an empty list if there are none.
+        """
+        state = self.container_states.get(container)
+        if state is None:
+            raise ObjectNotFoundError(
+                f"Container '{container}' does not exist."
+            )
+        if index not in state.indexes:
+            raise ObjectNotFoundError(
+                f"Container '{container}' has no index '{index}'."
+            )
+        return self._live_identifiers(container, state.indexes[index].lookup(key))
+
+    def delete_data_from_index(self, container: str, index: str, key) -> int:
+        """Deletes every entry whose data has the given key in the index.
+
+        Returns the amount of entries deleted.
+        """
+        identifiers = self.retrieve_identifiers_from_index(container, index, key)
+        for identifier in identifiers:
+            self._remove_entry(container, identifier)
+        return len(identifiers)
+
+    def _live_identifiers(self, container: str, identifiers: set) -> list:
+        """Filters out, and removes, expired entries from indexed identifiers."""
+        state = self.container_states[container]
+        entries = self.memory[container]
+        alive = []
+        for identifier in list(identifiers):
+            if entries[identifier].is_expired():
+                self._remove_entry(container, identifier)
+                state.expirations += 1
+            else:
+                alive.append(identifier)
+        return alive
+
     def clean_memory(self) -> list:
         """Removes all expired data inside memory."""
         expired = []
         for container_name in list(self.memory.keys()):
-            for identifier, payload in list(
-                self.memory[container_name].items()
-            ):
-                if payload.is_expired():
-                    expired.append(payload.description())
-                    del self.memory[container_name][identifier]
+            expired.extend(self.clean_container(container_name))
 
         return expired
 
@@ -234,10 +741,12 @@ class Memory:
             raise ObjectNotFoundError(
                 f"There is no '{container}' container."
             )
+        state = self.container_states[container]
         for identifier, payload in list(self.memory[container].items()):
             if payload.is_expired():
                 expired.append(payload.description())
-                del self.memory[container][identifier]
+                self._remove_entry(container, identifier)
+                state.expirations += 1
         return expired
 
     def delete_data(self, container: str, identifier: str) -> None:
@@ -247,9 +756,204 @@ class Memory:
                 f"""Identifier '{identifier}' does not exist in container
                 '{container}'."""
             )
-        del self.memory[container][identifier]
+        self._remove_entry(container, identifier)
         return
 
+    # -- Atomic operations
+    # These are single steps for read-modify-write patterns. Memory itself has no
+    # locking, ShardedMemory runs each of them under a lock.
+    def increment(
+        self, container: str, identifier: str, ttl: int, amount: int = 1
+    ) -> int:
+        """
+        Adds amount to the number stored under identifier and returns the result.
+
+        If there is no live entry, one is created holding amount that expires
+        after ttl. Incrementing doesn't extend the expiration time.
+        """
+        if container not in self.memory:
+            raise ObjectNotFoundError(
+                f"Container '{container}' does not exist."
+            )
+        payload = self.memory[container].get(identifier)
+        if payload is None or payload.is_expired():
+            self.add_data(container, identifier, ttl, amount, overwrite=True)
+            return amount
+        if not isinstance(payload.data, int):
+            raise DataError(
+                f"Data at '{identifier}' in '{container}' is not a number."
+            )
+        self._replace_data(container, identifier, payload, payload.data + amount)
+        return payload.data
+
+    def get_or_set(self, container: str, identifier: str, factory, ttl: int):
+        """
+        Returns the data stored under identifier. If there is no live entry,
+        factory() is called and its result is stored for ttl seconds and returned.
+        """
+        try:
+            return self.retrieve_data(container, identifier)
+        except (ObjectNotFoundError, DataExpiredError):
+            if container not in self.memory:
+                raise
+        data = factory()
+        self.add_data(container, identifier, ttl, data, overwrite=True)
+        return data
+
+    def get_or_compute(
+        self,
+        container: str,
+        identifier: str,
+        compute,
+        ttl: int,
+        *,
+        stale_ttl: int = 0,
+    ):
+        """
+        Returns the data stored under identifier. If there is no fresh entry,
+        compute() is called and its result is stored and returned. compute can
+        return a Computed to store a note too.
+
+        Entries are kept for ttl + stale_ttl seconds and are fresh for the first
+        ttl of them, so use the same stale_ttl for a container every time. Memory
+        recomputes stale entries right away, ShardedMemory serves them while
+        recomputing in the background.
+        """
+        entry = self._computed_entry(container, identifier, stale_ttl)
+        if entry is not None and entry[1]:
+            return entry[0]
+        return self._store_computed(
+            container, identifier, compute(), ttl + stale_ttl
+        )
+
+    def _computed_entry(
+        self, container: str, identifier: str, stale_ttl: int
+    ) -> tuple | None:
+        """Returns (data, is_fresh) of a live entry, or None."""
+        try:
+            data = self.retrieve_data(container, identifier)
+        except (ObjectNotFoundError, DataExpiredError):
+            if container not in self.memory:
+                raise
+            return None
+        expiration_time = self.memory[container][identifier].expiration_time
+        return data, expiration_time - stale_ttl > int(time())
+
+    def _store_computed(
+        self, container: str, identifier: str, computed, ttl: int
+    ):
+        if isinstance(computed, Computed):
+            data, note = computed
+        else:
+            data, note = computed, ""
+        try:
+            self.add_data(
+                container, identifier, ttl, data, note=note, overwrite=True
+            )
+        except DataError:
+            # Too large to keep, it gets computed again next time.
+            pass
+        return data
+
+    def time_to_live(self, container: str, identifier: str) -> int:
+        """Returns the seconds until the data expires, 0 if it already has."""
+        if container not in self.memory:
+            raise ObjectNotFoundError(
+                f"Container '{container}' does not exist."
+            )
+        payload = self.memory[container].get(identifier)
+        if payload is None:
+            raise ObjectNotFoundError(
+                f"""Identifier '{identifier}' does not exist in container
+                '{container}'."""
+            )
+        return max(0, payload.expiration_time - int(time()))
+
+    def _replace_data(
+        self, container: str, identifier: str, payload: Payload, data
+    ) -> None:
+        """Changes the data of a stored payload, keeping its bookkeeping right."""
+        state = self.container_states[container]
+        keys = [
+            (index, index.key(identifier, data))
+            for index in state.indexes.values()
+        ]
+        for index in state.indexes.values():
+            index.removed(identifier, payload.data)
+        state.size_bytes += estimate_size(identifier, data) - estimate_size(
+            identifier, payload.data
+        )
+        payload.data = data
+        for index, key in keys:
+            index.add_key(identifier, key)
+        if state.policy is not None:
+            state.policy.accessed(identifier)
+
+    # -- Capacity
+    def _remove_entry(self, container: str, identifier: str) -> Payload:
+        """Removes an entry and its bookkeeping. Every removal goes through here."""
+        payload = self.memory[container].pop(identifier)
+        state = self.container_states[container]
+        state.size_bytes -= estimate_size(identifier, payload.data)
+        if state.policy is not None:
+            state.policy.removed(identifier)
+        for index in state.indexes.values():
+            index.removed(identifier, payload.data)
+        return payload
+
+    def _expire_due(self, container: str) -> None:
+        """Removes the entries of the container that have expired, without
+        scanning the whole container."""
+        state = self.container_states[container]
+        entries = self.memory[container]
+        for payload in state.expiry.pop_due(int(time())):
+            identifier = payload._identifier
+            if entries.get(identifier) is not payload:
+                continue
+            if payload.is_expired():
+                self._remove_entry(container, identifier)
+                state.expirations += 1
+            else:
+                # The expiration time was extended after it was queued.
+                state.expiry.add(payload)
+        # Keep removed payloads from outgrowing the container.
+        if state.expiry.queued > 2 * len(entries) + 64:
+            state.expiry.compact(entries)
+
+    def _enforce_capacity(self, container: str) -> None:
+        state = self.container_states[container]
+        entries = self.memory[container]
+        while entries and state.is_over_capacity(len(entries)):
+            self._remove_entry(container, state.policy.victim())
+            state.evictions += 1
+
+    def container_statistics(self, container: str) -> dict:
+        """Returns the size, limits, and eviction and hit counters of the
+        container."""
+        if container not in self.memory:
+            raise ObjectNotFoundError(
+                f"Container '{container}' does not exist."
+            )
+        state = self.container_states[container]
+        return {
+            "entries": len(self.memory[container]),
+            "bytes": state.size_bytes,
+            "max_entries": state.max_entries,
+            "max_bytes": state.max_bytes,
+            "policy": state.policy.name if state.policy is not None else None,
+            "evictions": state.evictions,
+            "expirations": state.expirations,
+            "hits": state.hits,
+            "misses": state.misses,
+        }
+
+    def memory_statistics(self) -> dict:
+        """Returns container_statistics for every container."""
+        return {
+            container: self.container_statistics(container)
+            for container in self.memory
+        }
+
     # -- Listing
     def list_all_data_in_memory(self) -> list:
         """
@@ -297,60 +1001,84 @@ class Memory:
 
         return guides_cleaned
 
-    # -- JSON
-    # This function requires much more nuance due to Payload now being an
-    # object. Additionally, I want to add structure enforcing and more
-    # flexibility with importing.
-
-    # I'll have to create a complex parser, which I'll do later. UPDATE.
-
-    # def export_to_json(self) -> str:
-    #     """
-    #     Returns a JSON-object of all memory.\n\n Includes containers,
-    #     identifiers, values, TTL's, and notes.
-    #     """
-    #     return json.dumps(self.memory)
-
-    # def import_from_json(self, JSON: str) -> None:
-    #     """
-    #     Adds JSON-object inside memory.
-
-    #     The JSON-object has to have the same paradigm as all other memory
-    #     uses.
-
-    #     The paradigm is three layers of dictionaries; first is the entire
-    #     memory, the second is containers, and the third is the payload. There
-    #     is no other structure to memory.
-    #     """
-
-    #     # UPDATE : THIS WILL CURRENTLY COMPLETELY REPLACE THE INSIDE OF ANY
-    #     # OVERLAPPING CONTAINERS WTIH THE IMPORTED JSON, MAKE IT ADD, NOT REPLACE
-
-    #     self.memory.update(json.loads(JSON))
+    # -- Snapshots
+    # See backend.memory_snapshot for the format, and save_snapshot/load_snapshot
+    # to write and read one.
+    def iter_live_entries(self, container: str):
+        """Yields (identifier, expiration_time, note, data) for every live entry of
+        the container."""
+        if container not in self.memory:
+            raise ObjectNotFoundError(
+                f"Container '{container}' does not exist."
+            )
+        for identifier, payload in list(self.memory[container].items()):
+            if not payload.is_expired():
+                yield (
+                    identifier,
+                    payload.expiration_time,
+                    payload.note,
+                    payload.data,
+                )
 
     # extension methods, these were not part of the original class but were added for
     # convenience sake.
 
     def __setitem__(
         self, container_name: str, container_guide: str = ""
+    ) -> None:
+        """Creates a new, unbounded, container. See add_container."""
+        self.add_container(container_name, container_guide)
+        return None
+
+    def add_container(
+        self,
+        container_name: str,
+        container_guide: str = "",
+        *,
+        max_entries: int | None = None,
+        max_bytes: int | None = None,
+        policy: str = "lru",
+        index_data: bool = False,
+        indexes: dict | None = None,
     ) -> None:
         """Creates a new container, which is just a plain dictionary inside memory.
 
         Containers are used as seperators of concerns regarding values.
         A guide will be created automatically and be empty by default.
+
+        If max_entries or max_bytes is given the container is bounded. Going over
+        either limit evicts entries using the policy: 'lru', 'lfu', or 'ttl'
+        (closest to expiring first). Bytes are estimated, see estimate_size.
+
+        index_data makes retrieve_identifiers_from_data and does_data_exist O(1),
+        the data has to be hashable. indexes maps index names to key functions,
+        see retrieve_identifiers_from_index and delete_data_from_index.
         """
         if container_name in self.memory:
             raise ObjectAlreadyExistsError(
                 f"Can not create container, {container_name}, because it already exists"
             )
-        self.memory[container_name] = {}
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy '{policy}'.")
+        if indexes is not None and DATA_INDEX in indexes:
+            raise ValueError(f"The index name '{DATA_INDEX}' is reserved.")
+        secondary_indexes = {
+            name: SecondaryIndex(key_function)
+            for name, key_function in (indexes or {}).items()
+        }
+        if index_data:
+            secondary_indexes[DATA_INDEX] = SecondaryIndex(lambda data: data)
+        bounded = max_entries is not None or max_bytes is not None
+        entries = self.memory[container_name] = {}
+        expiry = ExpiryIndex()
         self.container_guides[container_name] = container_guide
-        return None
-
-    def add_container(
-        self, container_name: str, container_guide: str = ""
-    ) -> None:
-        self[container_name] = container_guide
+        self.container_states[container_name] = _ContainerState(
+            max_entries,
+            max_bytes,
+            EVICTION_POLICIES[policy](expiry, entries) if bounded else None,
+            expiry,
+            secondary_indexes,
+        )
         return None
 
     def remove_container(self, container: str) -> None:
@@ -364,4 +1092,282 @@ class Memory:
             )
         del self.memory[container]
         del self.container_guides[container]
+        del self.container_states[container]
+        return None
+
+
+class ShardedMemory:
+    """
+    A thread-safe Memory, with the same interface, that splits every container
+    into shards.
+
+    An identifier always lives in the same shard, picked by its hash, and every
+    shard has its own lock. Operations on one identifier only lock its shard, so
+    threads working on different identifiers rarely wait on each other. Operations
+    over a whole container lock the shards one at a time.
+
+    Capacity limits are split evenly between the shards, so eviction is decided
+    per shard.
+    """
+
+    def __init__(self, name, shards: int = 16):
+        if shards < 1:
+            raise ValueError("ShardedMemory needs at least one shard.")
+        self.memoryName = name
+        self.documentation = ""
+        self.shards = [Memory(f"{name}[{index}]") for index in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.flights = SingleFlight()
+        self.container_guides = dict(self.shards[0].container_guides)
+
+    def _shard(self, identifier: str) -> tuple[Memory, threading.Lock]:
+        index = hash(identifier) % len(self.shards)
+        return self.shards[index], self.locks[index]
+
+    def _each_shard(self):
+        """Yields every shard while holding its lock."""
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                yield shard
+
+    @property
+    def memory(self) -> dict:
+        """A merged, read-only, copy of every container. Prefer the methods."""
+        merged = {}
+        for shard in self._each_shard():
+            for container, entries in shard.memory.items():
+                merged.setdefault(container, {}).update(entries)
+        return merged
+
+    # -- CRUD and general-interactions
+    def add_data(
+        self,
+        container: str,
+        identity: str,
+        ttl: int,
+        data,
+        /,
+        *,
+        note: str = "",
+        overwrite: bool = False,
+    ) -> None:
+        shard, lock = self._shard(identity)
+        with lock:
+            shard.add_data(
+                container, identity, ttl, data, note=note, overwrite=overwrite
+            )
+
+    def retrieve_data(self, container: str, identifier: str):
+        shard, lock = self._shard(identifier)
+        with lock:
+            return shard.retrieve_data(container, identifier)
+
+    def delete_data(self, container: str, identifier: str) -> None:
+        shard, lock = self._shard(identifier)
+        with lock:
+            shard.delete_data(container, identifier)
+
+    def increment(
+        self, container: str, identifier: str, ttl: int, amount: int = 1
+    ) -> int:
+        shard, lock = self._shard(identifier)
+        with lock:
+            return shard.increment(container, identifier, ttl, amount)
+
+    def get_or_set(self, container: str, identifier: str, factory, ttl: int):
+        """See Memory.get_or_set. The factory runs while the shard is locked, so
+        it's called once even when threads race, but it should be quick."""
+        shard, lock = self._shard(identifier)
+        with lock:
+            return shard.get_or_set(container, identifier, factory, ttl)
+
+    def get_or_compute(
+        self,
+        container: str,
+        identifier: str,
+        compute,
+        ttl: int,
+        *,
+        stale_ttl: int = 0,
+    ):
+        """
+        See Memory.get_or_compute.
+
+        Only one thread computes an identifier at a time, the others wait for its
+        result. Stale entries are returned right away while a background thread
+        computes the new data. compute runs without holding the shard's lock.
+        """
+        shard, lock = self._shard(identifier)
+        with lock:
+            entry = shard._computed_entry(container, identifier, stale_ttl)
+        if entry is not None and entry[1]:
+            return entry[0]
+
+        def recompute():
+            with lock:
+                current = shard._computed_entry(container, identifier, stale_ttl)
+            # Another thread may have stored it while this one was waiting.
+            if current is not None and current[1]:
+                return current[0]
+            computed = compute()
+            with lock:
+                return shard._store_computed(
+                    container, identifier, computed, ttl + stale_ttl
+                )
+
+        key = (container, identifier)
+        if entry is not None:
+            self.flights.start(key, recompute)
+            return entry[0]
+        return self.flights.run(key, recompute)
+
+    def time_to_live(self, container: str, identifier: str) -> int:
+        shard, lock = self._shard(identifier)
+        with lock:
+            return shard.time_to_live(container, identifier)
+
+    def retrieve_identifiers_from_data(self, container: str, data) -> list:
+        identifiers = []
+        for shard in self._each_shard():
+            try:
+                identifiers.extend(
+                    shard.retrieve_identifiers_from_data(container, data)
+                )
+            except ObjectNotFoundError:
+                if container not in shard.memory:
+                    raise
+        if not identifiers:
+            raise ObjectNotFoundError(
+                f"""Data, '{data}', does not exist inside container
+                '{container}'."""
+            )
+        return identifiers
+
+    def does_data_exist(self, container: str, data) -> bool:
+        return any(
+            shard.does_data_exist(container, data) for shard in self._each_shard()
+        )
+
+    def retrieve_identifiers_from_index(
+        self, container: str, index: str, key
+    ) -> list:
+        identifiers = []
+        for shard in self._each_shard():
+            identifiers.extend(
+                shard.retrieve_identifiers_from_index(container, index, key)
+            )
+        return identifiers
+
+    def delete_data_from_index(self, container: str, index: str, key) -> int:
+        return sum(
+            shard.delete_data_from_index(container, index, key)
+            for shard in self._each_shard()
+        )
+
+    def clean_memory(self) -> list:
+        expired = []
+        for shard in self._each_shard():
+            expired.extend(shard.clean_memory())
+        return expired
+
+    def clean_container(self, container: str) -> list:
+        expired = []
+        for shard in self._each_shard():
+            expired.extend(shard.clean_container(container))
+        return expired
+
+    # -- Capacity
+    def container_statistics(self, container: str) -> dict:
+        """See Memory.container_statistics, the numbers are summed over the
+        shards."""
+        totals = None
+        for shard in self._each_shard():
+            statistics = shard.container_statistics(container)
+            if totals is None:
+                totals = statistics
+                continue
+            for key in (
+                "entries",
+                "bytes",
+                "evictions",
+                "expirations",
+                "hits",
+                "misses",
+            ):
+                totals[key] += statistics[key]
+            for key in ("max_entries", "max_bytes"):
+                if statistics[key] is not None:
+                    totals[key] += statistics[key]
+        return totals
+
+    def memory_statistics(self) -> dict:
+        return {
+            container: self.container_statistics(container)
+            for container in self.container_guides
+        }
+
+    # -- Listing
+    def list_all_data_in_memory(self) -> list:
+        data = []
+        for shard in self._each_shard():
+            data.extend(shard.list_all_data_in_memory())
+        return data
+
+    def list_all_data_in_container(self, container: str) -> list:
+        data = []
+        for shard in self._each_shard():
+            data.extend(shard.list_all_data_in_container(container))
+        return data
+
+    def iter_live_entries(self, container: str):
+        """See Memory.iter_live_entries. A shard's entries are collected under its
+        lock, then yielded without it."""
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                entries = list(shard.iter_live_entries(container))
+            yield from entries
+
+    # -- Containers
+    def __setitem__(
+        self, container_name: str, container_guide: str = ""
+    ) -> None:
+        self.add_container(container_name, container_guide)
+        return None
+
+    def add_container(
+        self,
+        container_name: str,
+        container_guide: str = "",
+        *,
+        max_entries: int | None = None,
+        max_bytes: int | None = None,
+        policy: str = "lru",
+        index_data: bool = False,
+        indexes: dict | None = None,
+    ) -> None:
+        """See Memory.add_container."""
+        shards = len(self.shards)
+        for shard in self._each_shard():
+            shard.add_container(
+                container_name,
+                container_guide,
+                max_entries=_split_limit(max_entries, shards),
+                max_bytes=_split_limit(max_bytes, shards),
+                policy=policy,
+                index_data=index_data,
+                indexes=indexes,
+            )
+        self.container_guides[container_name] = container_guide
+        return None
+
+    def remove_container(self, container: str) -> None:
+        for shard in self._each_shard():
+            shard.remove_container(container)
+        del self.container_guides[container]
+        return None
+
+
+def _split_limit(limit: int | None, shards: int) -> int | None:
+    if limit is None:
         return None
+    return max(1, -(-limit // shards))
@@ -0,0 +1,712 @@
+"""Storage backends for Memory, picked with create_memory.
+
+Every backend has the interface of Memory (add_data, retrieve_data, increment,
+add_container and so on), so callers don't need to know which one they got.
+
+- 'local' keeps everything inside the process, see ShardedMemory. It is the fastest
+  and the default.
+- 'sqlite' keeps the entries in a SQLite database in WAL mode, see SQLiteMemory.
+  Every worker process that opens the same file sees the same entries, and they
+  survive restarts. Use it for state that has to be shared, such as rate limits.
+
+The backend is chosen with the MEMORY_BACKEND environment variable, and the
+database of the sqlite backend with MEMORY_SQLITE_PATH.
+"""
+
+import marshal
+import threading
+from os import environ
+from pathlib import Path
+from sqlite3 import connect
+from time import time
+
+from backend.accounting import note_cache
+from backend.memory import (
+    DATA_INDEX,
+    EVICTION_POLICIES,
+    PAYLOAD_OVERHEAD_BYTES,
+    Computed,
+    DataError,
+    DataExpiredError,
+    ObjectAlreadyExistsError,
+    ObjectNotFoundError,
+    ShardedMemory,
+    SingleFlight,
+)
+
+DEFAULT_MEMORY_SQLITE_PATH = "./data/memory.db"
+# Seconds a write waits for another process to release the database.
+SQLITE_BUSY_TIMEOUT = 5
+# SQLite stores integers as 64-bit, bigger ones are marshaled like any other data.
+_MIN_SQL_INTEGER = -(2**63)
+_MAX_SQL_INTEGER = 2**63 - 1
+
+# How the policies order entries for eviction, first rows are evicted first.
+_EVICTION_ORDER = {
+    "lru": "last_access",
+    "lfu": "hits, last_access",
+    "ttl": "expiration_time",
+}
+
+
+def _open(path: Path):
+    """Opens the database at path, creating it and its table if needed."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = connect(
+        str(path),
+        timeout=SQLITE_BUSY_TIMEOUT,
+        isolation_level=None,
+    )
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS memory_entries (
+            memory TEXT NOT NULL,
+            container TEXT NOT NULL,
+            identifier TEXT NOT NULL,
+            data,
+            expiration_time INTEGER NOT NULL,
+            note TEXT NOT NULL DEFAULT '',
+            size INTEGER NOT NULL,
+            last_access REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (memory, container, identifier)
+        ) WITHOUT ROWID
+        """
+    )
+    return connection
+
+
+def _encode(data):
+    """Integers are stored as SQL integers so counters can be incremented by SQLite
+    itself, everything else is marshaled."""
+    if type(data) is int and _MIN_SQL_INTEGER <= data <= _MAX_SQL_INTEGER:
+        return data
+    try:
+        return marshal.dumps(data)
+    except ValueError:
+        raise DataError(
+            f"Data of type '{type(data).__name__}' can not be stored in shared"
+            " memory."
+        )
+
+
+def _decode(value):
+    if type(value) is not bytes:
+        return value
+    try:
+        return marshal.loads(value)
+    except (EOFError, ValueError, TypeError):
+        raise DataError("Stored data could not be read.")
+
+
+def _encoded_size(identifier: str, value) -> int:
+    if type(value) is bytes:
+        return PAYLOAD_OVERHEAD_BYTES + len(identifier) + len(value)
+    return PAYLOAD_OVERHEAD_BYTES + len(identifier) + 8
+
+
+class _SharedContainer:
+    """What this process knows about a container, its entries live in the
+    database."""
+
+    __slots__ = (
+        "max_entries",
+        "max_bytes",
+        "policy",
+        "check_interval",
+        "writes",
+        "evictions",
+        "expirations",
+        "hits",
+        "misses",
+    )
+
+    def __init__(self, max_entries, max_bytes, policy):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        # Counting a container is a scan, so limits are checked every few writes.
+        # A container can go over max_entries by about 1% per process meanwhile.
+        if max_entries is not None:
+            self.check_interval = max(1, max_entries // 100)
+        else:
+            self.check_interval = 100
+        self.writes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.hits = 0
+        self.misses = 0
+
+
+class SQLiteMemory:
+    """
+    Memory whose entries are kept in a SQLite database, shared by every process
+    that opens the same file.
+
+    The database is in WAL mode, so readers don't block the writer, and every
+    operation on an entry is a single statement, which makes increment atomic
+    across processes. Entries outlive the process, expired ones are dropped when
+    they are read or when their container is cleaned.
+
+    Containers are declared by every process with add_container, like with Memory.
+    Their limits, guides, and eviction counters belong to the process, the entries
+    are shared. Bounds are checked every few writes instead of on every write.
+
+    Data has to be marshalable (numbers, strings, bytes, and containers of those).
+    Secondary indexes with key functions need the local backend.
+    """
+
+    def __init__(self, name, path: str = DEFAULT_MEMORY_SQLITE_PATH):
+        self.memoryName = name
+        self.documentation = ""
+        self.path = Path(path).resolve()
+        self.container_guides = {}
+        self.containers = {}
+        self._local = threading.local()
+        self.flights = SingleFlight()
+        # Nothing is opened here, memories are created when modules are
+        # imported. See init_memory_database for failing at startup.
+
+    def _connection(self):
+        """Every thread gets its own connection, opened on first use, sqlite3
+        connections can't be shared between threads."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = _open(self.path)
+        return connection
+
+    def _execute(self, statement: str, parameters=()):
+        return self._connection().execute(statement, parameters)
+
+    def _container(self, container: str) -> _SharedContainer:
+        state = self.containers.get(container)
+        if state is None:
+            raise ObjectNotFoundError(
+                f"Container '{container}' does not exist."
+            )
+        return state
+
+    # -- CRUD and general-interactions
+    def add_data(
+        self,
+        container: str,
+        identity: str,
+        ttl: int,
+        data,
+        /,
+        *,
+        note: str = "",
+        overwrite: bool = False,
+    ) -> None:
+        """See Memory.add_data."""
+        state = self._container(container)
+        value = _encode(data)
+        size = _encoded_size(identity, value)
+        if state.max_bytes is not None and size > state.max_bytes:
+            raise DataError(
+                f"Data for '{identity}' is larger than container '{container}'"
+                " allows."
+            )
+        now = time()
+        # Without overwrite, only an expired entry may be replaced.
+        condition = "" if overwrite else "WHERE expiration_time <= :second"
+        stored = self._execute(
+            f"""
+            INSERT INTO memory_entries (
+                memory, container, identifier, data, expiration_time, note,
+                size, last_access
+            )
+            VALUES (:memory, :container, :identifier, :data, :expiration, :note,
+                :size, :now)
+            ON CONFLICT (memory, container, identifier) DO UPDATE SET
+                data = excluded.data,
+                expiration_time = excluded.expiration_time,
+                note = excluded.note,
+                size = excluded.size,
+                last_access = excluded.last_access,
+                hits = 1
+            {condition}
+            RETURNING identifier
+            """,
+            {
+                "memory": self.memoryName,
+                "container": container,
+                "identifier": identity,
+                "data": value,
+                "expiration": int(now) + ttl,
+                "note": note,
+                "size": size,
+                "now": now,
+                "second": int(now),
+            },
+        ).fetchone()
+        if stored is None:
+            raise ObjectAlreadyExistsError(
+                f"Can not overwrite. Identifier '{identity}' is already used."
+            )
+        self._wrote(container, state)
+        return
+
+    def retrieve_data(self, container: str, identifier: str):
+        """See Memory.retrieve_data."""
+        state = self._container(container)
+        if state.policy in ("lru", "lfu"):
+            row = self._execute(
+                """
+                UPDATE memory_entries SET last_access = ?, hits = hits + 1
+                WHERE memory = ? AND container = ? AND identifier = ?
+                RETURNING data, expiration_time
+                """,
+                (time(), self.memoryName, container, identifier),
+            ).fetchone()
+        else:
+            row = self._execute(
+                """
+                SELECT data, expiration_time FROM memory_entries
+                WHERE memory = ? AND container = ? AND identifier = ?
+                """,
+                (self.memoryName, container, identifier),
+            ).fetchone()
+        if row is None:
+            state.misses += 1
+            note_cache(False)
+            raise ObjectNotFoundError(f"""Identifer '{identifier}'
+                does not exist in container '{container}'""")
+        if row[1] <= int(time()):
+            self._delete_expired(container, identifier)
+            state.expirations += 1
+            state.misses += 1
+            note_cache(False)
+            raise DataExpiredError(
+                f"""Data at location: container, '{container}'; identifier,
+                '{identifier}'."""
+            )
+        state.hits += 1
+        note_cache(True)
+        return _decode(row[0])
+
+    def retrieve_identifiers_from_data(self, container: str, data) -> list:
+        """See Memory.retrieve_identifiers_from_data. This compares the stored
+        encoding, which is indexed if the container was created with index_data."""
+        self._container(container)
+        identifiers = [
+            row[0]
+            for row in self._execute(
+                """
+                SELECT identifier FROM memory_entries
+                WHERE memory = ? AND container = ? AND data = ?
+                    AND expiration_time > ?
+                """,
+                (self.memoryName, container, _encode(data), int(time())),
+            )
+        ]
+        if not identifiers:
+            raise ObjectNotFoundError(
+                f"""Data, '{data}', does not exist inside container
+                '{container}'."""
+            )
+        return identifiers
+
+    def does_data_exist(self, container: str, data) -> bool:
+        """See Memory.does_data_exist."""
+        try:
+            return bool(self.retrieve_identifiers_from_data(container, data))
+        except ObjectNotFoundError:
+            self._container(container)
+            return False
+
+    def retrieve_identifiers_from_index(
+        self, container: str, index: str, key
+    ) -> list:
+        self._container(container)
+        raise ObjectNotFoundError(
+            f"Container '{container}' has no index '{index}'."
+        )
+
+    def delete_data_from_index(self, container: str, index: str, key) -> int:
+        return len(self.retrieve_identifiers_from_index(container, index, key))
+
+    def clean_memory(self) -> list:
+        """Removes all expired data inside memory."""
+        expired = []
+        for container in list(self.containers):
+            expired.extend(self.clean_container(container))
+        return expired
+
+    def clean_container(self, container: str) -> list:
+        """Removes all expired data inside the given container."""
+        state = self._container(container)
+        expired = [
+            {
+                "data": _decode(data),
+                "note": note,
+                "container": container,
+                "identifier": identifier,
+            }
+            for identifier, data, note in self._execute(
+                """
+                DELETE FROM memory_entries
+                WHERE memory = ? AND container = ? AND expiration_time <= ?
+                RETURNING identifier, data, note
+                """,
+                (self.memoryName, container, int(time())),
+            ).fetchall()
+        ]
+        state.expirations += len(expired)
+        return expired
+
+    def delete_data(self, container: str, identifier: str) -> None:
+        """Instantly deletes the identifier and the data."""
+        self._container(container)
+        deleted = self._execute(
+            """
+            DELETE FROM memory_entries
+            WHERE memory = ? AND container = ? AND identifier = ?
+            RETURNING identifier
+            """,
+            (self.memoryName, container, identifier),
+        ).fetchone()
+        if deleted is None:
+            raise ObjectNotFoundError(
+                f"""Identifier '{identifier}' does not exist in container
+                '{container}'."""
+            )
+        return
+
+    def _delete_expired(self, container: str, identifier: str) -> None:
+        # Another process may have replaced it since it was read.
+        self._execute(
+            """
+            DELETE FROM memory_entries
+            WHERE memory = ? AND container = ? AND identifier = ?
+                AND expiration_time <= ?
+            """,
+            (self.memoryName, container, identifier, int(time())),
+        )
+
+    # -- Atomic operations
+    def increment(
+        self, container: str, identifier: str, ttl: int, amount: int = 1
+    ) -> int:
+        """See Memory.increment. This is a single statement, so it's atomic across
+        threads and processes."""
+        state = self._container(container)
+        now = time()
+        row = self._execute(
+            """
+            INSERT INTO memory_entries (
+                memory, container, identifier, data, expiration_time, size,
+                last_access
+            )
+            VALUES (:memory, :container, :identifier, :amount, :expiration,
+                :size, :now)
+            ON CONFLICT (memory, container, identifier) DO UPDATE SET
+                data = CASE WHEN expiration_time <= :second
+                    THEN excluded.data ELSE data + excluded.data END,
+                expiration_time = CASE WHEN expiration_time <= :second
+                    THEN excluded.expiration_time ELSE expiration_time END,
+                last_access = excluded.last_access,
+                hits = hits + 1
+            WHERE typeof(data) = 'integer' OR expiration_time <= :second
+            RETURNING data
+            """,
+            {
+                "memory": self.memoryName,
+                "container": container,
+                "identifier": identifier,
+                "amount": amount,
+                "expiration": int(now) + ttl,
+                "size": _encoded_size(identifier, amount),
+                "now": now,
+                "second": int(now),
+            },
+        ).fetchone()
+        if row is None:
+            raise DataError(
+                f"Data at '{identifier}' in '{container}' is not a number."
+            )
+        self._wrote(container, state)
+        return row[0]
+
+    def get_or_set(self, container: str, identifier: str, factory, ttl: int):
+        """
+        See Memory.get_or_set.
+
+        Processes racing on a missing entry may each call factory(), but only the
+        first result is stored and every caller gets that one.
+        """
+        try:
+            return self.retrieve_data(container, identifier)
+        except (ObjectNotFoundError, DataExpiredError):
+            if container not in self.containers:
+                raise
+        data = factory()
+        try:
+            self.add_data(container, identifier, ttl, data)
+        except ObjectAlreadyExistsError:
+            return self.retrieve_data(container, identifier)
+        return data
+
+    def get_or_compute(
+        self,
+        container: str,
+        identifier: str,
+        compute,
+        ttl: int,
+        *,
+        stale_ttl: int = 0,
+    ):
+        """See ShardedMemory.get_or_compute. Computations are only coalesced
+        between the threads of this process."""
+        entry = self._computed_entry(container, identifier, stale_ttl)
+        if entry is not None and entry[1]:
+            return entry[0]
+
+        def recompute():
+            current = self._computed_entry(container, identifier, stale_ttl)
+            if current is not None and current[1]:
+                return current[0]
+            computed = compute()
+            if isinstance(computed, Computed):
+                data, note = computed
+            else:
+                data, note = computed, ""
+            try:
+                self.add_data(
+                    container,
+                    identifier,
+                    ttl + stale_ttl,
+                    data,
+                    note=note,
+                    overwrite=True,
+                )
+            except DataError:
+                pass
+            return data
+
+        key = (container, identifier)
+        if entry is not None:
+            self.flights.start(key, recompute)
+            return entry[0]
+        return self.flights.run(key, recompute)
+
+    def _computed_entry(
+        self, container: str, identifier: str, stale_ttl: int
+    ) -> tuple | None:
+        try:
+            data = self.retrieve_data(container, identifier)
+            remaining = self.time_to_live(container, identifier)
+        except (ObjectNotFoundError, DataExpiredError):
+            self._container(container)
+            return None
+        return data, remaining > stale_ttl
+
+    def time_to_live(self, container: str, identifier: str) -> int:
+        """Returns the seconds until the data expires, 0 if it already has."""
+        self._container(container)
+        row = self._execute(
+            """
+            SELECT expiration_time FROM memory_entries
+            WHERE memory = ? AND container = ? AND identifier = ?
+            """,
+            (self.memoryName, container, identifier),
+        ).fetchone()
+        if row is None:
+            raise ObjectNotFoundError(
+                f"""Identifier '{identifier}' does not exist in container
+                '{container}'."""
+            )
+        return max(0, row[0] - int(time()))
+
+    # -- Capacity
+    def _wrote(self, container: str, state: _SharedContainer) -> None:
+        if state.max_entries is None and state.max_bytes is None:
+            return
+        state.writes += 1
+        if state.writes < state.check_interval:
+            return
+        state.writes = 0
+        self.clean_container(container)
+        entries, size_bytes = self._totals(container)
+        order = _EVICTION_ORDER[state.policy]
+        if state.max_entries is not None and entries > state.max_entries:
+            state.evictions += self._evict(
+                container, order, entries - state.max_entries
+            )
+        if state.max_bytes is not None:
+            # Entries differ in size, so evict the way Memory does: one at a time
+            # until the container fits.
+            while size_bytes > state.max_bytes:
+                evicted = self._execute(
+                    f"""
+                    DELETE FROM memory_entries
+                    WHERE memory = :memory AND container = :container
+                        AND identifier = (
+                            SELECT identifier FROM memory_entries
+                            WHERE memory = :memory AND container = :container
+                            ORDER BY {order} LIMIT 1
+                        )
+                    RETURNING size
+                    """,
+                    {"memory": self.memoryName, "container": container},
+                ).fetchone()
+                if evicted is None:
+                    break
+                size_bytes -= evicted[0]
+                state.evictions += 1
+
+    def _evict(self, container: str, order: str, amount: int) -> int:
+        return self._execute(
+            f"""
+            DELETE FROM memory_entries
+            WHERE memory = :memory AND container = :container
+                AND identifier IN (
+                    SELECT identifier FROM memory_entries
+                    WHERE memory = :memory AND container = :container
+                    ORDER BY {order} LIMIT :amount
+                )
+            """,
+            {"memory": self.memoryName, "container": container, "amount": amount},
+        ).rowcount
+
+    def _totals(self, container: str) -> tuple[int, int]:
+        return self._execute(
+            """
+            SELECT count(*), coalesce(sum(size), 0) FROM memory_entries
+            WHERE memory = ? AND container = ?
+            """,
+            (self.memoryName, container),
+        ).fetchone()
+
+    def container_statistics(self, container: str) -> dict:
+        """See Memory.container_statistics. Sizes are of the shared entries, the
+        counters are of this process."""
+        state = self._container(container)
+        entries, size_bytes = self._totals(container)
+        bounded = state.max_entries is not None or state.max_bytes is not None
+        return {
+            "entries": entries,
+            "bytes": size_bytes,
+            "max_entries": state.max_entries,
+            "max_bytes": state.max_bytes,
+            "policy": state.policy if bounded else None,
+            "evictions": state.evictions,
+            "expirations": state.expirations,
+            "hits": state.hits,
+            "misses": state.misses,
+        }
+
+    def memory_statistics(self) -> dict:
+        return {
+            container: self.container_statistics(container)
+            for container in self.containers
+        }
+
+    # -- Listing
+    def list_all_data_in_memory(self) -> list:
+        data = []
+        for container in self.containers:
+            data.extend(self.list_all_data_in_container(container))
+        return data
+
+    def list_all_data_in_container(self, container: str) -> list:
+        self._container(container)
+        return [
+            _decode(row[0])
+            for row in self._execute(
+                """
+                SELECT data FROM memory_entries
+                WHERE memory = ? AND container = ? AND expiration_time > ?
+                """,
+                (self.memoryName, container, int(time())),
+            )
+        ]
+
+    # -- Containers
+    def __setitem__(
+        self, container_name: str, container_guide: str = ""
+    ) -> None:
+        self.add_container(container_name, container_guide)
+        return None
+
+    def add_container(
+        self,
+        container_name: str,
+        container_guide: str = "",
+        *,
+        max_entries: int | None = None,
+        max_bytes: int | None = None,
+        policy: str = "lru",
+        index_data: bool = False,
+        indexes: dict | None = None,
+    ) -> None:
+        """See Memory.add_container. Entries already stored in the database under
+        this container are kept."""
+        if container_name in self.containers:
+            raise ObjectAlreadyExistsError(
+                f"Can not create container, {container_name}, because it already exists"
+            )
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy '{policy}'.")
+        if indexes:
+            raise ValueError(
+                "Secondary indexes are only supported by the local backend."
+            )
+        if index_data:
+            self._execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS memory_entries_{DATA_INDEX}
+                ON memory_entries (memory, container, data)
+                """
+            )
+        self.containers[container_name] = _SharedContainer(
+            max_entries, max_bytes, policy
+        )
+        self.container_guides[container_name] = container_guide
+        return None
+
+    def remove_container(self, container: str) -> None:
+        """Removes the container and deletes its entries for every process."""
+        self._container(container)
+        self._execute(
+            "DELETE FROM memory_entries WHERE memory = ? AND container = ?",
+            (self.memoryName, container),
+        )
+        del self.containers[container]
+        del self.container_guides[container]
+        return None
+
+
+MEMORY_BACKENDS = {
+    "local": ShardedMemory,
+    "sqlite": SQLiteMemory,
+}
+
+
+def init_memory_database() -> None:
+    """
+    Creates the database of the sqlite backend if MEMORY_BACKEND is 'sqlite', so
+    one that can't be opened fails at startup rather than on the first request.
+    """
+    if environ.get("MEMORY_BACKEND", "local") != "sqlite":
+        return None
+    path = environ.get("MEMORY_SQLITE_PATH", DEFAULT_MEMORY_SQLITE_PATH)
+    _open(Path(path).resolve()).close()
+    return None
+
+
+def create_memory(name: str, backend: str | None = None):
+    """
+    Returns a new memory using the given backend, or the one named by the
+    MEMORY_BACKEND environment variable ('local' by default).
+    """
+    backend = backend or environ.get("MEMORY_BACKEND", "local")
+    if backend not in MEMORY_BACKENDS:
+        raise ValueError(f"Unknown memory backend '{backend}'.")
+    if backend == "sqlite":
+        return SQLiteMemory(
+            name, environ.get("MEMORY_SQLITE_PATH", DEFAULT_MEMORY_SQLITE_PATH)
+        )
+    return MEMORY_BACKENDS[backend](name)
@@ -0,0 +1,219 @@
+"""Binary snapshots of Memory, used to warm caches up after a restart.
+
+A snapshot is a header followed by records, each written and read one at a time so
+neither side holds more than one entry in memory:
+
+    header   MAGIC, version (uint16), written_at (float64)
+    record   kind (uint8), length (uint32), marshaled tuple of that length
+
+Kinds are CONTAINER (name, guide, max_entries, max_bytes, policy), ENTRY
+(container, identifier, remaining_ttl, note, data) and END (entry count). A
+snapshot without its END record was cut short and is rejected. Integers are big
+endian.
+
+TTLs are stored as seconds remaining when the snapshot was written, and the time
+spent until it is loaded is taken off, so entries never outlive their original
+expiration.
+"""
+
+import logging
+import marshal
+import os
+import struct
+from time import time
+
+from backend.memory import (
+    BackendMemoryError,
+    DataError,
+    ObjectAlreadyExistsError,
+)
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TODOMEM\x00"
+VERSION = 1
+
+CONTAINER = 1
+ENTRY = 2
+END = 3
+
+_HEADER = struct.Struct(">8sHd")
+_RECORD = struct.Struct(">BI")
+# Larger records mean a corrupt length, not a real entry.
+MAX_RECORD_SIZE = 256 * 1024 * 1024
+
+
+class SnapshotError(BackendMemoryError):
+    """The snapshot can not be read, it's corrupt, truncated, or of an unknown
+    version."""
+
+    pass
+
+
+class SnapshotWriter:
+    """Writes a snapshot to a binary file, record by record."""
+
+    def __init__(self, file, /):
+        self._file = file
+        self.entries = 0
+        self.skipped = 0
+        self.written_at = time()
+        file.write(_HEADER.pack(MAGIC, VERSION, self.written_at))
+
+    def write_container(
+        self,
+        name: str,
+        guide: str,
+        max_entries: int | None,
+        max_bytes: int | None,
+        policy: str | None,
+    ) -> None:
+        self._write(CONTAINER, (name, guide, max_entries, max_bytes, policy))
+
+    def write_entry(
+        self, container: str, identifier: str, expiration_time: int, note: str, data
+    ) -> None:
+        """Writes an entry, entries whose data can't be marshaled are skipped."""
+        remaining_ttl = expiration_time - self.written_at
+        try:
+            self._write(
+                ENTRY, (container, identifier, remaining_ttl, note, data)
+            )
+        except ValueError:
+            self.skipped += 1
+            return
+        self.entries += 1
+
+    def close(self) -> None:
+        """Marks the snapshot as complete, without it the snapshot is rejected."""
+        self._write(END, (self.entries,))
+
+    def _write(self, kind: int, record: tuple) -> None:
+        body = marshal.dumps(record)
+        self._file.write(_RECORD.pack(kind, len(body)))
+        self._file.write(body)
+
+
+class SnapshotReader:
+    """
+    Reads a snapshot from a binary file.
+
+    Iterating yields (kind, record) tuples and raises SnapshotError if the
+    snapshot is damaged, including when it ends before its END record.
+    """
+
+    def __init__(self, file, /):
+        self._file = file
+        header = file.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise SnapshotError("The snapshot has no header.")
+        magic, version, self.written_at = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise SnapshotError("The file is not a memory snapshot.")
+        if version != VERSION:
+            raise SnapshotError(f"Unsupported snapshot version '{version}'.")
+
+    def __iter__(self):
+        entries = 0
+        while True:
+            header = self._file.read(_RECORD.size)
+            if len(header) != _RECORD.size:
+                raise SnapshotError("The snapshot is truncated.")
+            kind, length = _RECORD.unpack(header)
+            if length > MAX_RECORD_SIZE:
+                raise SnapshotError("The snapshot is corrupt.")
+            body = self._file.read(length)
+            if len(body) != length:
+                raise SnapshotError("The snapshot is truncated.")
+            try:
+                record = marshal.loads(body)
+            except (EOFError, ValueError, TypeError):
+                raise SnapshotError("The snapshot is corrupt.")
+            if kind == END:
+                if record != (entries,):
+                    raise SnapshotError("The snapshot is missing entries.")
+                return
+            if kind == ENTRY:
+                entries += 1
+            elif kind != CONTAINER:
+                raise SnapshotError(f"Unknown record kind '{kind}'.")
+            yield kind, record
+
+
+def save_snapshot(memory, path: str) -> int:
+    """
+    Writes every live entry of the memory to path and returns how many were
+    written.
+
+    The snapshot is written next to path and moved over it once complete, so a
+    crash mid-write leaves the previous snapshot in place.
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as file:
+        writer = SnapshotWriter(file)
+        for container in list(memory.container_guides):
+            statistics = memory.container_statistics(container)
+            writer.write_container(
+                container,
+                memory.container_guides[container],
+                statistics["max_entries"],
+                statistics["max_bytes"],
+                statistics["policy"],
+            )
+            for entry in memory.iter_live_entries(container):
+                writer.write_entry(container, *entry)
+        writer.close()
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+    if writer.skipped:
+        logger.warning(
+            "Left %s entries that can't be marshaled out of the snapshot",
+            writer.skipped,
+        )
+    return writer.entries
+
+
+def load_snapshot(memory, path: str, *, validators: dict | None = None) -> int:
+    """
+    Adds the entries of the snapshot at path to the memory and returns how many
+    were added.
+
+    Missing containers are created with the limits they had. Entries that have
+    expired since, or whose identifier is already used, are skipped. validators
+    maps container names to functions called with (identifier, note) that return
+    False for entries that are no longer valid.
+
+    Raises SnapshotError if the snapshot is damaged, entries read before the
+    damage are kept.
+    """
+    validators = validators or {}
+    loaded = 0
+    with open(path, "rb") as file:
+        reader = SnapshotReader(file)
+        elapsed = time() - reader.written_at
+        for kind, record in reader:
+            if kind == CONTAINER:
+                name, guide, max_entries, max_bytes, policy = record
+                if name not in memory.container_guides:
+                    memory.add_container(
+                        name,
+                        guide,
+                        max_entries=max_entries,
+                        max_bytes=max_bytes,
+                        policy=policy or "lru",
+                    )
+                continue
+            container, identifier, remaining_ttl, note, data = record
+            ttl = int(remaining_ttl - elapsed)
+            if ttl <= 0:
+                continue
+            validator = validators.get(container)
+            if validator is not None and not validator(identifier, note):
+                continue
+            try:
+                memory.add_data(container, identifier, ttl, data, note=note)
+            except (ObjectAlreadyExistsError, DataError):
+                continue
+            loaded += 1
+    return loaded
@@ -0,0 +1,315 @@
+"""Provides counters, gauges and histograms, exposed in the Prometheus text format.
+
+Metrics are declared once, at import time, and recorded on the hot path:
+
+>>> REQUESTS = counter("http_requests_total", "Requests handled", ("method",))
+>>> REQUESTS.labels("GET").inc()
+>>> DURATION = histogram("db_seconds", "Query time", buckets=(0.001, 0.01, 0.1))
+>>> DURATION.observe(0.004)
+
+Recording never takes a lock. Every thread adds into its own cell, and cells are
+only summed when the metrics are rendered. Values that already exist elsewhere,
+such as cache sizes, are better exposed with function=, which is called only when
+the metrics are rendered.
+"""
+
+import threading
+from bisect import bisect_left
+from math import inf
+
+# Seconds, from a fast cache hit to a slow request.
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+class _Cells:
+    """
+    Per-thread accumulators of a fixed number of values.
+
+    A thread only ever writes to its own cell, which needs no lock under the GIL.
+    The lock is only taken when a thread records for the first time, and when
+    reading. Cells of threads that have finished are folded into a base cell so
+    they don't pile up when every request gets its own thread.
+    """
+
+    __slots__ = ("_size", "_local", "_cells", "_base", "_lock")
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._cells = []  # (thread, cell)
+        self._base = [0] * size
+        self._lock = threading.Lock()
+
+    def cell(self) -> list:
+        cell = getattr(self._local, "cell", None)
+        if cell is None:
+            cell = self._local.cell = [0] * self._size
+            with self._lock:
+                self._fold_finished()
+                self._cells.append((threading.current_thread(), cell))
+        return cell
+
+    def sum(self) -> list:
+        with self._lock:
+            self._fold_finished()
+            totals = list(self._base)
+            for _, cell in self._cells:
+                for index, value in enumerate(cell):
+                    totals[index] += value
+        return totals
+
+    def _fold_finished(self) -> None:
+        alive = []
+        for thread, cell in self._cells:
+            if thread.is_alive():
+                alive.append((thread, cell))
+                continue
+            for index, value in enumerate(cell):
+                self._base[index] += value
+        self._cells = alive
+
+
+class _Metric:
+    """The shared part of every metric type. Labelled metrics keep one child per
+    combination of label values."""
+
+    type_name = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple, function):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Returns the child for the label values, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(
+                    f"Metric '{self.name}' takes {len(self.labelnames)} labels."
+                )
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """Yields (suffix, labels, value) for every line of the metric."""
+        if self.function is not None:
+            for values, value in _function_values(self.function, self.labelnames):
+                yield "", dict(zip(self.labelnames, values)), value
+            return
+        for values, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            yield from child.samples(labels)
+
+
+def _function_values(function, labelnames: tuple):
+    """A function returns a number for unlabelled metrics, or a dict mapping
+    tuples of label values to numbers."""
+    result = function()
+    if not labelnames:
+        return [((), result)]
+    return list(result.items())
+
+
+class _CounterChild:
+    __slots__ = ("_cells",)
+
+    def __init__(self):
+        self._cells = _Cells(1)
+
+    def inc(self, amount: float = 1) -> None:
+        self._cells.cell()[0] += amount
+
+    def samples(self, labels: dict):
+        yield "", labels, self._cells.sum()[0]
+
+
+class Counter(_Metric):
+    """A value that only goes up, such as the number of requests."""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        # A single assignment, so the last write wins without a lock.
+        self.value = value
+
+    def samples(self, labels: dict):
+        yield "", labels, self.value
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, such as the size of a cache."""
+
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_cells")
+
+    def __init__(self, buckets: tuple):
+        self._buckets = buckets
+        # One count per bucket, one for +Inf, then the count and the sum.
+        self._cells = _Cells(len(buckets) + 3)
+
+    def observe(self, value: float) -> None:
+        cell = self._cells.cell()
+        cell[bisect_left(self._buckets, value)] += 1
+        cell[-2] += 1
+        cell[-1] += value
+
+    def samples(self, labels: dict):
+        totals = self._cells.sum()
+        cumulative = 0
+        for bound, count in zip((*self._buckets, inf), totals):
+            cumulative += count
+            yield "_bucket", {**labels, "le": _format_number(bound)}, cumulative
+        yield "_count", labels, totals[-2]
+        yield "_sum", labels, totals[-1]
+
+
+class Histogram(_Metric):
+    """Counts observations, such as durations, into fixed buckets."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, help, labelnames, function, buckets):
+        if function is not None:
+            raise ValueError("Histograms can't be computed by a function.")
+        super().__init__(name, help, labelnames, None)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+
+class MetricsRegistry:
+    """Holds metrics by name and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric '{metric.name}' already exists.")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for suffix, labels, value in metric.samples():
+                lines.append(
+                    f"{metric.name}{suffix}{_format_labels(labels)}"
+                    f" {_format_number(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace('"', '\\"')
+        )
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    if value == inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(
+    name: str, help: str, labelnames: tuple = (), *, function=None
+) -> Counter:
+    """Creates and registers a counter. With function, the value is whatever it
+    returns when the metrics are rendered."""
+    return REGISTRY.register(Counter(name, help, labelnames, function))
+
+
+def gauge(
+    name: str, help: str, labelnames: tuple = (), *, function=None
+) -> Gauge:
+    """Creates and registers a gauge. With function, the value is whatever it
+    returns when the metrics are rendered."""
+    return REGISTRY.register(Gauge(name, help, labelnames, function))
+
+
+def histogram(
+    name: str,
+    help: str,
+    labelnames: tuple = (),
+    *,
+    buckets: tuple = DEFAULT_BUCKETS,
+) -> Histogram:
+    """Creates and registers a histogram with the given upper bucket bounds."""
+    return REGISTRY.register(Histogram(name, help, labelnames, None, buckets))
+
+
+def render() -> str:
+    """Returns every registered metric in the Prometheus text format."""
+    return REGISTRY.render()
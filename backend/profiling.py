@@ -0,0 +1,202 @@
+"""
+Profiling of the running server, used by the developer routes in
+backend/handlers/diagnostics.py.
+
+Both tools cost nothing until they are started: the stack sampler is a thread that
+only exists while sampling, and tracemalloc only traces between snapshot() and
+stop().
+
+The sampler's output is in the collapsed stack format, one line per distinct stack
+with its sample count, which flamegraph.pl and speedscope read as is:
+
+    thread MainThread;serve_forever (socketserver.py:215);... 42
+"""
+
+import os
+import sys
+import threading
+import tracemalloc
+from time import monotonic
+
+# Sampling every 10ms costs roughly 1% of a core with a few threads.
+DEFAULT_SAMPLE_INTERVAL = 0.01
+MIN_SAMPLE_INTERVAL = 0.001
+# A sampler someone forgot about stops on its own after this many seconds.
+MAX_SAMPLING_SECONDS = 5 * 60
+# Distinct stacks kept, the rest are counted under TRUNCATED_STACK.
+MAX_STACKS = 20_000
+TRUNCATED_STACK = "[other stacks]"
+TRACEMALLOC_FRAMES = 10
+
+
+class ProfilingError(Exception):
+    """The profiler isn't in the state the operation needs, such as stopping a
+    sampler that isn't running."""
+
+    pass
+
+
+class StackSampler:
+    """
+    Samples the stacks of every other thread at a fixed interval from a background
+    thread, counting how often each stack is seen.
+
+    A thread is used instead of a signal since signal handlers only ever run on
+    the main thread, which would miss the threads handling requests.
+    """
+
+    def __init__(self):
+        self.interval = DEFAULT_SAMPLE_INTERVAL
+        self.samples = 0
+        self._stacks = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        # The thread ends on its own after MAX_SAMPLING_SECONDS.
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def start(self, interval: float = DEFAULT_SAMPLE_INTERVAL) -> None:
+        """Starts sampling, raises ProfilingError if it's already running. The
+        stacks of a sampler that stopped on its own are dropped."""
+        with self._lock:
+            if self.running:
+                raise ProfilingError("The sampler is already running.")
+            self.interval = max(interval, MIN_SAMPLE_INTERVAL)
+            self.samples = 0
+            self._stacks = {}
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="stack-sampler", daemon=True
+            )
+            self._thread.start()
+        return None
+
+    def stop(self) -> str:
+        """Stops sampling and returns the collapsed stacks, raises ProfilingError
+        if it isn't running. A sampler that stopped on its own still returns what
+        it sampled until it's started again."""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                raise ProfilingError("The sampler isn't running.")
+            self._stop.set()
+            thread.join()
+            self._thread = None
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        lines = [
+            f"{stack} {count}"
+            for stack, count in sorted(
+                self._stacks.items(), key=lambda item: item[1], reverse=True
+            )
+        ]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        deadline = monotonic() + MAX_SAMPLING_SECONDS
+        while not self._stop.wait(self.interval):
+            if monotonic() > deadline:
+                return None
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self._count(_collapse(frame, names.get(thread_id, thread_id)))
+            self.samples += 1
+        return None
+
+    def _count(self, stack: str) -> None:
+        count = self._stacks.get(stack)
+        if count is not None:
+            self._stacks[stack] = count + 1
+        elif len(self._stacks) < MAX_STACKS:
+            self._stacks[stack] = 1
+        else:
+            self._stacks[TRUNCATED_STACK] = self._stacks.get(TRUNCATED_STACK, 0) + 1
+        return None
+
+
+def _collapse(frame, thread_name) -> str:
+    """The frames from the outermost call inwards, joined by ';'."""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}"
+            f":{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    frames.append(f"thread {thread_name}")
+    frames.reverse()
+    return ";".join(frames).replace("\n", " ")
+
+
+class AllocationTracker:
+    """Takes a tracemalloc snapshot as a baseline and diffs later ones against it."""
+
+    def __init__(self):
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    def snapshot(self, frames: int = TRACEMALLOC_FRAMES) -> dict:
+        """Starts tracing if needed and takes a new baseline. Only memory allocated
+        while tracing shows up, so the first baseline is taken right away."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._baseline = _take_snapshot()
+            return self.status()
+
+    def diff(self, limit: int = 25, key_type: str = "lineno") -> list:
+        """The allocation sites that grew the most since the baseline, raises
+        ProfilingError if there is no baseline."""
+        with self._lock:
+            if self._baseline is None:
+                raise ProfilingError("Take a snapshot first.")
+            differences = _take_snapshot().compare_to(self._baseline, key_type)
+        return [
+            {
+                "location": str(difference.traceback),
+                "size": difference.size,
+                "size_diff": difference.size_diff,
+                "count": difference.count,
+                "count_diff": difference.count_diff,
+            }
+            for difference in differences[:limit]
+        ]
+
+    def stop(self) -> None:
+        """Stops tracing and frees the baseline and the traces."""
+        with self._lock:
+            self._baseline = None
+            tracemalloc.stop()
+        return None
+
+    def status(self) -> dict:
+        traced, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "traced_bytes": traced,
+            "peak_bytes": peak,
+            "tracemalloc_bytes": tracemalloc.get_tracemalloc_memory(),
+        }
+
+
+def _take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        )
+    )
+
+
+sampler = StackSampler()
+allocations = AllocationTracker()
@@ -1,5 +1,10 @@
+import os
+import re
 from http.server import BaseHTTPRequestHandler
-from backend.router.routes import routes
+from random import random
+from time import perf_counter
+from urllib.parse import parse_qs
+from backend.router.routes import routes, route_classes, search_routes
 from http import HTTPStatus
 import logging
 from backend.router.firewall import (
@@ -8,34 +13,136 @@ from backend.router.firewall import (
     authenticate_request,
     backendMemory,
 )
-from backend.memory import ObjectNotFoundError, DataExpiredError
+from backend import accounting, admission
+from backend.lifecycle import RETRY_AFTER
+from backend.memory import Computed
+from backend.metrics import counter, histogram
+from backend.router.request_body import RequestBodyError
 
 backendMemory.add_container(
-    "loaded_files", "This container stores files that have been retrived"
+    "loaded_files",
+    "This container stores files that have been retrived",
+    max_bytes=32 * 1024 * 1024,
+    policy="lru",
 )
 
 logger = logging.getLogger(__name__)
+slow_request_logger = logging.getLogger("backend.slow_requests")
+access_logger = logging.getLogger("backend.access")
+
+# SERVER_TIMING=1 adds a Server-Timing header to every response, which shows the
+# time per phase, in SQL and on the CPU in the browser's developer tools.
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "") == "1"
+# Requests slower than this are logged with their accounting, but only a
+# SLOW_REQUEST_SAMPLE_RATE share of them so a slow period can't flood the log.
+SLOW_REQUEST_THRESHOLD = (
+    float(os.environ.get("SLOW_REQUEST_THRESHOLD_MS", "500")) / 1000
+)
+SLOW_REQUEST_SAMPLE_RATE = float(os.environ.get("SLOW_REQUEST_SAMPLE_RATE", "1"))
+# A statement executed this many times in one request is reported as an N+1 query,
+# once per route and statement.
+REPEATED_STATEMENT_THRESHOLD = 10
+_reported_repeated_statements = set()
+
+REQUEST_DURATION = histogram(
+    "http_request_duration_seconds",
+    "Time from reading the request line to sending the response, by route.",
+    ("route",),
+)
+RESPONSES = counter(
+    "http_responses_total",
+    "Responses sent, by method, route and status code.",
+    ("method", "route", "status"),
+)
+REPEATED_STATEMENTS = counter(
+    "http_requests_with_repeated_statements_total",
+    "Requests that executed a statement REPEATED_STATEMENT_THRESHOLD times or more.",
+    ("route",),
+)
+# Paths under /api/tasks that get their own route label, anything else there is
+# labelled '/api/tasks/*' so clients can't create new label values.
+API_ROUTE_NAMES = {
+    "/api/tasks",
+    "/api/tasks/export",
+    "/api/tasks/import",
+    "/api/tasks/stream",
+}
+API_TASK_PATH = re.compile(r"/api/tasks/\d+")
+
+
+# Files are re-read after LOADED_FILES_TTL seconds, and during the following
+# LOADED_FILES_STALE_TTL seconds the old copy is still served while that happens.
+# Files too large for the container are read from disk every time.
+LOADED_FILES_TTL = 30 * 60
+LOADED_FILES_STALE_TTL = 60
+
+
+def _read_file(path: str, binary: bool) -> Computed:
+    """Reads the file, noting its version for is_loaded_file_current."""
+    with open(path, "rb" if binary else "r") as f:
+        return Computed(f.read(), _file_version(os.fstat(f.fileno())))
+
+
+def _file_version(stat: os.stat_result) -> str:
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def is_loaded_file_current(path: str, note: str) -> bool:
+    """
+    Returns False if the file changed since it was cached in loaded_files, the note
+    of every entry is the version of the file. Used when loading memory snapshots.
+    """
+    try:
+        return _file_version(os.stat(path)) == note
+    except OSError:
+        return False
+
 
 # Handler names from all files follow the same pattern: {method}_{name}_handler.
 
 
 class request_handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 is needed for chunked responses. Every connection still only serves a
+    # single request, so responses are sent with 'Connection: close'.
+    protocol_version = "HTTP/1.1"
+
     def setup(self):
         super().setup()
-        self.backend_locked: bool = False
+        # Set by backend.lifecycle while the server drains before exiting.
+        self.backend_locked: bool = getattr(self.server, "draining", False)
         self.log_requests: bool = True
 
     def handle_one_request(self) -> None:
-        """Handle a single HTTP request."""
+        """Handle a single HTTP request, recording its duration, status and
+        accounting."""
+        start = perf_counter()
+        self.route_name = "-"
+        self.response_status = None
+        self.accounting, token = accounting.begin()
+        try:
+            self._handle_one_request()
+        finally:
+            accounting.end(token)
+            if self.response_status is not None:
+                duration = perf_counter() - start
+                admission.controller.observe(duration)
+                self._record_request(duration)
+                self._review_request(duration)
+
+    def _handle_one_request(self) -> None:
         if self.backend_locked:
             self.requestline = ""
             self.request_version = ""
             self.command = ""
-            self.send_error(HTTPStatus.SERVICE_UNAVAILABLE)
+            self.response_headers = {"Retry-After": RETRY_AFTER}
+            self.send_http_response(
+                HTTPStatus.SERVICE_UNAVAILABLE, "The server is restarting."
+            )
             return None
         self.close_connection = True
         self.response_headers = {} 
         self.user_information = {"role": ROLES["public"]}
+        self.request_body = None
 
         try:
             # No route in server should be longer than 399 characters
@@ -77,6 +184,72 @@ class request_handler(BaseHTTPRequestHandler):
             self.log_error("Request timed out: %r", err)
             return None
 
+    @property
+    def parsed_request_body(self):
+        """The parsed JSON body, or None if there is no body.
+
+        The body is read and parsed the first time this is accessed, so handlers
+        that don't need it never pay for it. Raises a RequestBodyError if it can't
+        be read, route() turns that into the matching response.
+        """
+        if self.request_body is None:
+            return None
+        return self.request_body.json()
+
+    def send_response(self, code, message=None) -> None:
+        self.response_status = int(code)
+        super().send_response(code, message)
+        return None
+
+    def end_headers(self) -> None:
+        # Every way of responding ends the headers here, so they all get it. The
+        # time spent after, such as writing a streamed body, isn't included.
+        if SERVER_TIMING:
+            self.send_header("Server-Timing", self.accounting.server_timing())
+        super().end_headers()
+        return None
+
+    def _record_request(self, duration: float) -> None:
+        method = self.command if self.command in routes else "other"
+        REQUEST_DURATION.labels(self.route_name).observe(duration)
+        RESPONSES.labels(
+            method, self.route_name, str(self.response_status)
+        ).inc()
+        return None
+
+    def _review_request(self, duration: float) -> None:
+        """Logs the request if it was slow or repeated a statement."""
+        if (
+            duration >= SLOW_REQUEST_THRESHOLD
+            and random() < SLOW_REQUEST_SAMPLE_RATE
+        ):
+            slow_request_logger.warning(
+                "Slow request",
+                extra={
+                    "method": self.command,
+                    "route": self.route_name,
+                    "status": self.response_status,
+                    **self.accounting.summary(),
+                },
+            )
+        repeated = self.accounting.repeated_statements(REPEATED_STATEMENT_THRESHOLD)
+        if repeated:
+            REPEATED_STATEMENTS.labels(self.route_name).inc()
+        for sql, count in repeated:
+            key = (self.route_name, sql)
+            if key in _reported_repeated_statements:
+                continue
+            _reported_repeated_statements.add(key)
+            logger.warning(
+                "Possible N+1 query",
+                extra={
+                    "route": self.route_name,
+                    "count": count,
+                    "statement": " ".join(sql.split()),
+                },
+            )
+        return None
+
     def log_request(self, code="-", size="-") -> None:
         """Log an accepted request.
 
@@ -86,11 +259,26 @@ class request_handler(BaseHTTPRequestHandler):
             return None
         if isinstance(code, HTTPStatus):
             code = code.value
-        self.log_message(
-            '"%s" %s %s', self.requestline, str(code), str(size)
+        access_logger.info(
+            '"%s" %s %s',
+            self.requestline,
+            code,
+            size,
+            extra={
+                "client": self.client_address[0],
+                "method": self.command,
+                "route": self.route_name,
+                "status": code,
+            },
         )
         return None
 
+    def log_message(self, format, *args) -> None:
+        # BaseHTTPRequestHandler writes these straight to stderr, they go through
+        # logging instead. Only its errors, like malformed requests, end up here.
+        logger.warning(format, *args, extra={"client": self.client_address[0]})
+        return None
+
     def send_http_response(
         self,
         code: int,
@@ -119,10 +307,11 @@ class request_handler(BaseHTTPRequestHandler):
                 )
                 return None
         self.send_response(code)
-        if content_length is None and body is not None:
-            content_length = len(body)
+        if content_length is None:
+            content_length = 0 if body is None else len(body)
         self.response_headers["Content-Length"] = content_length
         self.response_headers["Content-Type"] = body_type
+        self.response_headers["Connection"] = "close"
         for header, value in self.response_headers.items():
             self.send_header(header, value)
             continue
@@ -131,12 +320,48 @@ class request_handler(BaseHTTPRequestHandler):
             self.wfile.write(body)
         return None
 
+    def hand_over_connection(self):
+        """
+        Returns the connection, for whoever keeps writing to it once the handler
+        has returned. The server leaves it open then. The response headers have to
+        be sent already.
+        """
+        self.wfile.flush()
+        self.server.handed_over.add(self.connection)
+        return self.connection
+
     def redirect(self, location: str, status: HTTPStatus = HTTPStatus.FOUND) -> None:
         self.response_headers["Location"] = location
         self.send_http_response(status, "Redirecting")
         return None
 
     def route(self) -> None:
+        """Routes the request unless admission control sheds it."""
+        route_class = self.route_class()
+        if not admission.server_admit(self, route_class):
+            return None
+        try:
+            self._route()
+        finally:
+            admission.release(route_class)
+        return None
+
+    def route_class(self) -> str:
+        search_parameter = search_routes.get(self.command, {}).get(self.path)
+        if (
+            search_parameter is not None
+            and self.parameters
+            and parse_qs(self.parameters).get(search_parameter)
+        ):
+            return "search"
+        listed = route_classes.get(self.command, {}).get(self.path)
+        if listed is not None:
+            return listed
+        if isinstance(routes.get(self.command, {}).get(self.path), dict):
+            return "static"
+        return "api"
+
+    def _route(self) -> None:
         method_routes: dict = routes.get(self.command)
         if method_routes is None:
             self.send_http_response(HTTPStatus.METHOD_NOT_ALLOWED)
@@ -147,14 +372,22 @@ class request_handler(BaseHTTPRequestHandler):
         if route_path is None:
             # Check if this is an API route that needs pattern matching
             if self.path.startswith('/api/tasks'):
+                if self.path in API_ROUTE_NAMES:
+                    self.route_name = self.path
+                elif API_TASK_PATH.fullmatch(self.path):
+                    self.route_name = "/api/tasks/:id"
+                else:
+                    self.route_name = "/api/tasks/*"
                 from backend.api.tasks import api_tasks_handler
                 if not authenticate_request(self):
                     return None
-                api_tasks_handler(self)
+                self.call_handler(api_tasks_handler)
                 return None
             
+            self.route_name = "unmatched"
             self.send_http_response(HTTPStatus.NOT_FOUND)
             return None
+        self.route_name = self.path
         
         # A dict is a resource whereas a tuple is a handler
         # A resource is a file-like structure that requires reading
@@ -192,42 +425,42 @@ class request_handler(BaseHTTPRequestHandler):
                 return None
 
         if route_path_type == "handler":
-            handler(self)
+            self.call_handler(handler)
         else:
-            self.resource_handler(route_path)
+            with accounting.phase("file"):
+                self.resource_handler(route_path)
+        return None
+
+    def call_handler(self, handler) -> None:
+        """Calls the handler, responding for it if the request body was unusable."""
+        try:
+            with accounting.phase("handler"):
+                handler(self)
+        except RequestBodyError as err:
+            self.send_error(err.status, str(err))
         return None
 
     def resource_handler(self, resource) -> None:
         # UPDATE: Consider sending the file directly from the kernal to the client
         # in order to maximize preformance
         try:
-            file_info = backendMemory.retrieve_data(
-                "loaded_files", resource["path"]
-            )
-            self.send_http_response(
-                HTTPStatus.OK, file_info, body_type=resource["type"]
+            # Concurrent requests for a file that isn't cached read it only once,
+            # and an expired file keeps being served while it is read again.
+            file_info = backendMemory.get_or_compute(
+                "loaded_files",
+                resource["path"],
+                lambda: _read_file(resource["path"], resource["bytes"]),
+                LOADED_FILES_TTL,
+                stale_ttl=LOADED_FILES_STALE_TTL,
             )
-            return None
-        except (ObjectNotFoundError, DataExpiredError):
-            pass
-        (open_mode := "rb") if resource["bytes"] else (open_mode := "r")
-        try:
-            with open(resource["path"], open_mode) as f:
-                file_info = f.read()
-                self.send_http_response(
-                    HTTPStatus.OK, file_info, body_type=resource["type"]
-                )
-                # UPDATE: Expiring this won't help with anything since the backendMemory
-                # gets rid of data lazily. The memory class should not be lazy in order
-                # to be more memory efficient.
-                backendMemory.add_data(
-                    "loaded_files", resource["path"], 30 * 60, file_info
-                )
-                return None
         except (OSError, IOError, FileNotFoundError) as err:
             logger.error(err, exc_info=True)
             self.send_http_response(HTTPStatus.INTERNAL_SERVER_ERROR)
             return None
+        self.send_http_response(
+            HTTPStatus.OK, file_info, body_type=resource["type"]
+        )
+        return None
 
     def set_cookie(
         self,
@@ -1,12 +1,21 @@
+from __future__ import annotations
+
 from typing import TYPE_CHECKING
 import logging
+import os
 from backend.handlers.dbWrapper import server_interact_with_row
-from backend.memory import ObjectNotFoundError, DataExpiredError, Memory
+from backend.memory import ShardedMemory
+from backend.memory_backends import create_memory
+from backend.metrics import counter, gauge
+from backend.accounting import timed_phase
 from secrets import token_urlsafe
-from time import time
 from http import HTTPStatus
 from http.cookies import BaseCookie, _unquote, _quote
-import json
+from backend.router.request_body import (
+    RequestBody,
+    RequestBodyError,
+    get_max_body_size,
+)
 
 
 class SimpleCookie(BaseCookie):
@@ -32,15 +41,71 @@ class SimpleCookie(BaseCookie):
 if TYPE_CHECKING:
     from backend.router.RequestHandler import request_handler
 
-backendMemory = Memory("backendMemory")
-backendMemory.add_container("get_request_limiting")
-backendMemory.add_container("request_limiting")
-
 logger = logging.getLogger(__name__)
 
-REQUESTS_RATE_LIMITING_CAP = 50
-GET_REQUESTS_RATE_LIMITING_CAP = 500
+# Every new public_id gets its own rate limiting entry, so these containers are
+# bounded to keep cookie spraying from growing memory without limit. The entries
+# closest to expiring are the least useful ones and get evicted first.
+RATE_LIMITING_MAX_ENTRIES = 100_000
+
+# Sharded so it stays consistent if requests are ever handled on several threads.
+backendMemory = ShardedMemory("backendMemory")
+# State that has to be the same for every worker. It is only shared between
+# processes when MEMORY_BACKEND is 'sqlite', see backend.memory_backends.
+sharedMemory = create_memory("sharedMemory")
+sharedMemory.add_container(
+    "get_request_limiting", max_entries=RATE_LIMITING_MAX_ENTRIES, policy="ttl"
+)
+sharedMemory.add_container(
+    "request_limiting", max_entries=RATE_LIMITING_MAX_ENTRIES, policy="ttl"
+)
+
+
+def _memory_statistic(key: str):
+    """Collects a container_statistics value of every container of both
+    memories, for the metrics."""
+
+    def collect() -> dict:
+        values = {}
+        for memory in (backendMemory, sharedMemory):
+            for container, statistics in memory.memory_statistics().items():
+                values[(memory.memoryName, container)] = statistics[key]
+        return values
+
+    return collect
+
+
+for _name, _key, _metric, _help in (
+    ("memory_container_entries", "entries", gauge, "Entries stored"),
+    ("memory_container_bytes", "bytes", gauge, "Estimated size of the entries"),
+    ("memory_container_hits_total", "hits", counter, "Reads that found data"),
+    ("memory_container_misses_total", "misses", counter, "Reads that found none"),
+    ("memory_container_evictions_total", "evictions", counter, "Entries evicted"),
+    (
+        "memory_container_expirations_total",
+        "expirations",
+        counter,
+        "Entries removed after expiring",
+    ),
+):
+    _metric(
+        _name,
+        f"{_help}, by memory and container.",
+        ("memory", "container"),
+        function=_memory_statistic(_key),
+    )
+
+# Requests a client may make per RATE_LIMITING_INTERVAL, load tests raise them.
+REQUESTS_RATE_LIMITING_CAP = int(os.environ.get("REQUESTS_RATE_LIMITING_CAP", "50"))
+GET_REQUESTS_RATE_LIMITING_CAP = int(
+    os.environ.get("GET_REQUESTS_RATE_LIMITING_CAP", "500")
+)
 RATE_LIMITING_INTERVAL = 30
+# Used for routes that don't declare their own limit in routes.max_body_sizes
+DEFAULT_MAX_BODY_SIZE = 1500
+# The whole body has to arrive within this many seconds
+REQUEST_BODY_TIMEOUT = 10
+REQUEST_BODY_READ_SIZE = 16 * 1024
 ROLES = {
     "public": 0,
     "account": 1,
@@ -49,6 +114,7 @@ ROLES = {
 }
 
 
+@timed_phase("firewall")
 def server_firewall(self: request_handler) -> bool:
     """Responsible for setting security, parsing, and setting the
     context for the request.
@@ -74,9 +140,7 @@ def server_firewall(self: request_handler) -> bool:
     # Parsing request
     _parse_path(self)
 
-    if self.command not in ["HEAD", "GET"]:
-        return parse_request_body(self)
-    return True
+    return server_prepare_request_body(self)
 
 
 def _increment_rate_limit(
@@ -89,42 +153,18 @@ def _increment_rate_limit(
     Invoked by the server firewall.
     """
     request_identifier = get_request_identifier(self)
-    try:
-        requests_amount = backendMemory.retrieve_data(
-            container, request_identifier
-        )
-        payload = backendMemory.memory[container].get(request_identifier)
-        if requests_amount >= cap:
-            remaining = 0
-            if payload is not None:
-                remaining = max(
-                    0, int(payload.expiration_time - time())
-                )
-            self.send_error(
-                HTTPStatus.TOO_MANY_REQUESTS,
-                f"Try again in {remaining} seconds.",
-            )
-            return False
-        if payload is not None:
-            payload.data = requests_amount + 1
-        else:
-            backendMemory.add_data(
-                container,
-                request_identifier,
-                RATE_LIMITING_INTERVAL,
-                requests_amount + 1,
-                overwrite=True,
-            )
-        return True
-    except (ObjectNotFoundError, DataExpiredError):
-        backendMemory.add_data(
-            container,
-            request_identifier,
-            RATE_LIMITING_INTERVAL,
-            1,
-            overwrite=True,
+    # A single atomic step, so concurrent requests can't lose counts.
+    requests_amount = sharedMemory.increment(
+        container, request_identifier, RATE_LIMITING_INTERVAL
+    )
+    if requests_amount > cap:
+        remaining = sharedMemory.time_to_live(container, request_identifier)
+        self.send_error(
+            HTTPStatus.TOO_MANY_REQUESTS,
+            f"Try again in {remaining} seconds.",
         )
-        return True
+        return False
+    return True
 
 
 def _parse_path(self: request_handler) -> None:
@@ -169,41 +209,33 @@ def get_request_identifier(self: request_handler):
     return self.cookies["public_id"]
 
 
-def parse_request_body(self: request_handler) -> bool:
+def server_prepare_request_body(self: request_handler) -> bool:
     """
-    Parses the request body and sets it as an attribute of the class under
-    self.parsed_request_body
+    Attaches the request body to the class under self.request_body without reading
+    it. Handlers read it lazily through self.parsed_request_body.
+
+    Requests whose headers already show the body can't be accepted are rejected.
     """
-    length = self.headers.get("Content-Length", None)
-    if length is None or length == 0:
-        logger.debug(f"length is {length}", stack_info=True)
-        self.parsed_request_body = ""
-        return True
-    try:
-        length = int(length)
-    except (ValueError, TypeError):
-        self.send_error(
-            HTTPStatus.BAD_REQUEST, "Invalid content-length header"
-        )
-        return False
+    # Imported here since the routes import the firewall.
+    from backend.router.routes import max_body_sizes
 
-    if length > 1500:
-        self.send_error(
-            HTTPStatus.BAD_REQUEST, "The request body is too long"
-        )
-        return False
-    body = self.rfile.read(length).decode()
+    self.request_body = RequestBody(
+        self,
+        max_size=get_max_body_size(
+            max_body_sizes, self.command, self.path, DEFAULT_MAX_BODY_SIZE
+        ),
+        timeout=REQUEST_BODY_TIMEOUT,
+        chunk_size=REQUEST_BODY_READ_SIZE,
+    )
     try:
-        body = json.loads(body)
-    except (json.JSONDecodeError, UnicodeDecodeError) as err:
-        print(err)
-        self.send_error(HTTPStatus.BAD_REQUEST, "Expected format is JSON")
+        self.request_body.inspect_headers()
+    except RequestBodyError as err:
+        self.send_error(err.status, str(err))
         return False
-
-    self.parsed_request_body = body
     return True
 
 
+@timed_phase("auth")
 def authenticate_request(self: request_handler) -> bool:
     """Uses the database to fully authenticate request then sets user information
     as a class attribute.
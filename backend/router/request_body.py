@@ -0,0 +1,289 @@
+"""
+Reads and parses request bodies lazily.
+
+The firewall only inspects the headers and attaches a RequestBody to the request.
+Nothing is read from the socket until a handler asks for the body, and the body is
+read and parsed at most once. Reads are incremental and share a single deadline,
+so a client trickling bytes in (slowloris) can't hold the backend for long.
+
+Both Content-Length and chunked transfer-encoding bodies are supported.
+"""
+
+from __future__ import annotations
+
+import json
+from http import HTTPStatus
+from socket import timeout as SocketTimeout
+from time import monotonic
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from backend.router.RequestHandler import request_handler
+
+# Chunk-size lines are tiny, anything longer is not a real client.
+MAX_CHUNK_LINE_LENGTH = 1024
+MAX_TRAILER_LINES = 32
+
+
+class RequestBodyError(Exception):
+    """This is the base class for all request body errors.
+
+    The status is what should be sent back to the client.
+    """
+
+    status = HTTPStatus.BAD_REQUEST
+
+    pass
+
+
+class MalformedBodyError(RequestBodyError):
+    """The body, or its framing, is not valid."""
+
+    status = HTTPStatus.BAD_REQUEST
+
+    pass
+
+
+class BodyTooLargeError(RequestBodyError):
+    """The body is larger than the route allows."""
+
+    status = HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+    pass
+
+
+class BodyTimeoutError(RequestBodyError):
+    """The client didn't send the whole body before the deadline."""
+
+    status = HTTPStatus.REQUEST_TIMEOUT
+
+    pass
+
+
+class RequestBody:
+    """
+    The body of a single request, read from the socket on first use.
+
+    Use raw() for the bytes, json() for the parsed JSON, or iter_chunks() to
+    stream the body without holding all of it. Once a body has been streamed it
+    can't be read again.
+    """
+
+    def __init__(
+        self,
+        request: request_handler,
+        /,
+        *,
+        max_size: int,
+        timeout: float,
+        chunk_size: int,
+    ):
+        self._request = request
+        self.max_size = max_size
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+
+        self.content_length: int | None = None
+        self.chunked = False
+        self._raw: bytes | None = None
+        self._parsed = None
+        self._is_parsed = False
+        self._consumed = False
+
+    def inspect_headers(self) -> None:
+        """Checks the framing headers without reading anything.
+
+        Raises a RequestBodyError when the body can be rejected up front.
+        """
+        headers = self._request.headers
+        transfer_encoding = headers.get("Transfer-Encoding")
+        length = headers.get("Content-Length")
+
+        if transfer_encoding is not None:
+            if transfer_encoding.strip().lower() != "chunked":
+                raise MalformedBodyError("Unsupported transfer-encoding")
+            if length is not None:
+                # Having both is how request smuggling starts.
+                raise MalformedBodyError(
+                    "Content-length and transfer-encoding are both set"
+                )
+            self.chunked = True
+            return None
+
+        if length is None:
+            self.content_length = 0
+            return None
+        try:
+            self.content_length = int(length)
+        except (ValueError, TypeError):
+            raise MalformedBodyError("Invalid content-length header")
+        if self.content_length < 0:
+            raise MalformedBodyError("Invalid content-length header")
+        if self.content_length > self.max_size:
+            raise BodyTooLargeError("The request body is too long")
+        return None
+
+    def is_empty(self) -> bool:
+        return not self.chunked and not self.content_length
+
+    def iter_chunks(self):
+        """Yields the body as bytes as it arrives from the client.
+
+        Every read is bound by the same deadline and the total is capped at
+        max_size.
+        """
+        if self._consumed:
+            raise RuntimeError("The request body has already been read.")
+        self._consumed = True
+        if self.is_empty():
+            return
+        connection = self._request.connection
+        previous_timeout = connection.gettimeout()
+        deadline = monotonic() + self.timeout
+        try:
+            if self.chunked:
+                yield from self._iter_chunked(connection, deadline)
+            else:
+                yield from self._iter_fixed(connection, deadline)
+        except (SocketTimeout, TimeoutError):
+            raise BodyTimeoutError("Timed out reading the request body")
+        finally:
+            connection.settimeout(previous_timeout)
+
+    def iter_lines(self, max_line_length: int):
+        """Yields the body line by line without the line endings, for
+        newline-delimited formats.
+
+        Lines longer than max_line_length are skipped and yielded as None so the
+        caller can still report them by line number.
+        """
+        pending = b""
+        overflowed = False
+        for chunk in self.iter_chunks():
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                if overflowed:
+                    overflowed = False
+                    yield None
+                elif len(line) > max_line_length:
+                    yield None
+                else:
+                    yield line.rstrip(b"\r")
+            if len(pending) > max_line_length:
+                overflowed = True
+                pending = b""
+        if overflowed:
+            yield None
+        elif pending:
+            yield pending.rstrip(b"\r")
+
+    def raw(self) -> bytes:
+        """Returns the whole body as bytes, reading it on first use."""
+        if self._raw is None:
+            self._raw = b"".join(self.iter_chunks())
+        return self._raw
+
+    def json(self):
+        """Returns the parsed JSON body, or None if there is no body.
+
+        The body is parsed the first time this is called only.
+        """
+        if not self._is_parsed:
+            raw = self.raw()
+            if raw:
+                try:
+                    self._parsed = json.loads(raw)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    raise MalformedBodyError("Expected format is JSON")
+            self._is_parsed = True
+        return self._parsed
+
+    # -- Reading
+    def _read(self, connection, deadline: float, size: int) -> bytes:
+        """A single read of at most size bytes, bounded by the deadline."""
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise BodyTimeoutError("Timed out reading the request body")
+        connection.settimeout(remaining)
+        return self._request.rfile.read1(size)
+
+    def _read_line(self, connection, deadline: float) -> bytes:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise BodyTimeoutError("Timed out reading the request body")
+        connection.settimeout(remaining)
+        line = self._request.rfile.readline(MAX_CHUNK_LINE_LENGTH + 1)
+        if len(line) > MAX_CHUNK_LINE_LENGTH:
+            raise MalformedBodyError("Chunk line is too long")
+        if not line.endswith(b"\n"):
+            raise MalformedBodyError("Connection closed mid-body")
+        return line
+
+    def _iter_fixed(self, connection, deadline: float):
+        remaining = self.content_length
+        while remaining > 0:
+            data = self._read(
+                connection, deadline, min(self.chunk_size, remaining)
+            )
+            if not data:
+                raise MalformedBodyError("Connection closed mid-body")
+            remaining -= len(data)
+            yield data
+
+    def _iter_chunked(self, connection, deadline: float):
+        total = 0
+        while True:
+            size_line = self._read_line(connection, deadline)
+            try:
+                size = int(size_line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise MalformedBodyError("Invalid chunk size")
+            if size < 0:
+                raise MalformedBodyError("Invalid chunk size")
+            if size == 0:
+                break
+            total += size
+            if total > self.max_size:
+                raise BodyTooLargeError("The request body is too long")
+            while size > 0:
+                data = self._read(
+                    connection, deadline, min(self.chunk_size, size)
+                )
+                if not data:
+                    raise MalformedBodyError("Connection closed mid-body")
+                size -= len(data)
+                yield data
+            if self._read_line(connection, deadline).strip():
+                raise MalformedBodyError("Chunk is longer than its size")
+
+        # Trailers are read and discarded.
+        for _ in range(MAX_TRAILER_LINES):
+            if not self._read_line(connection, deadline).strip():
+                return
+        raise MalformedBodyError("Too many trailer lines")
+
+
+def get_max_body_size(
+    limits: dict, method: str, path: str, default: int
+) -> int:
+    """
+    Returns the maximum body size of the route from the limits table.
+
+    Exact paths win, then the longest '/*' prefix pattern, then the default.
+    """
+    method_limits = limits.get(method)
+    if not method_limits:
+        return default
+    limit = method_limits.get(path)
+    if limit is not None:
+        return limit
+    best_prefix = ""
+    for pattern, pattern_limit in method_limits.items():
+        if not pattern.endswith("/*"):
+            continue
+        prefix = pattern[:-1]
+        if path.startswith(prefix) and len(prefix) > len(best_prefix):
+            best_prefix = prefix
+            limit = pattern_limit
+    return default if limit is None else limit
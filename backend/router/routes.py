@@ -23,6 +23,7 @@ from backend.handlers.tasks import (
     patch_task_label_handler,
     delete_task_label_handler,
     post_task_label_handler,
+    get_user_tasks_handler,
 )
 from backend.handlers.accounts import (
     get_account_handler,
@@ -33,6 +34,16 @@ from backend.handlers.accounts import (
     post_session_handler,
     delete_session_handler,
 )
+from backend.handlers.diagnostics import (
+    get_metrics_handler,
+    post_profiler_start_handler,
+    post_profiler_stop_handler,
+    post_tracemalloc_snapshot_handler,
+    get_tracemalloc_diff_handler,
+    post_tracemalloc_stop_handler,
+    get_memory_containers_handler,
+    get_sql_statements_handler,
+)
 
 # This should only contain routes that exist.
 # This also returns resources, but resources may need to be handled seperately for
@@ -113,12 +124,29 @@ routes = {
         ),
         "/account/information": (get_account_handler, ROLES["account"]),
         "/session": (get_session_handler, ROLES["account"]),
+        "/metrics": (get_metrics_handler, ROLES["developer"]),
+        "/debug/tracemalloc/diff": (
+            get_tracemalloc_diff_handler,
+            ROLES["developer"],
+        ),
+        "/debug/memory": (get_memory_containers_handler, ROLES["developer"]),
+        "/debug/sql": (get_sql_statements_handler, ROLES["developer"]),
     },
     "POST": {
         "/task/create": (post_task_handler, ROLES["account"]),
         "/task-label/create": (post_task_label_handler, ROLES["account"]),
         "/account/create": (post_account_handler, ROLES["public"]),
         "/session/create": (post_session_handler, ROLES["public"]),
+        "/debug/profiler/start": (post_profiler_start_handler, ROLES["developer"]),
+        "/debug/profiler/stop": (post_profiler_stop_handler, ROLES["developer"]),
+        "/debug/tracemalloc/snapshot": (
+            post_tracemalloc_snapshot_handler,
+            ROLES["developer"],
+        ),
+        "/debug/tracemalloc/stop": (
+            post_tracemalloc_stop_handler,
+            ROLES["developer"],
+        ),
     },
     "PATCH": {
         "/task/update": (patch_task_handler, ROLES["account"]),
@@ -135,3 +163,43 @@ routes = {
         "/session/delete": (delete_session_handler, ROLES["account"]),
     },
 }
+
+
+# Maximum request body size in bytes, per method and route. Routes that aren't
+# listed here fall back to the firewall's DEFAULT_MAX_BODY_SIZE.
+# A path ending with '/*' applies to every route under that prefix.
+max_body_sizes = {
+    "POST": {
+        "/api/tasks": 8 * 1024,
+        # NDJSON, read line by line so this doesn't need to fit in memory
+        "/api/tasks/import": 64 * 1024 * 1024,
+    },
+    "PATCH": {
+        "/api/tasks/*": 8 * 1024,
+    },
+}
+
+
+# Route classes of admission control (backend/admission.py), per method and route.
+# Resources are 'static' and every other route is 'api' unless it's listed here.
+route_classes = {
+    "GET": {
+        "/session": "static",
+        "/metrics": "static",
+    },
+    "POST": {
+        "/account/create": "auth",
+        "/session/create": "auth",
+    },
+    "PATCH": {
+        # Hashes the new password
+        "/account/update": "auth",
+    },
+}
+# Routes that search when they get a non-empty query parameter of this name, their
+# requests are in the 'search' class then.
+search_routes = {
+    "GET": {
+        "/api/tasks": "query",
+    },
+}
@@ -0,0 +1,332 @@
+"""Provides a small, no-dependancy schema validator for parsed JSON request bodies.
+
+Schemas are declared once, at import time, and compiled into closures. Validating
+a request body is then just a walk over the already-parsed value; nothing gets
+re-serialized and no parser gets rebuilt per request.
+
+### Declaring schemas
+>>> LOGIN_SCHEMA = compile_schema({"email": str, "password": str})
+>>> LOGIN_SCHEMA({"email": "a@b.c", "password": 1})
+[SchemaViolation(path='password', message='Expected string, got integer')]
+
+- A type (str, int, float, bool, type(None)) checks the JSON type of the value.
+- A dict is an object with exactly those keys, see Object for extra keys.
+- ListOf, MapOf, Nullable and NotRequired can be nested inside each other.
+"""
+
+from typing import Any, Callable, NamedTuple
+
+
+class SchemaError(Exception):
+    """This is the base class for all schema errors."""
+
+    pass
+
+
+class SchemaDefinitionError(SchemaError):
+    """The declared schema can not be compiled."""
+
+    pass
+
+
+class SchemaViolation(NamedTuple):
+    """A single reason a value does not match its schema.
+
+    The path is empty for the top-level value, otherwise it looks like
+    'labels[2]' or 'email'.
+    """
+
+    path: str
+    message: str
+
+    def __str__(self) -> str:
+        if not self.path:
+            return self.message
+        return f"{self.path}: {self.message}"
+
+
+# -- Declarations
+
+
+class Object:
+    """An object with the given fields. Unknown keys fail unless allow_extra is
+    True."""
+
+    def __init__(self, fields: dict, /, *, allow_extra: bool = False):
+        self.fields = fields
+        self.allow_extra = allow_extra
+
+
+class ListOf:
+    """A list where every item matches the item schema."""
+
+    def __init__(
+        self,
+        item,
+        /,
+        *,
+        min_length: int | None = None,
+        max_length: int | None = None,
+    ):
+        self.item = item
+        self.min_length = min_length
+        self.max_length = max_length
+
+
+class MapOf:
+    """An object with arbitrary string keys where every value matches the value
+    schema."""
+
+    def __init__(self, value, /, *, max_length: int | None = None):
+        self.value = value
+        self.max_length = max_length
+
+
+class Nullable:
+    """Allows the value to be null in addition to matching the schema."""
+
+    def __init__(self, schema, /):
+        self.schema = schema
+
+
+class NotRequired:
+    """Marks a field of an Object as optional."""
+
+    def __init__(self, schema, /):
+        self.schema = schema
+
+
+# -- Compilation
+
+# JSON names are used in the messages since those are what the client sent.
+_TYPE_NAMES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    dict: "object",
+    type(None): "null",
+}
+
+# json.loads only ever produces these exact types, so checking type() with 'is'
+# is both stricter and faster than isinstance (a bool is not an integer here).
+_ACCEPTED_TYPES = {
+    str: (str,),
+    int: (int,),
+    float: (int, float),
+    bool: (bool,),
+    type(None): (type(None),),
+}
+
+# A check returns None when the value is valid, otherwise a list of
+# (path_parts, message). Parents prepend their key to path_parts so that no
+# path strings are built unless validation actually fails.
+_Check = Callable[[Any], list | None]
+
+
+def _type_name(value) -> str:
+    return _TYPE_NAMES.get(type(value), type(value).__name__)
+
+
+def _compile_type(expected: type) -> _Check:
+    accepted = _ACCEPTED_TYPES.get(expected)
+    if accepted is None:
+        raise SchemaDefinitionError(f"Unsupported type '{expected}'.")
+    expected_name = _TYPE_NAMES[expected]
+
+    if len(accepted) == 1:
+        only = accepted[0]
+
+        def check(value):
+            if type(value) is only:
+                return None
+            return [((), f"Expected {expected_name}, got {_type_name(value)}")]
+
+        return check
+
+    def check(value):
+        if type(value) in accepted:
+            return None
+        return [((), f"Expected {expected_name}, got {_type_name(value)}")]
+
+    return check
+
+
+def _compile_object(schema: Object) -> _Check:
+    required = []
+    optional = []
+    for key, field_schema in schema.fields.items():
+        if not isinstance(key, str):
+            raise SchemaDefinitionError(f"Object keys must be strings: {key}")
+        if isinstance(field_schema, NotRequired):
+            optional.append((key, _compile(field_schema.schema)))
+        else:
+            required.append((key, _compile(field_schema)))
+    known_keys = frozenset(schema.fields)
+    allow_extra = schema.allow_extra
+
+    def check(value):
+        if type(value) is not dict:
+            return [((), f"Expected object, got {_type_name(value)}")]
+        errors = None
+        for key, field_check in required:
+            if key not in value:
+                errors = errors or []
+                errors.append(((key,), "Field is required"))
+                continue
+            field_errors = field_check(value[key])
+            if field_errors is not None:
+                errors = errors or []
+                errors.extend(
+                    ((key, *path), msg) for path, msg in field_errors
+                )
+        for key, field_check in optional:
+            if key not in value:
+                continue
+            field_errors = field_check(value[key])
+            if field_errors is not None:
+                errors = errors or []
+                errors.extend(
+                    ((key, *path), msg) for path, msg in field_errors
+                )
+        if not allow_extra and not known_keys.issuperset(value):
+            errors = errors or []
+            for key in value:
+                if key not in known_keys:
+                    errors.append(((key,), "Unknown field"))
+        return errors
+
+    return check
+
+
+def _compile_length(
+    min_length: int | None, max_length: int | None
+) -> Callable[[int], str | None]:
+    def check_length(length):
+        if min_length is not None and length < min_length:
+            return f"Expected at least {min_length} items, got {length}"
+        if max_length is not None and length > max_length:
+            return f"Expected at most {max_length} items, got {length}"
+        return None
+
+    return check_length
+
+
+def _compile_list(schema: ListOf) -> _Check:
+    item_check = _compile(schema.item)
+    check_length = _compile_length(schema.min_length, schema.max_length)
+
+    def check(value):
+        if type(value) is not list:
+            return [((), f"Expected array, got {_type_name(value)}")]
+        length_error = check_length(len(value))
+        if length_error is not None:
+            return [((), length_error)]
+        errors = None
+        for index, item in enumerate(value):
+            item_errors = item_check(item)
+            if item_errors is not None:
+                errors = errors or []
+                errors.extend(
+                    ((index, *path), msg) for path, msg in item_errors
+                )
+        return errors
+
+    return check
+
+
+def _compile_map(schema: MapOf) -> _Check:
+    value_check = _compile(schema.value)
+    check_length = _compile_length(None, schema.max_length)
+
+    def check(value):
+        if type(value) is not dict:
+            return [((), f"Expected object, got {_type_name(value)}")]
+        length_error = check_length(len(value))
+        if length_error is not None:
+            return [((), length_error)]
+        errors = None
+        for key, item in value.items():
+            item_errors = value_check(item)
+            if item_errors is not None:
+                errors = errors or []
+                errors.extend(((key, *path), msg) for path, msg in item_errors)
+        return errors
+
+    return check
+
+
+def _compile_nullable(schema: Nullable) -> _Check:
+    inner_check = _compile(schema.schema)
+
+    def check(value):
+        if value is None:
+            return None
+        return inner_check(value)
+
+    return check
+
+
+def _compile(schema) -> _Check:
+    if isinstance(schema, type):
+        return _compile_type(schema)
+    if isinstance(schema, dict):
+        return _compile_object(Object(schema))
+    if isinstance(schema, Object):
+        return _compile_object(schema)
+    if isinstance(schema, ListOf):
+        return _compile_list(schema)
+    if isinstance(schema, MapOf):
+        return _compile_map(schema)
+    if isinstance(schema, Nullable):
+        return _compile_nullable(schema)
+    if isinstance(schema, NotRequired):
+        raise SchemaDefinitionError(
+            "NotRequired can only be used for the fields of an object."
+        )
+    raise SchemaDefinitionError(f"Can not compile schema '{schema}'.")
+
+
+def _format_path(parts: tuple) -> str:
+    path = ""
+    for part in parts:
+        if isinstance(part, int):
+            path += f"[{part}]"
+        elif path:
+            path += f".{part}"
+        else:
+            path = part
+    return path
+
+
+class CompiledSchema:
+    """A schema that has been compiled into a validator.
+
+    Calling it returns a list of SchemaViolation, an empty list means the value is
+    valid.
+    """
+
+    __slots__ = ("schema", "_check")
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._check = _compile(schema)
+
+    def __call__(self, value) -> list[SchemaViolation]:
+        errors = self._check(value)
+        if errors is None:
+            return []
+        return [
+            SchemaViolation(_format_path(path), message)
+            for path, message in errors
+        ]
+
+    def is_valid(self, value) -> bool:
+        return self._check(value) is None
+
+
+def compile_schema(schema) -> CompiledSchema:
+    """Compiles the declared schema, raises SchemaDefinitionError if the
+    declaration is invalid."""
+    return CompiledSchema(schema)
@@ -0,0 +1,74 @@
+"""
+The steps of starting the backend, run in this order by backend.main:
+
+1. load_environment: reads .env, before anything reads its settings.
+2. configure_logging (backend.structured_logging).
+3. bootstrap_database: opens the database, which starts its writer thread, and
+   creates every missing table in one pass, including the one of the sqlite memory
+   backend. Importing a module never touches either database.
+4. import_server: imports the request handler and everything it routes to. Modules
+   read their settings from the environment when imported, so this comes after 1.
+5. preload_modules: once the server is listening, imports the modules that are
+   only needed by some requests, such as bcrypt, on a background thread, so neither
+   startup nor the first of those requests waits for them.
+
+Use `python -m benchmarks.import_time` to check what importing costs.
+"""
+
+import logging
+import threading
+from importlib import import_module
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Imported lazily by the code using them, see preload_modules.
+PRELOADED_MODULES = ("bcrypt", "email_validator", "backend.api.tasks")
+
+
+def load_environment(path: str = ".env") -> bool:
+    """Loads the variables of the .env file into the environment, without
+    overriding ones already set. Returns False if there is no such file."""
+    if not Path(path).is_file():
+        return False
+    # Only imported when there is a file to read, deployments set the variables.
+    from dotenv import load_dotenv
+
+    load_dotenv(path)
+    return True
+
+
+def bootstrap_database() -> None:
+    """Creates the tables that don't exist yet."""
+    from backend.db.connections import get_database
+    from backend.db.tasks import init_tasks_table
+    from backend.handlers.dbWrapper import init_accounts_table
+    from backend.memory_backends import init_memory_database
+
+    get_database()
+    init_accounts_table()
+    init_tasks_table()
+    init_memory_database()
+    return None
+
+
+def import_server():
+    """Imports and returns the request handler class."""
+    from backend.router.RequestHandler import request_handler
+
+    return request_handler
+
+
+def preload_modules(modules: tuple = PRELOADED_MODULES) -> threading.Thread:
+    """Imports the modules on a daemon thread and returns the thread."""
+
+    def preload():
+        for module in modules:
+            try:
+                import_module(module)
+            except ImportError:
+                logger.warning("Could not preload %s", module, exc_info=True)
+
+    thread = threading.Thread(target=preload, name="preload-modules", daemon=True)
+    thread.start()
+    return thread
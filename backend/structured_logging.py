@@ -0,0 +1,200 @@
+"""
+Structured logging, written by a background thread.
+
+configure_logging() puts a QueueHandler on the root logger. Logging a message only
+formats it and puts it on a queue, a QueueListener thread writes it out as a JSON
+line, so a slow stderr or disk never holds up a request. Fields passed with
+extra= become fields of the line:
+
+    logger.info("Task created", extra={"user_id": user_id})
+    {"time": "2024-01-01T12:00:00.000Z", "level": "INFO", "logger": "backend.api",
+     "message": "Task created", "user_id": 7}
+
+If the queue is full, messages are dropped instead of waiting, and a noisy message
+is let through at most LOG_RATE_LIMIT times a minute. The ones held back are counted
+in the 'suppressed' field of the next one let through.
+
+Configured with environment variables:
+- LOG_LEVEL: level of the root logger (default: INFO)
+- LOG_LEVELS: levels of single loggers, like 'backend.db=DEBUG,backend.access=WARNING'
+- LOG_RATE_LIMIT: times a minute the same message may be logged, 0 for no limit
+  (default: 20)
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from time import monotonic
+
+MAX_QUEUED_RECORDS = 10_000
+RATE_LIMIT_INTERVAL = 60
+# Messages tracked by the rate limit before it starts over.
+MAX_RATE_LIMITED_MESSAGES = 10_000
+# One line per request is expected from these, so they're never rate limited.
+UNLIMITED_LOGGERS = frozenset({"backend.access"})
+
+# Attributes every LogRecord has. Anything else came from extra= and is a field.
+_RECORD_ATTRIBUTES = frozenset(
+    vars(logging.LogRecord("", 0, "", 0, "", (), None))
+) | {"message", "asctime", "taskName", "suppressed"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single line of JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).strftime(
+                "%Y-%m-%dT%H:%M:%S.%f"
+            )[:-3]
+            + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets the same message, by logger and unformatted text, through at most burst
+    times every interval seconds. The first one let through after some were held
+    back gets their count as record.suppressed.
+    """
+
+    def __init__(self, burst: int, interval: float = RATE_LIMIT_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {}  # (logger, msg) -> [window start, count, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.name in UNLIMITED_LOGGERS:
+            return True
+        key = (record.name, str(record.msg))
+        now = monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                if len(self._windows) >= MAX_RATE_LIMITED_MESSAGES:
+                    self._windows.clear()
+                window = self._windows[key] = [now, 0, 0]
+            elif now - window[0] >= self.interval:
+                window[0] = now
+                window[1] = 0
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            record.suppressed, window[2] = window[2], 0
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Drops records when the queue is full instead of waiting for the writer."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The message and traceback are formatted here, since the arguments and the
+        # traceback may change or be gone by the time the writer gets to it.
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        return None
+
+
+def parse_levels(value: str) -> dict:
+    """Parses 'name=LEVEL,name=LEVEL' into {name: LEVEL}."""
+    levels = {}
+    for pair in value.split(","):
+        if not pair.strip():
+            continue
+        name, _, level = pair.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(
+    *,
+    level: str | None = None,
+    levels: dict | None = None,
+    rate_limit: int | None = None,
+    stream=None,
+) -> QueueListener:
+    """
+    Sends every log record through the queue to a JSON writer thread. Arguments
+    that aren't given are read from the environment. Calling this again replaces
+    the previous configuration.
+    """
+    global _listener
+    level = level or os.environ.get("LOG_LEVEL", "INFO").upper()
+    if levels is None:
+        levels = parse_levels(os.environ.get("LOG_LEVELS", ""))
+    if rate_limit is None:
+        rate_limit = int(os.environ.get("LOG_RATE_LIMIT", "20"))
+
+    stop_logging()
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(JsonFormatter())
+    log_queue = queue.Queue(MAX_QUEUED_RECORDS)
+    handler = _NonBlockingQueueHandler(log_queue)
+    if rate_limit > 0:
+        handler.addFilter(RateLimitFilter(rate_limit))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name, logger_level in levels.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener = QueueListener(log_queue, writer, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging() -> None:
+    """Writes out every queued record and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    return None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1 @@
+"""Benchmarks for the backend, run each module with python -m benchmarks.<name>."""
@@ -0,0 +1,276 @@
+"""
+Microbenchmarks for the code every request goes through.
+
+Covers the firewall (cookie parsing, rate limiting, path parsing, the whole
+server_firewall), Memory add_data/retrieve_data as containers grow,
+authenticate_request as the accounts table grows, and db.tasks.get_tasks as a
+user's task list grows. Random inputs come from a fixed seed, and everything runs
+against a temporary database.
+
+Results can be saved and compared against an earlier run:
+
+    python -m benchmarks.hot_paths --save before.json
+    python -m benchmarks.hot_paths --compare before.json
+
+With --compare the exit status is 1 if any benchmark got slower than --threshold.
+
+Usage: python -m benchmarks.hot_paths [--only GROUP ...] [--sizes N ...]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import timeit
+from itertools import cycle
+from pathlib import Path
+
+# The backend reads SQLITE3_PATH when it connects, this is set first to be safe.
+_DIRECTORY = tempfile.TemporaryDirectory()
+os.environ["SQLITE3_PATH"] = str(Path(_DIRECTORY.name) / "hot_paths.db")
+os.environ["MEMORY_BACKEND"] = "local"
+
+from backend.memory import Memory  # noqa: E402
+from backend.router import firewall  # noqa: E402
+from backend.router.RequestHandler import request_handler  # noqa: E402
+from backend.startup import bootstrap_database  # noqa: E402
+
+bootstrap_database()
+
+GROUPS = ["firewall", "memory", "auth", "tasks"]
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+# Random inputs are drawn up front and cycled through while timing.
+PICKS = 100_000
+
+
+class BenchmarkRequest:
+    """The parts of request_handler that the firewall and authentication use,
+    without a socket."""
+
+    set_cookie = request_handler.set_cookie
+    remove_cookie = request_handler.remove_cookie
+
+    def __init__(self, path: str, command: str = "GET", cookie: str = ""):
+        self.path = path
+        self.command = command
+        self.headers = {"cookie": cookie} if cookie else {}
+        self.response_headers = {}
+
+    def send_error(self, status, message=None):
+        raise RuntimeError(f"Unexpected error response {status}: {message}")
+
+    def send_http_response(self, status, *args, **kwargs):
+        raise RuntimeError(f"Unexpected response {status}")
+
+
+def measure(function, repeat: int) -> float:
+    """Returns the best time of a single call, in microseconds."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1e6
+
+
+# -- Benchmarks
+# Each yields (name, function) pairs, every call of function is one operation.
+def firewall_benchmarks(rng: random.Random, sizes: list):
+    cookies = [f"public_id=client{rng.getrandbits(48):x}" for _ in range(10_000)]
+
+    request = BenchmarkRequest("/app", cookie=cookies[0])
+    yield "cookie parse", lambda: firewall.SimpleCookie().load(
+        request.headers["cookie"]
+    )
+
+    requests = []
+    for cookie in cookies:
+        request = BenchmarkRequest("/app", cookie=cookie)
+        request.cookies = firewall.SimpleCookie()
+        request.cookies.load(cookie)
+        requests.append(request)
+    picks = cycle(rng.choices(requests, k=PICKS))
+    yield "_increment_rate_limit", lambda: firewall._increment_rate_limit(
+        next(picks), "get_request_limiting", sys.maxsize
+    )
+
+    paths = [
+        "/api/tasks?query=work#top",
+        "/About/",
+        "/task/information?id=12",
+        "\\app.css",
+    ]
+
+    def parse_path():
+        for path in paths:
+            request.path = path
+            firewall._parse_path(request)
+
+    yield "_parse_path (x4)", parse_path
+
+    cookie = cookies[1]
+
+    def whole_firewall():
+        firewall.server_firewall(BenchmarkRequest("/api/tasks?q=a", cookie=cookie))
+
+    # Every call counts against the same client, so the cap is lifted meanwhile.
+    cap = firewall.GET_REQUESTS_RATE_LIMITING_CAP
+    firewall.GET_REQUESTS_RATE_LIMITING_CAP = sys.maxsize
+    yield "server_firewall", whole_firewall
+    firewall.GET_REQUESTS_RATE_LIMITING_CAP = cap
+
+
+def memory_benchmarks(rng: random.Random, sizes: list):
+    for size in sizes:
+        memory = Memory("benchmark")
+        memory.add_container("unbounded")
+        memory.add_container("bounded", max_entries=size, policy="lru")
+        identifiers = [f"key{index}" for index in range(size)]
+        for identifier in identifiers:
+            memory.add_data("unbounded", identifier, 3600, identifier)
+            memory.add_data("bounded", identifier, 3600, identifier)
+
+        picks = cycle(rng.choices(identifiers, k=PICKS))
+        yield f"retrieve_data n={size}", lambda memory=memory, picks=picks: (
+            memory.retrieve_data("unbounded", next(picks))
+        )
+        counter = iter(range(sys.maxsize))
+        yield f"add_data n={size}", lambda memory=memory, counter=counter: (
+            memory.add_data("unbounded", f"new{next(counter)}", 3600, 1)
+        )
+        counter = iter(range(sys.maxsize))
+        yield f"add_data bounded (evicts) n={size}", (
+            lambda memory=memory, counter=counter: memory.add_data(
+                "bounded", f"new{next(counter)}", 3600, 1
+            )
+        )
+
+
+def _seed_accounts(connection, start: int, end: int) -> None:
+    with connection:
+        connection.executemany(
+            """
+            INSERT INTO accounts (email, username, password, session_id)
+            VALUES (?, ?, 'unused', ?)
+            """,
+            (
+                (f"user{index}@example.com", f"user{index}", f"session{index}")
+                for index in range(start, end)
+            ),
+        )
+
+
+def auth_benchmarks(rng: random.Random, sizes: list):
+    connection = sqlite3.connect(os.environ["SQLITE3_PATH"])
+    seeded = 0
+    for size in sizes:
+        _seed_accounts(connection, seeded, size)
+        seeded = size
+        requests = [
+            BenchmarkRequest("/app", cookie=f"session_id=session{index}")
+            for index in rng.sample(range(size), min(size, 1000))
+        ]
+        for request in requests:
+            request.cookies = firewall.SimpleCookie()
+            request.cookies.load(request.headers["cookie"])
+        picks = cycle(rng.choices(requests, k=PICKS))
+        yield f"authenticate_request accounts={size}", lambda picks=picks: (
+            firewall.authenticate_request(next(picks))
+        )
+    connection.close()
+
+
+def tasks_benchmarks(rng: random.Random, sizes: list):
+    from backend.db import tasks as tasks_db
+
+    seeded = 0
+    for size in sizes:
+        tasks_db.import_tasks(
+            (
+                {
+                    "title": f"Task {index}",
+                    "labels": rng.sample(["home", "work", "urgent"], 2),
+                    "completed": rng.random() < 0.3,
+                }
+                for index in range(seeded, size)
+            ),
+            user_id=1,
+        )
+        seeded = size
+        yield f"get_tasks tasks={size}", lambda: tasks_db.get_tasks(user_id=1)
+
+
+BENCHMARKS = {
+    "firewall": firewall_benchmarks,
+    "memory": memory_benchmarks,
+    "auth": auth_benchmarks,
+    "tasks": tasks_benchmarks,
+}
+
+
+# -- Reporting
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """Prints a comparison table, returns True if something regressed."""
+    regressed = False
+    width = max(map(len, results), default=10) + 2
+    print(f"{'benchmark':<{width}}{'before':>14}{'after':>14}{'change':>10}")
+    for name, after in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<{width}}{'-':>14}{after:>11.2f} us{'new':>10}")
+            continue
+        change = (after - before) / before
+        marker = ""
+        if change > threshold:
+            marker = " !"
+            regressed = True
+        print(
+            f"{name:<{width}}{before:>11.2f} us{after:>11.2f} us"
+            f"{change:>+9.1%}{marker}"
+        )
+    return regressed
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    argument_parser.add_argument("--only", nargs="+", choices=GROUPS, default=GROUPS)
+    argument_parser.add_argument(
+        "--sizes", type=int, nargs="+", default=DEFAULT_SIZES
+    )
+    argument_parser.add_argument("--repeat", type=int, default=5)
+    argument_parser.add_argument("--seed", type=int, default=1)
+    argument_parser.add_argument("--save", help="Write the results to this file")
+    argument_parser.add_argument(
+        "--compare", help="Compare against results saved with --save"
+    )
+    argument_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Slowdown counted as a regression (default 0.10, 10%%)",
+    )
+    arguments = argument_parser.parse_args()
+
+    rng = random.Random(arguments.seed)
+    sizes = sorted(arguments.sizes)
+    results = {}
+    for group in arguments.only:
+        for name, function in BENCHMARKS[group](rng, sizes):
+            full_name = f"{group}: {name}"
+            results[full_name] = measure(function, arguments.repeat)
+            if not arguments.compare:
+                print(f"{full_name:<50}{results[full_name]:>11.2f} us")
+
+    if arguments.save:
+        Path(arguments.save).write_text(json.dumps(results, indent=2) + "\n")
+    if arguments.compare:
+        baseline = json.loads(Path(arguments.compare).read_text())
+        if compare(results, baseline, arguments.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Import time budget for starting the server.
+
+Imports backend.main and the request handler the way backend.main does, in a fresh
+interpreter with -X importtime, and reports the total and the slowest modules. The
+best of --repeat runs is kept, since the first runs also pay for cold disk caches.
+
+The exit status is 1 if the total is over --budget-ms, so this can run in CI:
+
+    python -m benchmarks.import_time --budget-ms 160
+
+Usage: python -m benchmarks.import_time [--budget-ms MS] [--top N] [--repeat N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+DEFAULT_BUDGET_MS = 160
+IMPORTS = (
+    "import backend.main; "
+    "from backend.startup import import_server; "
+    "import_server()"
+)
+
+
+def measure_imports() -> dict:
+    """Returns {module: (self µs, cumulative µs, depth)} of one fresh import."""
+    with tempfile.TemporaryDirectory() as directory:
+        environment = dict(
+            os.environ,
+            SQLITE3_PATH=str(Path(directory) / "import_time.db"),
+            MEMORY_BACKEND="local",
+        )
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", IMPORTS],
+            cwd=Path(__file__).resolve().parent.parent,
+            env=environment,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_time), int(cumulative), depth)
+    return modules
+
+
+def total_ms(modules: dict) -> float:
+    """Sum of the modules imported directly, everything else is inside them."""
+    return sum(
+        cumulative for _, cumulative, depth in modules.values() if depth == 0
+    ) / 1000
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    argument_parser.add_argument(
+        "--budget-ms", type=float, default=DEFAULT_BUDGET_MS
+    )
+    argument_parser.add_argument("--top", type=int, default=15)
+    argument_parser.add_argument("--repeat", type=int, default=5)
+    arguments = argument_parser.parse_args()
+
+    runs = [measure_imports() for _ in range(arguments.repeat)]
+    best = min(runs, key=total_ms)
+    total = total_ms(best)
+
+    print(f"{'module':<50}{'self ms':>10}{'cumulative ms':>16}")
+    slowest = sorted(best.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (self_time, cumulative, _) in slowest[: arguments.top]:
+        print(f"{name:<50}{self_time / 1000:>10.1f}{cumulative / 1000:>16.1f}")
+    print()
+    print("backend modules, by their own import time:")
+    own = [item for item in best.items() if item[0].startswith("backend")]
+    own.sort(key=lambda item: item[1][0], reverse=True)
+    for name, (self_time, _, _) in own:
+        print(f"  {name:<48}{self_time / 1000:>10.1f}")
+    print()
+    print(f"total {total:.1f} ms, budget {arguments.budget_ms:.1f} ms")
+    if total > arguments.budget_ms:
+        print("Over budget.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
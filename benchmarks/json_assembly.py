@@ -0,0 +1,169 @@
+"""
+GET /api/tasks bodies built from dicts, compared against bodies encoded by SQLite.
+
+Builds the whole body of a user's task list the three ways it could be done:
+- dict: a dict per row (row_to_task), encoded by iter_json_object_with_array,
+  the path with SQL_JSON_RESPONSES=0
+- sql rows: json_object per row, joined a batch at a time (iter_tasks_json), the
+  path the server takes
+- sql document: a single json_group_array query returning the whole body, which
+  can't be streamed, only for comparison
+
+Bodies are consumed chunk by chunk, like the server writes them to the socket.
+Every body is checked to parse to the same tasks. Times are the best of --repeat
+runs, memory is the peak traced by tracemalloc while building one body.
+
+Usage: python -m benchmarks.json_assembly [--sizes 100 10000 100000] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+# The backend reads SQLITE3_PATH when it connects, this is set first to be safe.
+_DIRECTORY = tempfile.TemporaryDirectory()
+os.environ["SQLITE3_PATH"] = str(Path(_DIRECTORY.name) / "json_assembly.db")
+# Every query here is slow on purpose.
+os.environ["SLOW_QUERY_THRESHOLD_MS"] = "60000"
+
+from backend.api.streaming import (  # noqa: E402
+    buffer_chunks,
+    iter_json_object_with_array,
+    iter_json_object_with_encoded_array,
+)
+from backend.db import tasks as tasks_db  # noqa: E402
+
+DEFAULT_SIZES = [100, 10_000, 100_000]
+LABELS = ["home", "work", "urgent", "später", "errands"]
+NOW = "2024-01-01T12:00:00.000000Z"
+
+
+def seed(user_id: int, size: int, rng: random.Random) -> None:
+    connection = tasks_db.get_connection()
+    try:
+        with connection:
+            connection.executemany(
+                """
+                INSERT INTO tasks (
+                    user_id, title, labels_json, completed, created_at, updated_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    (
+                        user_id,
+                        f"Task {number} \"quoted\"",
+                        json.dumps(rng.sample(LABELS, rng.randint(0, 3))),
+                        rng.random() < 0.3,
+                        NOW,
+                        NOW,
+                    )
+                    for number in range(size)
+                ),
+            )
+    finally:
+        connection.close()
+    return None
+
+
+def dict_body(user_id: int):
+    tasks = tasks_db.iter_tasks(user_id=user_id)
+    return buffer_chunks(iter_json_object_with_array("tasks", tasks))
+
+
+def sql_rows_body(user_id: int):
+    tasks = tasks_db.iter_tasks_json(user_id=user_id)
+    return buffer_chunks(iter_json_object_with_encoded_array("tasks", tasks))
+
+
+def sql_document_body(user_id: int):
+    connection = tasks_db.get_connection()
+    try:
+        (body,) = connection.execute(
+            f"""
+            SELECT json_object('tasks', json_group_array({tasks_db.TASK_JSON_COLUMN}))
+            FROM (
+                SELECT * FROM tasks WHERE user_id = ?
+                ORDER BY completed ASC, created_at DESC
+            )
+            """,
+            [user_id],
+        ).fetchone()
+    finally:
+        connection.close()
+    return [body.encode("utf-8")]
+
+
+BUILDERS = {
+    "dict": dict_body,
+    "sql rows": sql_rows_body,
+    "sql document": sql_document_body,
+}
+
+
+def consume(chunks) -> int:
+    """Reads the chunks like the socket would and returns the body's length."""
+    return sum(len(chunk) for chunk in chunks)
+
+
+def best_time(builder, user_id: int, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        consume(builder(user_id))
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def peak_memory(builder, user_id: int) -> int:
+    tracemalloc.start()
+    try:
+        consume(builder(user_id))
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    argument_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    argument_parser.add_argument("--repeat", type=int, default=5)
+    argument_parser.add_argument("--seed", type=int, default=1)
+    arguments = argument_parser.parse_args()
+
+    if not tasks_db.HAS_JSON_FUNCTIONS:
+        raise SystemExit("This SQLite build has no JSON functions.")
+    tasks_db.init_tasks_table()
+    rng = random.Random(arguments.seed)
+
+    print(
+        f"{'tasks':>8}  {'builder':<14}{'ms':>10}{'speedup':>9}"
+        f"{'body KiB':>10}{'peak KiB':>10}"
+    )
+    for user_id, size in enumerate(arguments.sizes, start=1):
+        seed(user_id, size, rng)
+        expected = json.loads(b"".join(dict_body(user_id)))
+        baseline = None
+        for name, builder in BUILDERS.items():
+            body = b"".join(builder(user_id))
+            if json.loads(body) != expected:
+                raise SystemExit(f"'{name}' built different tasks.")
+            seconds = best_time(builder, user_id, arguments.repeat)
+            baseline = baseline or seconds
+            print(
+                f"{size:>8}  {name:<14}{seconds * 1000:>10.2f}"
+                f"{baseline / seconds:>8.1f}x{len(body) / 1024:>10.0f}"
+                f"{peak_memory(builder, user_id) / 1024:>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
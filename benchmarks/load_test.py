@@ -0,0 +1,393 @@
+"""
+Load test for the whole server.
+
+Starts backend.main on a temporary database, seeds it with users and tasks, then
+runs each workload for a fixed time with concurrent clients and prints the results
+as JSON, so runs on different commits can be compared.
+
+Workloads:
+- login: logs in as random users (bcrypt bound)
+- list: lists the tasks of random users
+- write: creates and updates tasks of random users
+- static: fetches the static pages and assets
+
+The client is a minimal asyncio HTTP/1.1 client, the server closes every connection
+after its response so a response is read until EOF.
+
+The server is started with admission control off and rate limits out of reach, so
+the workloads measure the work they're named after. With --with-limits both apply
+as configured. Throughput and latency only count 2xx responses either way, the
+rest are listed by status, with 429 (rate limited) and 503 (shed) also counted as
+rejected.
+
+Usage: python -m benchmarks.load_test [--users N] [--tasks M] [--workloads ...]
+    [--with-limits]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import bcrypt
+
+PASSWORD = "load-test-password"
+# Public files only, /app redirects to the login page without a session.
+STATIC_PATHS = ["/about", "/app.css", "/app.js", "/logo.png"]
+WORKLOADS = ["login", "list", "write", "static"]
+SERVER_START_TIMEOUT = 15
+# Rate limits of the server without --with-limits.
+UNLIMITED_RATE = 10**9
+
+
+# -- Server
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(
+    database: Path, port: int, log, *, with_limits: bool = False
+) -> subprocess.Popen:
+    environment = dict(
+        os.environ,
+        SQLITE3_PATH=str(database),
+        PORT=str(port),
+        BASE_URL="127.0.0.1",
+        MEMORY_BACKEND="local",
+        MEMORY_SNAPSHOT_PATH="",
+    )
+    if not with_limits:
+        environment.update(
+            ADMISSION_CONTROL="0",
+            REQUESTS_RATE_LIMITING_CAP=str(UNLIMITED_RATE),
+            GET_REQUESTS_RATE_LIMITING_CAP=str(UNLIMITED_RATE),
+        )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "backend.main"],
+        cwd=Path(__file__).resolve().parent.parent,
+        env=environment,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited while starting.")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.terminate()
+    raise RuntimeError("The server did not start in time.")
+
+
+def stop_server(server: subprocess.Popen) -> None:
+    server.terminate()
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+# -- Seeding
+def seed(database: Path, users: int, tasks: int, rng: random.Random) -> list:
+    """
+    Inserts the users, each with a session and their tasks, straight into the
+    database. Returns (email, session_id, task_ids) for every user.
+    """
+    # Every account has the same password, so it's only hashed once. Logging in
+    # still costs a full bcrypt check.
+    password_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt()).decode()
+    now = datetime.utcnow().isoformat() + "Z"
+    seeded = []
+    connection = sqlite3.connect(database)
+    try:
+        with connection:
+            for index in range(users):
+                email = f"load-{index}@example.com"
+                session_id = f"load-session-{index}-{rng.getrandbits(64):x}"
+                account_id = connection.execute(
+                    """
+                    INSERT INTO accounts (
+                        email, username, password, session_id,
+                        session_id_creation_time
+                    )
+                    VALUES (?, ?, ?, ?, strftime('%s', 'now'))
+                    """,
+                    (email, f"load_{index}", password_hash, session_id),
+                ).lastrowid
+                connection.executemany(
+                    """
+                    INSERT INTO tasks (
+                        user_id, title, labels_json, completed, created_at,
+                        updated_at
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        (
+                            account_id,
+                            f"Task {number} of user {index}",
+                            json.dumps(rng.sample(["home", "work", "urgent"], 2)),
+                            rng.random() < 0.3,
+                            now,
+                            now,
+                        )
+                        for number in range(tasks)
+                    ),
+                )
+                task_ids = [
+                    row[0]
+                    for row in connection.execute(
+                        "SELECT id FROM tasks WHERE user_id = ?", (account_id,)
+                    )
+                ]
+                seeded.append((email, session_id, task_ids))
+    finally:
+        connection.close()
+    return seeded
+
+
+def restore_sessions(database: Path, seeded: list) -> None:
+    """Logging in replaces an account's session, so the seeded sessions are put
+    back before every workload."""
+    connection = sqlite3.connect(database)
+    try:
+        with connection:
+            connection.executemany(
+                "UPDATE accounts SET session_id = ? WHERE email = ?",
+                ((session_id, email) for email, session_id, _ in seeded),
+            )
+    finally:
+        connection.close()
+
+
+# -- Client
+async def request(
+    port: int,
+    method: str,
+    path: str,
+    *,
+    body: bytes = b"",
+    session_id: str | None = None,
+) -> int:
+    """Sends one request and returns the status code of the response."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        head = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: 127.0.0.1:{port}",
+            "Connection: close",
+        ]
+        if session_id is not None:
+            head.append(f"Cookie: session_id={session_id}")
+        if body:
+            head.append("Content-Type: application/json")
+            head.append(f"Content-Length: {len(body)}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        # The body has to be read too, it's part of the latency.
+        while await reader.read(64 * 1024):
+            pass
+    finally:
+        writer.close()
+    parts = status_line.split()
+    if len(parts) < 2 or not parts[1].isdigit():
+        raise ConnectionError("Invalid response")
+    return int(parts[1])
+
+
+def make_workload(name: str, seeded: list, rng: random.Random):
+    """Returns a function that picks the next request of the workload."""
+
+    def login():
+        email, _, _ = rng.choice(seeded)
+        body = json.dumps({"email": email, "password": PASSWORD}).encode()
+        return "POST", "/session/create", body, None
+
+    def list_tasks():
+        _, session_id, _ = rng.choice(seeded)
+        return "GET", "/api/tasks", b"", session_id
+
+    def write():
+        _, session_id, task_ids = rng.choice(seeded)
+        if task_ids and rng.random() < 0.3:
+            task_id = rng.choice(task_ids)
+            body = json.dumps({"completed": rng.random() < 0.5}).encode()
+            return "PATCH", f"/api/tasks/{task_id}", body, session_id
+        body = json.dumps({"title": "Load test task", "labels": ["load"]}).encode()
+        return "POST", "/api/tasks", body, session_id
+
+    def static():
+        return "GET", rng.choice(STATIC_PATHS), b"", None
+
+    return {
+        "login": login,
+        "list": list_tasks,
+        "write": write,
+        "static": static,
+    }[name]
+
+
+async def run_workload(
+    port: int, next_request, concurrency: int, duration: float
+) -> dict:
+    latencies = []
+    statuses = {}
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            method, path, body, session_id = next_request()
+            start = time.perf_counter()
+            try:
+                status = await request(
+                    port, method, path, body=body, session_id=session_id
+                )
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                errors += 1
+                continue
+            if 200 <= status < 300:
+                latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, statuses, errors, elapsed)
+
+
+# -- Reporting
+def percentile(ordered: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies: list, statuses: dict, errors: int, elapsed: float) -> dict:
+    """latencies are those of the 2xx responses only, in seconds."""
+    ordered = sorted(latencies)
+    succeeded = len(ordered)
+    seconds = {
+        "p50": percentile(ordered, 0.50),
+        "p95": percentile(ordered, 0.95),
+        "p99": percentile(ordered, 0.99),
+        "max": ordered[-1] if ordered else 0.0,
+        "mean": sum(ordered) / succeeded if succeeded else 0.0,
+    }
+    rejected = statuses.get(429, 0) + statuses.get(503, 0)
+    server_errors = sum(
+        count for status, count in statuses.items()
+        if status >= 500 and status != 503
+    )
+    return {
+        "requests": sum(statuses.values()) + errors,
+        "succeeded": succeeded,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(succeeded / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            key: round(value * 1000, 3) for key, value in seconds.items()
+        },
+        "statuses": {str(status): statuses[status] for status in sorted(statuses)},
+        "rejected": rejected,
+        "errors": errors + server_errors,
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__.strip())
+    argument_parser.add_argument("--users", type=int, default=50)
+    argument_parser.add_argument("--tasks", type=int, default=100)
+    argument_parser.add_argument("--concurrency", type=int, default=16)
+    argument_parser.add_argument("--duration", type=float, default=10)
+    argument_parser.add_argument(
+        "--workloads", nargs="+", choices=WORKLOADS, default=WORKLOADS
+    )
+    argument_parser.add_argument("--seed", type=int, default=1)
+    argument_parser.add_argument(
+        "--with-limits",
+        action="store_true",
+        help="Keep admission control and the rate limits of the server",
+    )
+    argument_parser.add_argument(
+        "--output", help="Also write the results to this file"
+    )
+    argument_parser.add_argument(
+        "--server-log", help="Write the server output here instead of dropping it"
+    )
+    arguments = argument_parser.parse_args()
+
+    rng = random.Random(arguments.seed)
+    results = {
+        "revision": git_revision(),
+        "config": {
+            "users": arguments.users,
+            "tasks_per_user": arguments.tasks,
+            "concurrency": arguments.concurrency,
+            "duration_s": arguments.duration,
+            "seed": arguments.seed,
+            "with_limits": arguments.with_limits,
+        },
+        "workloads": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        database = Path(directory) / "load_test.db"
+        port = free_port()
+        log_path = arguments.server_log or os.devnull
+        with open(log_path, "w") as log:
+            server = start_server(
+                database, port, log, with_limits=arguments.with_limits
+            )
+            try:
+                seeded = seed(database, arguments.users, arguments.tasks, rng)
+                for name in arguments.workloads:
+                    restore_sessions(database, seeded)
+                    results["workloads"][name] = asyncio.run(
+                        run_workload(
+                            port,
+                            make_workload(name, seeded, rng),
+                            arguments.concurrency,
+                            arguments.duration,
+                        )
+                    )
+            finally:
+                stop_server(server)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if arguments.output:
+        Path(arguments.output).write_text(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Contention benchmark for the thread-safe memory.
+
+Every thread runs the rate limiter's hot path (increment, then a read) on random
+identifiers. ShardedMemory is compared against a plain Memory guarded by one
+global lock, which is what making Memory thread-safe without striping costs.
+
+Usage: python -m benchmarks.memory_contention [--threads 1 2 4 8 16 32]
+"""
+
+import argparse
+import random
+import threading
+from time import perf_counter
+
+from backend.memory import Memory, ShardedMemory
+
+
+class GloballyLockedMemory:
+    """A Memory where every operation takes the same lock."""
+
+    def __init__(self):
+        self.memory = Memory("global")
+        self.lock = threading.Lock()
+
+    def add_container(self, *args, **kwargs):
+        with self.lock:
+            self.memory.add_container(*args, **kwargs)
+
+    def increment(self, *args):
+        with self.lock:
+            return self.memory.increment(*args)
+
+    def retrieve_data(self, *args):
+        with self.lock:
+            return self.memory.retrieve_data(*args)
+
+
+def run(store, threads: int, operations: int, identifiers: int) -> float:
+    """Returns operations per second over all threads."""
+    store.add_container("rate_limiting", max_entries=identifiers, policy="ttl")
+    per_thread = operations // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        keys = random.Random(seed).choices(range(identifiers), k=per_thread)
+        keys = [f"client-{key}" for key in keys]
+        barrier.wait()
+        for key in keys:
+            store.increment("rate_limiting", key, 30)
+            store.retrieve_data("rate_limiting", key)
+
+    workers = [
+        threading.Thread(target=worker, args=(seed,)) for seed in range(threads)
+    ]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = perf_counter()
+    for thread in workers:
+        thread.join()
+    return per_thread * threads * 2 / (perf_counter() - start)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__.strip())
+    argument_parser.add_argument(
+        "--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32]
+    )
+    argument_parser.add_argument("--operations", type=int, default=200_000)
+    argument_parser.add_argument("--identifiers", type=int, default=10_000)
+    argument_parser.add_argument("--shards", type=int, default=16)
+    arguments = argument_parser.parse_args()
+
+    print(f"{'threads':>8}{'global lock':>16}{'sharded':>16}")
+    for threads in arguments.threads:
+        locked = run(
+            GloballyLockedMemory(),
+            threads,
+            arguments.operations,
+            arguments.identifiers,
+        )
+        sharded = run(
+            ShardedMemory("contention", shards=arguments.shards),
+            threads,
+            arguments.operations,
+            arguments.identifiers,
+        )
+        print(f"{threads:>8}{locked:>12.0f} op/s{sharded:>12.0f} op/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Memory footprint benchmark for backend.memory.Memory.
+
+Fills a container the way the rate limiter does (a long random identifier and a
+small integer per entry) and reports the bytes used per entry, measured with
+tracemalloc. The compact __slots__ Payload is compared against the previous
+Payload, which kept its attributes in a per-instance __dict__.
+
+Usage: python -m benchmarks.memory_footprint [--sizes 100000 1000000]
+"""
+
+import argparse
+import gc
+import tracemalloc
+from contextlib import contextmanager
+from secrets import token_urlsafe
+from time import time
+
+import backend.memory as memory
+
+
+class DictPayload:
+    """The Payload as it was before __slots__, only used for comparison."""
+
+    def __init__(self, container, identifier, data, ttl=30, /, *, note=""):
+        self.data = data
+        self.expiration_time = int(time()) + ttl
+        self.note = note
+
+        self._container = container
+        self._identifier = identifier
+
+    def is_expired(self):
+        return self.expiration_time <= int(time())
+
+
+@contextmanager
+def payload_class(cls):
+    original = memory.Payload
+    memory.Payload = cls
+    try:
+        yield
+    finally:
+        memory.Payload = original
+
+
+def bytes_per_entry(size: int, identifiers: list) -> float:
+    store = memory.Memory("footprint")
+    store.add_container("rate_limiting")
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for identifier in identifiers[:size]:
+        store.add_data("rate_limiting", identifier, 30, 1)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / size
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__.strip())
+    argument_parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100_000, 1_000_000]
+    )
+    arguments = argument_parser.parse_args()
+
+    # Identifiers are created upfront so only the entries themselves are measured,
+    # they would exist as cookie values either way.
+    identifiers = [token_urlsafe(64) for _ in range(max(arguments.sizes))]
+
+    print(f"{'entries':>10}{'__dict__ payload':>20}{'__slots__ payload':>20}{'saved':>8}")
+    for size in arguments.sizes:
+        with payload_class(DictPayload):
+            before = bytes_per_entry(size, identifiers)
+        after = bytes_per_entry(size, identifiers)
+        print(
+            f"{size:>10}{before:>13.1f} B/entry{after:>13.1f} B/entry"
+            f"{1 - after / before:>8.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
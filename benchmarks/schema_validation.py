@@ -0,0 +1,75 @@
+"""
+Microbenchmark for request body schema validation.
+
+Compares the compiled validators in backend.schema against the previous
+approach: re-serializing the parsed body and building a valid8r parser for the
+annotation on every request.
+
+Usage: python -m benchmarks.schema_validation [--number N]
+"""
+
+import argparse
+import json
+import timeit
+
+from backend.schema import compile_schema, ListOf, MapOf
+
+# (name, compiled schema, valid8r annotation, request body)
+CASES = [
+    (
+        "session",
+        compile_schema({"email": str, "password": str}),
+        dict[str, str],
+        {"email": "someone@example.com", "password": "hunter2hunter2"},
+    ),
+    (
+        "account update",
+        compile_schema(MapOf(ListOf(str, min_length=2, max_length=2))),
+        dict[str, list[str]],
+        {"username": ["new_name", "old_name"], "email": ["a@b.co", "c@d.co"]},
+    ),
+]
+
+
+def valid8r_validate(annotation, body):
+    # This mirrors the old server_validate_schema.
+    from valid8r import from_type
+
+    parser = from_type(annotation)
+    return parser(json.dumps(body))
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__.strip())
+    argument_parser.add_argument("--number", type=int, default=20_000)
+    arguments = argument_parser.parse_args()
+
+    try:
+        import valid8r  # noqa: F401
+    except ImportError:
+        valid8r = None
+        print("valid8r is not installed, only timing the compiled schemas.\n")
+
+    print(f"{'case':<16}{'compiled':>14}{'valid8r':>14}{'speedup':>10}")
+    for name, schema, annotation, body in CASES:
+        assert schema(body) == []
+        compiled = timeit.timeit(
+            lambda: schema(body), number=arguments.number
+        )
+        compiled_us = compiled / arguments.number * 1e6
+        if valid8r is None:
+            print(f"{name:<16}{compiled_us:>11.2f} us{'-':>14}{'-':>10}")
+            continue
+        baseline = timeit.timeit(
+            lambda: valid8r_validate(annotation, body),
+            number=arguments.number,
+        )
+        baseline_us = baseline / arguments.number * 1e6
+        print(
+            f"{name:<16}{compiled_us:>11.2f} us{baseline_us:>11.2f} us"
+            f"{baseline / compiled:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,10 @@
 
 let tasks = [];
 
+// Set once the task stream is open. Until then, and in browsers without
+// EventSource, the list is reloaded after every change.
+let taskStream = null;
+
 // ========================================
 // RENDER
 // ========================================
@@ -72,6 +76,39 @@ function createTaskElement(task) {
 // STATE MUTATIONS
 // ========================================
 
+// The order of GET /api/tasks: incomplete first, then newest first.
+function compareTasks(a, b) {
+    if (a.completed !== b.completed) {
+        return a.completed ? 1 : -1;
+    }
+    if (a.createdAt !== b.createdAt) {
+        return a.createdAt < b.createdAt ? 1 : -1;
+    }
+    return b.id - a.id;
+}
+
+function upsertTask(task) {
+    const index = tasks.findIndex((t) => t.id === task.id);
+    if (index === -1) {
+        tasks.push(task);
+    } else {
+        tasks[index] = task;
+    }
+    tasks.sort(compareTasks);
+    renderTasks();
+}
+
+function removeTask(id) {
+    tasks = tasks.filter((t) => t.id !== id);
+    renderTasks();
+}
+
+async function refreshTasks() {
+    if (!taskStream || taskStream.readyState !== EventSource.OPEN) {
+        await loadTasks();
+    }
+}
+
 async function loadTasks() {
     const response = await fetch("/api/tasks", {
         method: "GET",
@@ -111,7 +148,8 @@ async function addTask(title) {
         return;
     }
 
-    await loadTasks();
+    upsertTask(await response.json());
+    await refreshTasks();
 }
 
 async function deleteTask(id) {
@@ -129,7 +167,8 @@ async function deleteTask(id) {
         return;
     }
 
-    await loadTasks();
+    removeTask(id);
+    await refreshTasks();
 }
 
 async function toggleTask(id) {
@@ -152,7 +191,35 @@ async function toggleTask(id) {
         return;
     }
 
-    await loadTasks();
+    upsertTask(await response.json());
+    await refreshTasks();
+}
+
+// ========================================
+// LIVE UPDATES
+// ========================================
+
+// Changes made on other devices arrive as events, see GET /api/tasks/stream.
+// The browser reconnects on its own and resumes after the last event it got.
+function openTaskStream() {
+    if (!window.EventSource) {
+        return;
+    }
+
+    taskStream = new EventSource("/api/tasks/stream");
+
+    taskStream.addEventListener("create", (event) => {
+        upsertTask(JSON.parse(event.data));
+    });
+    taskStream.addEventListener("update", (event) => {
+        upsertTask(JSON.parse(event.data));
+    });
+    taskStream.addEventListener("delete", (event) => {
+        removeTask(JSON.parse(event.data).id);
+    });
+    // Too many changes to send one by one, or events that were missed
+    taskStream.addEventListener("import", () => loadTasks());
+    taskStream.addEventListener("reset", () => loadTasks());
 }
 
 // ========================================
@@ -169,6 +236,8 @@ document.addEventListener("DOMContentLoaded", () => {
     }
 
     input.focus();
+    // Opened first so no change falls between the list and the stream
+    openTaskStream();
     loadTasks();
 
     input.addEventListener("keydown", (event) => {
@@ -0,0 +1,54 @@
+"""Tests for backend.admission and the route classes of request_handler."""
+
+from types import SimpleNamespace
+import pytest
+from backend import admission
+from backend.admission import AdmissionController, parse_targets
+from backend.router.RequestHandler import request_handler
+
+
+@pytest.mark.parametrize(
+    "command, path, parameters, route_class",
+    [
+        ("GET", "/api/tasks", "query=milk", "search"),
+        ("GET", "/api/tasks", None, "api"),
+        ("GET", "/api/tasks", "query=", "api"),
+        ("GET", "/api/tasks/export", "query=milk", "api"),
+        ("POST", "/session/create", None, "auth"),
+        ("GET", "/session", None, "static"),
+    ],
+)
+def test_route_class(command, path, parameters, route_class):
+    request = SimpleNamespace(command=command, path=path, parameters=parameters)
+    assert request_handler.route_class(request) == route_class
+
+
+def test_search_is_shed_before_plain_api_requests(monkeypatch):
+    controller = AdmissionController()
+    controller.mean_duration = 0.1
+    # 4 queued connections of 100ms each, a 400ms wait
+    monkeypatch.setattr(admission, "queued_connections", lambda listening: 4)
+    assert controller.admit("static", None) is None
+    assert controller.admit("api", None) is None
+    assert controller.admit("search", None) == pytest.approx(0.4)
+    assert controller.admit("auth", None) == pytest.approx(0.4)
+    assert controller.classes["search"].shed == 1
+    assert controller.classes["api"].in_flight == 1
+
+
+def test_in_flight_cap(monkeypatch):
+    controller = AdmissionController()
+    monkeypatch.setattr(admission, "queued_connections", lambda listening: None)
+    cap = controller.classes["auth"].max_in_flight
+    for _ in range(cap):
+        assert controller.admit("auth", None) is None
+    assert controller.admit("auth", None) is not None
+    controller.release("auth")
+    assert controller.admit("auth", None) is None
+
+
+def test_parse_targets():
+    assert parse_targets("static=2000, search=100,") == {
+        "static": 2.0,
+        "search": 0.1,
+    }
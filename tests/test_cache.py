@@ -0,0 +1,46 @@
+"""Tests for backend.api.cache."""
+
+from backend.api.cache import ENTRY_OVERHEAD_BYTES, ResponseCache
+
+
+def test_entries_are_only_served_at_their_version():
+    cache = ResponseCache(max_bytes=10_000, max_entry_bytes=1_000)
+    cache.put((1, None), 3, b"body")
+    assert cache.get((1, None), 3) == b"body"
+    # Another process bumped the version
+    assert cache.get((1, None), 4) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_older_body_does_not_replace_newer():
+    cache = ResponseCache(max_bytes=10_000, max_entry_bytes=1_000)
+    cache.put((1, None), 4, b"new")
+    cache.put((1, None), 3, b"old")
+    assert cache.get((1, None), 4) == b"new"
+
+
+def test_etag_is_the_same_in_every_process():
+    assert ResponseCache.etag((1, "milk"), 2) == ResponseCache.etag((1, "milk"), 2)
+    assert ResponseCache.etag((1, "milk"), 2) != ResponseCache.etag((1, "milk"), 3)
+    assert ResponseCache.etag((1, "milk"), 2) != ResponseCache.etag((1, None), 2)
+    # crc32 of the key, not the per-process salted hash()
+    assert ResponseCache.etag((1, "milk"), 2) == '"2-ca0d6d40"'
+
+
+def test_invalidate_user_and_eviction():
+    cache = ResponseCache(
+        max_bytes=2 * (ENTRY_OVERHEAD_BYTES + 10), max_entry_bytes=100
+    )
+    cache.put((1, None), 1, b"a" * 10)
+    cache.put((1, "q"), 1, b"b" * 10)
+    cache.invalidate_user(1)
+    assert cache.size_bytes == 0
+    cache.put((1, None), 1, b"a" * 10)
+    cache.put((2, None), 1, b"b" * 10)
+    cache.put((3, None), 1, b"c" * 10)
+    assert cache.evictions == 1
+    assert cache.get((1, None), 1) is None
+    assert cache.get((3, None), 1) == b"c" * 10
+    # Too large to cache at all
+    cache.put((4, None), 1, b"d" * 101)
+    assert cache.get((4, None), 1) is None
@@ -0,0 +1,237 @@
+"""Tests for backend.db.connections."""
+
+import asyncio
+import contextvars
+import sqlite3
+import threading
+import pytest
+from backend.db.connections import Database, DatabaseClosedError
+
+TIMEOUT = 5
+
+caller = contextvars.ContextVar("caller", default=None)
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / "test.db"), read_connections=2)
+    database.write(lambda connection: connection.execute(
+        "CREATE TABLE items (value INTEGER PRIMARY KEY)"
+    ))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def batches(database, monkeypatch):
+    """The sizes of the batches the writer runs from now on."""
+    sizes = []
+    run_batch = database._run_batch
+
+    def recording_run_batch(connection, batch):
+        sizes.append(len(batch))
+        return run_batch(connection, batch)
+
+    monkeypatch.setattr(database, "_run_batch", recording_run_batch)
+    return sizes
+
+
+def hold_writer(database):
+    """Blocks the writer until the returned event is set, so the writes submitted
+    meanwhile make up its next batch."""
+    running = threading.Event()
+    release = threading.Event()
+
+    def hold(connection):
+        running.set()
+        release.wait(TIMEOUT)
+
+    database.submit(hold)
+    assert running.wait(TIMEOUT)
+    return release
+
+
+def insert(value):
+    def work(connection):
+        connection.execute("INSERT INTO items VALUES (?)", [value])
+        return value
+
+    return work
+
+
+def stored(path) -> list:
+    connection = sqlite3.connect(path)
+    try:
+        return [row[0] for row in connection.execute(
+            "SELECT value FROM items ORDER BY value"
+        )]
+    finally:
+        connection.close()
+
+
+def test_writes_queued_meanwhile_are_one_batch(database, batches):
+    release = hold_writer(database)
+    futures = [database.submit(insert(value)) for value in range(5)]
+    release.set()
+    assert [future.result(TIMEOUT) for future in futures] == [0, 1, 2, 3, 4]
+    assert batches == [1, 5]
+    assert stored(database.path) == [0, 1, 2, 3, 4]
+
+
+def test_failing_write_only_undoes_itself(database, batches):
+    def insert_then_fail(connection):
+        connection.execute("INSERT INTO items VALUES (2)")
+        raise ValueError("no")
+
+    release = hold_writer(database)
+    futures = [
+        database.submit(insert(1)),
+        database.submit(insert_then_fail),
+        # Violates the primary key of the first write
+        database.submit(insert(1)),
+        database.submit(insert(3)),
+    ]
+    release.set()
+    assert futures[0].result(TIMEOUT) == 1
+    with pytest.raises(ValueError):
+        futures[1].result(TIMEOUT)
+    with pytest.raises(sqlite3.IntegrityError):
+        futures[2].result(TIMEOUT)
+    assert futures[3].result(TIMEOUT) == 3
+    assert batches == [1, 4]
+    assert stored(database.path) == [1, 3]
+
+
+def test_failed_commit_fails_the_whole_batch(database, batches):
+    database.write(lambda connection: connection.execute("""
+        CREATE TABLE children (
+            parent INTEGER REFERENCES items (value) DEFERRABLE INITIALLY DEFERRED
+        )
+    """))
+    # Deferred foreign keys are only checked on COMMIT. The pragma can't be set
+    # inside the writer's transactions.
+    database._writer_connection.execute("PRAGMA foreign_keys = ON")
+    batches.clear()
+
+    release = hold_writer(database)
+    futures = [
+        database.submit(insert(1)),
+        database.submit(lambda connection: connection.execute(
+            "INSERT INTO children VALUES (404)"
+        )),
+    ]
+    release.set()
+    for future in futures:
+        with pytest.raises(sqlite3.IntegrityError):
+            future.result(TIMEOUT)
+    assert batches == [1, 2]
+    assert stored(database.path) == []
+    # The writer keeps going
+    assert database.write(insert(2)) == 2
+    assert stored(database.path) == [2]
+
+
+def test_close_commits_the_queued_writes(database):
+    release = hold_writer(database)
+    futures = [database.submit(insert(value)) for value in range(3)]
+    closing = threading.Thread(target=database.close)
+    closing.start()
+    release.set()
+    closing.join(TIMEOUT)
+    assert not closing.is_alive()
+    assert [future.result(0) for future in futures] == [0, 1, 2]
+    assert stored(database.path) == [0, 1, 2]
+    with pytest.raises(DatabaseClosedError):
+        database.submit(insert(3))
+
+
+def test_writes_racing_close_are_answered(database):
+    futures = []
+    refused = []
+    start = threading.Barrier(9)
+
+    def submit_many(offset):
+        start.wait(TIMEOUT)
+        for value in range(offset, offset + 200):
+            try:
+                futures.append(database.submit(insert(value)))
+            except DatabaseClosedError:
+                refused.append(value)
+
+    threads = [
+        threading.Thread(target=submit_many, args=(offset,))
+        for offset in range(0, 1600, 200)
+    ]
+    for thread in threads:
+        thread.start()
+    start.wait(TIMEOUT)
+    while len(futures) < 100:
+        pass
+    database.close()
+    for thread in threads:
+        thread.join(TIMEOUT)
+    # Every queued write was committed, none is left waiting
+    assert len(futures) + len(refused) == 1600
+    assert len(set(future.result(TIMEOUT) for future in futures)) == len(futures)
+    assert len(stored(database.path)) == len(futures)
+
+
+def test_cancelled_writes_are_skipped(database):
+    release = hold_writer(database)
+    cancelled = database.submit(insert(1))
+    assert cancelled.cancel()
+    queued = database.submit(insert(2))
+    release.set()
+    assert queued.result(TIMEOUT) == 2
+    # The writer is still running
+    assert database.write(insert(3)) == 3
+    assert stored(database.path) == [2, 3]
+
+
+def test_writes_run_in_the_context_of_the_caller(database):
+    caller.set("request")
+    assert database.write(lambda connection: caller.get()) == "request"
+
+
+def test_write_async(database):
+    async def main():
+        return await database.write_async(insert(7))
+
+    assert asyncio.run(main()) == 7
+    assert stored(database.path) == [7]
+
+
+def test_reads_see_commits_and_can_not_write(database):
+    database.write(insert(1))
+    with database.read() as connection:
+        assert connection.execute("SELECT value FROM items").fetchall()[0][0] == 1
+        with pytest.raises(sqlite3.OperationalError):
+            connection.execute("INSERT INTO items VALUES (2)")
+
+
+def test_reads_wait_for_a_connection_once_the_pool_is_used_up(database):
+    acquired = []
+    done = threading.Event()
+
+    def third_read():
+        with database.read() as connection:
+            acquired.append(connection)
+        done.set()
+
+    with database.read() as first, database.read():
+        thread = threading.Thread(target=third_read)
+        thread.start()
+        assert not done.wait(0.2)
+    assert done.wait(TIMEOUT)
+    thread.join(TIMEOUT)
+    # No third connection was opened, a returned one was reused
+    assert len(database._readers) == 2
+    assert acquired[0] in database._readers
+    assert first in database._readers
+
+
+def test_read_rolls_back_an_open_transaction(database):
+    with database.read() as connection:
+        connection.execute("BEGIN")
+        connection.execute("SELECT * FROM items").fetchall()
+    assert not connection.in_transaction
@@ -0,0 +1,196 @@
+"""Tests for backend.api.events."""
+
+import socket
+import threading
+import time
+
+import pytest
+from backend.api import events
+from backend.api.events import EventHub, encode_event
+
+TIMEOUT = 5
+EPOCH = events._EPOCH
+
+
+@pytest.fixture
+def hub():
+    hub = EventHub()
+    yield hub
+    for streams in list(hub._streams.values()):
+        for stream in list(streams):
+            hub._close(stream)
+
+
+@pytest.fixture
+def connect(hub):
+    """Subscribes a socketpair for a user and returns the client's end."""
+    clients = []
+
+    def connect(user_id=1, last_event_id=None):
+        server, client = socket.socketpair()
+        client.settimeout(TIMEOUT)
+        hub.subscribe(user_id, server, last_event_id)
+        clients.append(client)
+        return client
+
+    yield connect
+    for client in clients:
+        client.close()
+
+
+def read_until(client, end: bytes) -> bytes:
+    received = b""
+    while not received.endswith(end):
+        chunk = client.recv(65536)
+        assert chunk, f"Closed before {end!r}, got {received!r}"
+        received += chunk
+    return received
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def event(sequence: int, action: str = "update", task=None) -> bytes:
+    return encode_event(f"{EPOCH}.{sequence}", action, task or {"id": sequence})
+
+
+def test_events_reach_the_streams_of_their_user(hub, connect):
+    first, second, other = connect(1), connect(1), connect(2)
+    for client in (first, second, other):
+        assert read_until(client, b"\n\n") == b"retry: 3000\n\n"
+    hub.publish("create", 1, {"id": 1, "title": "Milk"})
+    expected = (
+        f'id: {EPOCH}.1\nevent: create\ndata: {{"id":1,"title":"Milk"}}\n\n'
+    ).encode()
+    assert read_until(first, b"\n\n") == expected
+    assert read_until(second, b"\n\n") == expected
+    hub.publish("delete", 2, {"id": 5})
+    # Numbered per user
+    assert read_until(other, b"\n\n") == event(1, "delete", {"id": 5})
+
+
+def test_users_without_a_stream_are_not_buffered(hub):
+    hub.publish("create", 1, {"id": 1})
+    assert hub.published == 0
+    assert 1 not in hub._history
+
+
+def test_missed_events_are_replayed(hub, connect):
+    client = connect(1)
+    read_until(client, b"\n\n")
+    for sequence in (1, 2, 3):
+        hub.publish("update", 1, {"id": sequence})
+    read_until(client, event(3))
+    client.close()
+    wait_until(lambda: hub.streams() == 0)
+    hub.publish("update", 1, {"id": 4})
+
+    resumed = connect(1, f"{EPOCH}.2")
+    assert read_until(resumed, event(4)) == (
+        b"retry: 3000\n\n" + event(3) + event(4)
+    )
+
+
+def test_resuming_at_the_last_event_sends_nothing(hub, connect):
+    client = connect(1)
+    hub.publish("update", 1, {"id": 1})
+    read_until(client, event(1))
+    resumed = connect(1, f"{EPOCH}.1")
+    hub.publish("update", 1, {"id": 2})
+    assert read_until(resumed, event(2)) == b"retry: 3000\n\n" + event(2)
+
+
+@pytest.mark.parametrize(
+    "last_event_id",
+    [
+        f"{EPOCH}.0",  # older than the oldest kept event
+        f"{EPOCH}.1",
+        f"{EPOCH}.9",  # newer than the last event
+        "18c2f3a9b10.5",  # another process
+        "garbled",
+        f"{EPOCH}.x",
+    ],
+)
+def test_out_of_range_or_foreign_ids_reset(hub, monkeypatch, last_event_id):
+    monkeypatch.setattr(events, "MAX_BUFFERED_EVENTS", 3)
+    history = events._History()
+    for sequence in range(1, 6):
+        history.sequence = sequence
+        history.events.append((sequence, event(sequence)))
+    # Events 3 to 5 are kept, so ids 2 to 5 can resume
+    assert hub._replay(history, f"{EPOCH}.2") == event(3) + event(4) + event(5)
+    assert hub._replay(history, f"{EPOCH}.5") == b""
+    assert hub._replay(history, last_event_id) == encode_event(
+        f"{EPOCH}.5", "reset", {}
+    )
+
+
+def test_an_empty_history_resumes_from_its_sequence(hub):
+    history = events._History()
+    assert hub._replay(history, f"{EPOCH}.0") == b""
+    assert hub._replay(history, f"{EPOCH}.1") == encode_event(
+        f"{EPOCH}.0", "reset", {}
+    )
+
+
+def test_a_forgotten_history_resets(hub, connect, monkeypatch):
+    monkeypatch.setattr(events, "MAX_BUFFERED_USERS", 1)
+    client = connect(1)
+    hub.publish("update", 1, {"id": 1})
+    read_until(client, event(1))
+    client.close()
+    wait_until(lambda: hub.streams() == 0)
+    # Only one user is kept, and user 1 has no stream anymore
+    connect(2)
+    assert 1 not in hub._history
+
+    # Recreated at sequence 0, the old id is from the future now
+    resumed = connect(1, f"{EPOCH}.1")
+    assert read_until(resumed, b"event: reset\ndata: {}\n\n") == (
+        b"retry: 3000\n\n" + encode_event(f"{EPOCH}.0", "reset", {})
+    )
+
+
+def test_heartbeats_are_sent(hub, connect, monkeypatch):
+    monkeypatch.setattr(events, "HEARTBEAT_INTERVAL", 0.05)
+    client = connect(1)
+    assert read_until(client, b": heartbeat\n\n").startswith(b"retry: 3000\n\n")
+
+
+def test_closed_clients_are_unregistered(hub, connect):
+    client, kept = connect(1), connect(1)
+    client.close()
+    wait_until(lambda: hub.streams() == 1)
+    # Only the kept stream and the wakeup socket are watched
+    assert len(hub._selector.get_map()) == 2
+    hub.publish("update", 1, {"id": 1})
+    read_until(kept, event(1))
+
+
+def test_slow_readers_are_dropped(hub, connect, monkeypatch):
+    monkeypatch.setattr(events, "MAX_PENDING_BYTES", 64 * 1024)
+    client = connect(1)
+    task = {"id": 1, "title": "x" * 16 * 1024}
+    deadline = time.monotonic() + TIMEOUT
+    # The client never reads, so the socket buffers fill up first
+    while hub.dropped_streams == 0:
+        assert time.monotonic() < deadline, "The stream was not dropped"
+        hub.publish("update", 1, task)
+        time.sleep(0.001)
+    wait_until(lambda: hub.streams() == 0)
+    # What was sent is followed by the end of the stream
+    client.settimeout(TIMEOUT)
+    while client.recv(1 << 20):
+        pass
+
+
+def test_streams_per_user_are_capped(hub, connect):
+    for _ in range(events.MAX_STREAMS_PER_USER):
+        assert hub.has_room(1)
+        connect(1)
+    assert not hub.has_room(1)
+    assert hub.has_room(2)
@@ -0,0 +1,363 @@
+"""Tests for backend.memory."""
+
+import sys
+import threading
+
+import pytest
+from backend.memory import (
+    DataError,
+    ExpiryIndex,
+    Memory,
+    ObjectNotFoundError,
+    Payload,
+    ShardedMemory,
+    SingleFlight,
+    estimate_size,
+)
+
+
+@pytest.fixture
+def memory():
+    return Memory("test")
+
+
+def test_failed_overwrite_keeps_the_old_value(memory):
+    memory.add_container("c", max_bytes=2000)
+    memory.add_data("c", "k", 60, "small")
+    with pytest.raises(DataError):
+        memory.add_data("c", "k", 60, "x" * 5000, overwrite=True)
+    assert memory.retrieve_data("c", "k") == "small"
+    assert memory.container_states["c"].size_bytes > 0
+
+
+def test_failed_overwrite_keeps_the_old_index_entries(memory):
+    memory.add_container("sessions", indexes={"user": lambda data: data["user"]})
+    memory.add_data("sessions", "s1", 60, {"user": 1})
+    with pytest.raises(DataError):
+        # Lists can't be index keys
+        memory.add_data("sessions", "s1", 60, {"user": [2]}, overwrite=True)
+    with pytest.raises(KeyError):
+        memory.add_data("sessions", "s1", 60, {}, overwrite=True)
+    assert memory.retrieve_data("sessions", "s1") == {"user": 1}
+    assert memory.retrieve_identifiers_from_index("sessions", "user", 1) == ["s1"]
+
+
+def test_overwrite_with_the_same_index_key(memory):
+    memory.add_container("sessions", indexes={"user": lambda data: data["user"]})
+    memory.add_data("sessions", "s1", 60, {"user": 1, "n": 1})
+    memory.add_data("sessions", "s1", 60, {"user": 1, "n": 2}, overwrite=True)
+    assert memory.retrieve_identifiers_from_index("sessions", "user", 1) == ["s1"]
+    memory.add_data("sessions", "s1", 60, {"user": 2}, overwrite=True)
+    assert memory.retrieve_identifiers_from_index("sessions", "user", 2) == ["s1"]
+    assert memory.retrieve_identifiers_from_index("sessions", "user", 1) == []
+
+
+# -- Eviction
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the time Memory reads, advance it with clock.now += seconds."""
+
+    class Clock:
+        now = 1_000_000
+
+    monkeypatch.setattr("backend.memory.time", lambda: Clock.now)
+    return Clock
+
+
+def test_lru_evicts_the_least_recently_used(memory):
+    memory.add_container("c", max_entries=2, policy="lru")
+    memory.add_data("c", "a", 60, 1)
+    memory.add_data("c", "b", 60, 2)
+    memory.retrieve_data("c", "a")
+    memory.add_data("c", "c", 60, 3)
+    assert sorted(memory.memory["c"]) == ["a", "c"]
+    assert memory.container_statistics("c")["evictions"] == 1
+
+
+def test_lfu_evicts_the_least_frequently_used(memory):
+    memory.add_container("c", max_entries=3, policy="lfu")
+    for identifier in ("a", "b", "c"):
+        memory.add_data("c", identifier, 60, identifier)
+    memory.retrieve_data("c", "a")
+    memory.retrieve_data("c", "a")
+    memory.retrieve_data("c", "c")
+    memory.add_data("c", "d", 60, "d")
+    assert sorted(memory.memory["c"]) == ["a", "c", "d"]
+    assert memory.container_statistics("c")["evictions"] == 1
+
+
+def test_lfu_evicts_the_oldest_of_a_tie(memory):
+    memory.add_container("c", max_entries=3, policy="lfu")
+    for identifier in ("a", "b", "c", "d"):
+        memory.add_data("c", identifier, 60, identifier)
+    assert sorted(memory.memory["c"]) == ["b", "c", "d"]
+
+
+def test_ttl_evicts_the_entry_closest_to_expiring(memory, clock):
+    memory.add_container("c", max_entries=2, policy="ttl")
+    memory.add_data("c", "long", 60, 1)
+    memory.add_data("c", "short", 10, 2)
+    memory.add_data("c", "medium", 30, 3)
+    assert sorted(memory.memory["c"]) == ["long", "medium"]
+    memory.add_data("c", "longest", 90, 4)
+    assert sorted(memory.memory["c"]) == ["long", "longest"]
+    statistics = memory.container_statistics("c")
+    assert (statistics["evictions"], statistics["expirations"]) == (2, 0)
+
+
+def test_max_bytes_evicts_until_the_container_fits(memory):
+    entry = estimate_size("a", "x" * 100)
+    memory.add_container("c", max_bytes=3 * entry, policy="lru")
+    for identifier in ("a", "b", "c"):
+        memory.add_data("c", identifier, 60, "x" * 100)
+    assert memory.container_statistics("c")["evictions"] == 0
+    # As large as two of the others
+    memory.add_data("c", "d", 60, "x" * (100 + entry))
+    assert sorted(memory.memory["c"]) == ["c", "d"]
+    statistics = memory.container_statistics("c")
+    assert statistics["evictions"] == 2
+    assert statistics["bytes"] <= statistics["max_bytes"]
+
+
+def test_max_entries_and_max_bytes_both_apply(memory):
+    memory.add_container("c", max_entries=2, max_bytes=10**6)
+    for identifier in ("a", "b", "c"):
+        memory.add_data("c", identifier, 60, identifier)
+    assert sorted(memory.memory["c"]) == ["b", "c"]
+
+
+def test_expired_entries_go_before_anything_is_evicted(memory, clock):
+    memory.add_container("c", max_entries=2, policy="lru")
+    memory.add_data("c", "old", 5, 1)
+    memory.add_data("c", "new", 60, 2)
+    clock.now += 5
+    memory.add_data("c", "newer", 60, 3)
+    assert sorted(memory.memory["c"]) == ["new", "newer"]
+    statistics = memory.container_statistics("c")
+    assert (statistics["evictions"], statistics["expirations"]) == (0, 1)
+
+
+def test_entries_expire_in_order(memory, clock):
+    memory["c"] = ""
+    for ttl in (3, 1, 2, 10):
+        memory.add_data("c", f"ttl{ttl}", ttl, ttl)
+    clock.now += 2
+    memory.add_data("c", "trigger", 60, 0)
+    assert sorted(memory.memory["c"]) == ["trigger", "ttl10", "ttl3"]
+    clock.now += 1
+    memory.add_data("c", "trigger", 60, 0, overwrite=True)
+    assert sorted(memory.memory["c"]) == ["trigger", "ttl10"]
+    assert memory.container_statistics("c")["expirations"] == 3
+
+
+def test_expiry_index_skips_removed_and_extended_payloads(clock):
+    entries = {}
+    expiry = ExpiryIndex()
+    for identifier, ttl in (("a", 1), ("b", 2), ("c", 3)):
+        entries[identifier] = Payload("c", identifier, None, ttl)
+        expiry.add(entries[identifier])
+    del entries["a"]
+    entries["b"].expiration_time += 10
+    assert expiry.earliest(entries) is entries["c"]
+    clock.now += 3
+    assert [payload._identifier for payload in expiry.pop_due(clock.now)] == ["c"]
+    expiry.compact(entries)
+    assert expiry.queued == 1
+
+
+# -- ShardedMemory
+
+
+@pytest.fixture
+def sharded():
+    return ShardedMemory("test", shards=4)
+
+
+@pytest.fixture
+def contended():
+    """Switches threads far more often than usual, so races show up."""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def run_threads(count, target):
+    start = threading.Barrier(count)
+
+    def run(number):
+        start.wait()
+        target(number)
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_increments_are_not_lost(sharded, contended):
+    sharded["counters"] = ""
+
+    def increment(number):
+        for _ in range(500):
+            sharded.increment("counters", "hits", 60)
+            sharded.increment("counters", f"thread{number}", 60, 2)
+
+    run_threads(8, increment)
+    assert sharded.retrieve_data("counters", "hits") == 8 * 500
+    for number in range(8):
+        assert sharded.retrieve_data("counters", f"thread{number}") == 1000
+
+
+def test_concurrent_overwrites_keep_one_consistent_entry(sharded, contended):
+    sharded.add_container("c", index_data=True)
+
+    def overwrite(number):
+        for attempt in range(300):
+            sharded.add_data("c", "key", 60, (number, attempt), overwrite=True)
+
+    run_threads(8, overwrite)
+    number, attempt = sharded.retrieve_data("c", "key")
+    assert attempt == 299
+    assert sharded.retrieve_identifiers_from_data("c", (number, 299)) == ["key"]
+    statistics = sharded.container_statistics("c")
+    assert statistics["entries"] == 1
+    assert statistics["bytes"] == estimate_size("key", (number, attempt))
+
+
+def test_statistics_add_up_across_shards(sharded):
+    sharded.add_container("c", max_entries=40, policy="lru")
+    for number in range(100):
+        sharded.add_data("c", f"key{number}", 60, number)
+    statistics = sharded.container_statistics("c")
+    entries = sum(len(shard.memory["c"]) for shard in sharded.shards)
+    assert statistics["entries"] == entries == len(sharded.memory["c"])
+    assert statistics["evictions"] == 100 - entries
+    assert statistics["bytes"] == sum(
+        shard.container_states["c"].size_bytes for shard in sharded.shards
+    )
+    # 40 split over 4 shards
+    assert statistics["max_entries"] == 40
+    assert entries <= 40
+    assert sharded.memory_statistics()["c"] == statistics
+
+
+# -- Computing
+
+TIMEOUT = 5
+
+
+def wait_until(condition):
+    for _ in range(TIMEOUT * 100):
+        if condition():
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("Timed out")
+
+
+def test_concurrent_misses_compute_once(sharded):
+    sharded["pages"] = ""
+    calls = []
+
+    def compute():
+        calls.append(None)
+        # Long enough for every thread to miss and queue behind this one
+        threading.Event().wait(0.2)
+        return "page"
+
+    results = []
+    run_threads(
+        8,
+        lambda number: results.append(
+            sharded.get_or_compute("pages", "index", compute, 60)
+        ),
+    )
+    assert len(calls) == 1
+    assert results == ["page"] * 8
+
+
+def test_concurrent_misses_share_the_error(sharded):
+    sharded["pages"] = ""
+    calls = []
+
+    def compute():
+        calls.append(None)
+        threading.Event().wait(0.2)
+        raise OSError("unreadable")
+
+    errors = []
+
+    def get(number):
+        try:
+            sharded.get_or_compute("pages", "index", compute, 60)
+        except OSError as error:
+            errors.append(error)
+
+    run_threads(4, get)
+    assert len(calls) == 1
+    assert len(errors) == 4
+    with pytest.raises(ObjectNotFoundError):
+        sharded.retrieve_data("pages", "index")
+
+
+def test_stale_entries_are_served_while_recomputing(sharded, clock):
+    sharded["pages"] = ""
+    sharded.get_or_compute("pages", "index", lambda: "old", 10, stale_ttl=60)
+    clock.now += 10
+    started, release = threading.Event(), threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(TIMEOUT)
+        return "new"
+
+    # Returned while compute is still waiting
+    assert sharded.get_or_compute(
+        "pages", "index", compute, 10, stale_ttl=60
+    ) == "old"
+    assert started.wait(TIMEOUT)
+    # Only one refresh runs at a time
+    assert sharded.get_or_compute(
+        "pages", "index", compute, 10, stale_ttl=60
+    ) == "old"
+    release.set()
+    wait_until(lambda: not sharded.flights._flights)
+    assert sharded.get_or_compute(
+        "pages", "index", lambda: "unused", 10, stale_ttl=60
+    ) == "new"
+    assert sharded.time_to_live("pages", "index") == 70
+
+
+def test_failed_refresh_keeps_the_stale_entry(sharded, clock, caplog):
+    sharded["pages"] = ""
+    sharded.get_or_compute("pages", "index", lambda: "old", 10, stale_ttl=60)
+    clock.now += 10
+
+    def compute():
+        raise OSError("unreadable")
+
+    assert sharded.get_or_compute(
+        "pages", "index", compute, 10, stale_ttl=60
+    ) == "old"
+    wait_until(lambda: "Failed to recompute" in caplog.text)
+    assert sharded.retrieve_data("pages", "index") == "old"
+
+
+def test_racing_starts_run_one_computation():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(None)
+        release.wait(TIMEOUT)
+
+    started = []
+    run_threads(8, lambda number: started.append(flights.start("key", compute)))
+    release.set()
+    assert started.count(True) == 1
+    wait_until(lambda: not flights._flights)
+    assert len(calls) == 1
@@ -0,0 +1,190 @@
+"""Tests for backend.memory_backends."""
+
+import threading
+
+import pytest
+from backend.memory import (
+    DataError,
+    DataExpiredError,
+    ObjectAlreadyExistsError,
+    ObjectNotFoundError,
+)
+from backend.memory_backends import (
+    SQLiteMemory,
+    create_memory,
+    init_memory_database,
+)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "memory.db")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the time SQLiteMemory reads, advance it with clock.now += seconds."""
+
+    class Clock:
+        now = 1_000_000.0
+
+    monkeypatch.setattr("backend.memory_backends.time", lambda: Clock.now)
+    return Clock
+
+
+def shared(path, container="c", **limits) -> SQLiteMemory:
+    """A memory on the database at path, as another process would open it."""
+    memory = SQLiteMemory("test", path)
+    memory.add_container(container, **limits)
+    return memory
+
+
+def test_increments_from_several_connections_are_exact(path):
+    # Two memories on one file stand in for two processes
+    memories = [shared(path), shared(path)]
+    start = threading.Barrier(8)
+
+    def increment(memory):
+        start.wait()
+        for _ in range(200):
+            memory.increment("c", "hits", 60)
+
+    threads = [
+        threading.Thread(target=increment, args=(memories[number % 2],))
+        for number in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert memories[0].retrieve_data("c", "hits") == 8 * 200
+    assert memories[1].retrieve_data("c", "hits") == 8 * 200
+
+
+def test_increment_only_adds_to_numbers(path):
+    memory = shared(path)
+    memory.add_data("c", "name", 60, "text")
+    with pytest.raises(DataError):
+        memory.increment("c", "name", 60)
+    # Bigger than an SQL integer, so it's marshaled
+    memory.add_data("c", "big", 60, 2**70)
+    assert memory.retrieve_data("c", "big") == 2**70
+
+
+def test_entries_expire(path, clock):
+    memory = shared(path)
+    memory.add_data("c", "a", 5, {"n": 1})
+    memory.increment("c", "hits", 5, 3)
+    assert memory.time_to_live("c", "a") == 5
+    clock.now += 5
+    with pytest.raises(DataExpiredError):
+        memory.retrieve_data("c", "a")
+    with pytest.raises(ObjectNotFoundError):
+        memory.retrieve_data("c", "a")
+    # An expired counter starts over with a new expiration time
+    assert memory.increment("c", "hits", 60) == 1
+    assert memory.time_to_live("c", "hits") == 60
+    assert memory.container_statistics("c")["expirations"] == 1
+
+
+def test_clean_container_removes_the_expired_entries(path, clock):
+    memory = shared(path)
+    memory.add_data("c", "short", 1, "s", note="gone")
+    memory.add_data("c", "long", 60, "l")
+    clock.now += 1
+    assert memory.clean_container("c") == [
+        {"data": "s", "note": "gone", "container": "c", "identifier": "short"}
+    ]
+    assert memory.list_all_data_in_container("c") == ["l"]
+
+
+def test_add_without_overwrite_conflicts_across_processes(path, clock):
+    first, second = shared(path), shared(path)
+    first.add_data("c", "a", 5, "first")
+    with pytest.raises(ObjectAlreadyExistsError):
+        second.add_data("c", "a", 60, "second")
+    assert second.retrieve_data("c", "a") == "first"
+    second.add_data("c", "a", 60, "second", overwrite=True)
+    assert first.retrieve_data("c", "a") == "second"
+    # An expired entry can be replaced without overwrite
+    clock.now += 60
+    first.add_data("c", "a", 60, "third")
+    assert second.retrieve_data("c", "a") == "third"
+
+
+def test_get_or_set_keeps_the_first_value(path):
+    first, second = shared(path), shared(path)
+    first.add_data("c", "a", 60, "stored")
+    assert second.get_or_set("c", "a", lambda: "new", 60) == "stored"
+    assert second.get_or_set("c", "b", lambda: "new", 60) == "new"
+
+
+@pytest.mark.parametrize(
+    "policy, evicted",
+    # A new entry has been used the least, so LFU drops it, like Memory's does
+    [("lru", "a"), ("lfu", "d"), ("ttl", "b")],
+)
+def test_eviction_policies(path, clock, policy, evicted):
+    # max_entries=3 checks the limit on every write
+    memory = shared(path, max_entries=3, policy=policy)
+    for identifier, ttl in (("a", 60), ("b", 10), ("c", 30)):
+        clock.now += 1
+        memory.add_data("c", identifier, ttl, identifier)
+    # a is used the most but the longest ago
+    for identifier in ("a", "a", "a", "c", "b"):
+        clock.now += 1
+        memory.retrieve_data("c", identifier)
+    clock.now += 1
+    memory.add_data("c", "d", 90, "d")
+    remaining = {"a", "b", "c", "d"} - {evicted}
+    assert sorted(memory.list_all_data_in_container("c")) == sorted(remaining)
+    assert memory.container_statistics("c")["evictions"] == 1
+
+
+def test_max_bytes_evicts_until_the_container_fits(path, clock):
+    probe = shared(path, "probe")
+    probe.add_data("probe", "a", 60, "x" * 100)
+    entry = probe.container_statistics("probe")["bytes"]
+    memory = shared(path, max_bytes=3 * entry)
+    memory.containers["c"].check_interval = 1
+    for identifier in ("a", "b", "c"):
+        clock.now += 1
+        memory.add_data("c", identifier, 60, "x" * 100)
+    clock.now += 1
+    # About one and a half entries, so the two oldest have to go
+    memory.add_data("c", "d", 60, "y" * (100 + entry // 2))
+    statistics = memory.container_statistics("c")
+    assert sorted(memory.list_all_data_in_container("c")) == [
+        "x" * 100,
+        "y" * (100 + entry // 2),
+    ]
+    with pytest.raises(ObjectNotFoundError):
+        memory.retrieve_data("c", "b")
+    assert statistics["entries"] == 2
+    assert statistics["evictions"] == 2
+    assert statistics["bytes"] <= statistics["max_bytes"]
+
+
+def test_unmarshalable_data_is_refused(path):
+    memory = shared(path)
+    with pytest.raises(DataError):
+        memory.add_data("c", "a", 60, object())
+
+
+def test_init_memory_database_is_idempotent(path, monkeypatch):
+    monkeypatch.setenv("MEMORY_BACKEND", "sqlite")
+    monkeypatch.setenv("MEMORY_SQLITE_PATH", path)
+    init_memory_database()
+    memory = create_memory("test")
+    assert isinstance(memory, SQLiteMemory)
+    memory["c"] = ""
+    memory.add_data("c", "a", 60, "kept")
+    init_memory_database()
+    assert memory.retrieve_data("c", "a") == "kept"
+
+
+def test_init_memory_database_ignores_the_local_backend(path, monkeypatch):
+    monkeypatch.setenv("MEMORY_BACKEND", "local")
+    monkeypatch.setenv("MEMORY_SQLITE_PATH", path)
+    init_memory_database()
+    assert not SQLiteMemory("test", path).path.exists()
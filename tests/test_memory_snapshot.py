@@ -0,0 +1,135 @@
+"""Tests for backend.memory_snapshot."""
+
+import io
+import struct
+import pytest
+from backend.memory import Memory
+from backend.memory_snapshot import (
+    CONTAINER,
+    ENTRY,
+    MAGIC,
+    VERSION,
+    SnapshotError,
+    SnapshotReader,
+    SnapshotWriter,
+    load_snapshot,
+    save_snapshot,
+)
+
+
+def filled_memory():
+    memory = Memory("test")
+    memory.add_container("files", "Loaded files", max_entries=10, policy="lfu")
+    memory.add_data("files", "/index.html", 600, b"<html>", note="text/html")
+    memory.add_data("files", "/app.js", 600, {"size": 3, "tags": ["a"]})
+    memory.add_data("process_information", "p1", 600, (1, 2.5, None))
+    return memory
+
+
+def snapshot_bytes() -> bytes:
+    file = io.BytesIO()
+    writer = SnapshotWriter(file)
+    writer.write_container("files", "", None, None, None)
+    writer.write_entry("files", "a", int(writer.written_at) + 600, "", "x")
+    writer.write_entry("files", "b", int(writer.written_at) + 600, "", "y")
+    writer.close()
+    return file.getvalue()
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "memory.snapshot")
+    assert save_snapshot(filled_memory(), path) == 3
+    memory = Memory("restored")
+    assert load_snapshot(memory, path) == 3
+    assert memory.retrieve_data("files", "/index.html") == b"<html>"
+    assert memory.retrieve_data("files", "/app.js") == {"size": 3, "tags": ["a"]}
+    assert memory.retrieve_data("process_information", "p1") == (1, 2.5, None)
+    statistics = memory.container_statistics("files")
+    assert (statistics["max_entries"], statistics["policy"]) == (10, "lfu")
+    assert memory.container_guides["files"] == "Loaded files"
+    assert 590 <= memory.time_to_live("files", "/app.js") <= 600
+
+
+def test_header():
+    data = snapshot_bytes()
+    magic, version, written_at = struct.unpack(">8sHd", data[:18])
+    assert (magic, version) == (MAGIC, VERSION)
+    reader = SnapshotReader(io.BytesIO(data))
+    assert reader.written_at == written_at
+    assert [kind for kind, _ in reader] == [CONTAINER, ENTRY, ENTRY]
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        b"",
+        b"TODOMEM",
+        b"NOTMEM\x00\x00" + struct.pack(">Hd", VERSION, 0.0),
+        MAGIC + struct.pack(">Hd", VERSION + 1, 0.0),
+    ],
+)
+def test_bad_header(header):
+    with pytest.raises(SnapshotError):
+        SnapshotReader(io.BytesIO(header))
+
+
+def test_every_truncation_is_rejected():
+    data = snapshot_bytes()
+    for length in range(18, len(data)):
+        with pytest.raises(SnapshotError):
+            list(SnapshotReader(io.BytesIO(data[:length])))
+
+
+def test_corrupt_records():
+    data = bytearray(snapshot_bytes())
+    # A record length far too large
+    corrupt = data[:19] + struct.pack(">I", 2**31) + data[23:]
+    with pytest.raises(SnapshotError):
+        list(SnapshotReader(io.BytesIO(bytes(corrupt))))
+    # An unknown record kind
+    corrupt = data[:18] + b"\x09" + data[19:]
+    with pytest.raises(SnapshotError):
+        list(SnapshotReader(io.BytesIO(bytes(corrupt))))
+
+
+def test_entries_before_the_damage_are_kept(tmp_path):
+    path = tmp_path / "memory.snapshot"
+    path.write_bytes(snapshot_bytes()[:-3])
+    memory = Memory("restored")
+    with pytest.raises(SnapshotError):
+        load_snapshot(memory, str(path))
+    assert memory.retrieve_data("files", "a") == "x"
+
+
+def test_expired_invalid_and_used_entries_are_skipped(tmp_path):
+    file = io.BytesIO()
+    writer = SnapshotWriter(file)
+    writer.write_container("files", "", None, None, None)
+    now = int(writer.written_at)
+    writer.write_entry("files", "expired", now - 1, "", "x")
+    writer.write_entry("files", "invalid", now + 600, "old", "x")
+    writer.write_entry("files", "used", now + 600, "", "snapshot")
+    writer.write_entry("files", "fresh", now + 600, "", "x")
+    writer.close()
+    path = tmp_path / "memory.snapshot"
+    path.write_bytes(file.getvalue())
+
+    memory = Memory("restored")
+    memory.add_container("files")
+    memory.add_data("files", "used", 600, "current")
+    loaded = load_snapshot(
+        memory, str(path), validators={"files": lambda identifier, note: note != "old"}
+    )
+    assert loaded == 1
+    assert memory.retrieve_data("files", "used") == "current"
+    assert memory.retrieve_data("files", "fresh") == "x"
+
+
+def test_unmarshalable_entries_are_skipped(tmp_path):
+    memory = Memory("test")
+    memory.add_data("process_information", "lock", 600, object())
+    memory.add_data("process_information", "ok", 600, "x")
+    path = str(tmp_path / "memory.snapshot")
+    assert save_snapshot(memory, path) == 1
+    restored = Memory("restored")
+    assert load_snapshot(restored, path) == 1
@@ -0,0 +1,57 @@
+"""Tests for backend.profiling."""
+
+import threading
+
+import pytest
+from backend import profiling
+from backend.profiling import ProfilingError, StackSampler
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def sampler():
+    sampler = StackSampler()
+    yield sampler
+    if sampler.running:
+        sampler.stop()
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+def test_samples_the_other_threads(sampler):
+    stop = threading.Event()
+    worker = threading.Thread(target=busy, args=(stop,), name="worker")
+    worker.start()
+    try:
+        sampler.start(0.001)
+        with pytest.raises(ProfilingError):
+            sampler.start()
+        while sampler.samples < 20:
+            threading.Event().wait(0.01)
+        stacks = sampler.stop()
+    finally:
+        stop.set()
+        worker.join()
+    assert not sampler.running
+    assert "thread worker;" in stacks
+    assert "stack-sampler" not in stacks
+    with pytest.raises(ProfilingError):
+        sampler.stop()
+
+
+def test_can_start_again_after_the_deadline(sampler, monkeypatch):
+    monkeypatch.setattr(profiling, "MAX_SAMPLING_SECONDS", 0.05)
+    sampler.start(0.001)
+    sampler._thread.join(TIMEOUT)
+    assert not sampler.running
+    # Stopped on its own, what it sampled can still be collected
+    assert sampler.stop() != ""
+    sampler.start(0.001)
+    sampler._thread.join(TIMEOUT)
+    # Or it's started again without stopping it first
+    sampler.start(0.001)
+    assert sampler.running
@@ -0,0 +1,270 @@
+"""Tests for backend.router.request_body."""
+
+import io
+import socket
+import time
+import pytest
+from backend.router.request_body import (
+    MAX_TRAILER_LINES,
+    BodyTimeoutError,
+    BodyTooLargeError,
+    MalformedBodyError,
+    RequestBody,
+    get_max_body_size,
+)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.timeout = 60.0
+        self.timeouts = []
+
+    def gettimeout(self):
+        return self.timeout
+
+    def settimeout(self, timeout):
+        self.timeouts.append(timeout)
+        self.timeout = timeout
+
+
+class SlowReader(io.BufferedReader):
+    """Reads a byte at a time, taking delay seconds for every read."""
+
+    def __init__(self, data: bytes, delay: float):
+        super().__init__(io.BytesIO(data))
+        self.delay = delay
+
+    def read1(self, size=-1):
+        time.sleep(self.delay)
+        return super().read1(1)
+
+
+class FakeRequest:
+    def __init__(self, headers: dict, body: bytes, rfile=None):
+        self.headers = headers
+        self.connection = FakeConnection()
+        self.rfile = rfile or io.BufferedReader(io.BytesIO(body))
+
+
+def make_body(headers, body=b"", *, max_size=1024, timeout=5.0, chunk_size=4):
+    request = FakeRequest(headers, body)
+    request_body = RequestBody(
+        request, max_size=max_size, timeout=timeout, chunk_size=chunk_size
+    )
+    request_body.inspect_headers()
+    return request_body
+
+
+def chunked(*chunks: bytes, trailers: bytes = b"") -> bytes:
+    framed = b"".join(b"%x\r\n%s\r\n" % (len(chunk), chunk) for chunk in chunks)
+    return framed + b"0\r\n" + trailers + b"\r\n"
+
+
+# -- Content-Length
+def test_content_length_body():
+    body = make_body({"Content-Length": "11"}, b"hello world and more")
+    assert body.raw() == b"hello world"
+    # Read once, kept afterwards
+    assert body.raw() == b"hello world"
+
+
+def test_content_length_reads_in_chunks():
+    body = make_body({"Content-Length": "10"}, b"0123456789", chunk_size=4)
+    assert list(body.iter_chunks()) == [b"0123", b"4567", b"89"]
+
+
+def test_missing_content_length_is_empty():
+    body = make_body({})
+    assert body.is_empty()
+    assert body.raw() == b""
+    assert body.json() is None
+
+
+@pytest.mark.parametrize("length", ["abc", "-1", "1.5"])
+def test_invalid_content_length(length):
+    with pytest.raises(MalformedBodyError):
+        make_body({"Content-Length": length})
+
+
+def test_content_length_over_the_limit_is_rejected_before_reading():
+    with pytest.raises(BodyTooLargeError):
+        make_body({"Content-Length": "1025"}, max_size=1024)
+
+
+def test_connection_closed_mid_body():
+    body = make_body({"Content-Length": "10"}, b"short")
+    with pytest.raises(MalformedBodyError):
+        body.raw()
+
+
+def test_body_can_only_be_streamed_once():
+    body = make_body({"Content-Length": "2"}, b"ab")
+    assert list(body.iter_chunks()) == [b"ab"]
+    with pytest.raises(RuntimeError):
+        list(body.iter_chunks())
+
+
+def test_json():
+    body = make_body({"Content-Length": "13"}, b'{"title": 1}')
+    with pytest.raises(MalformedBodyError):
+        body.json()
+    body = make_body({"Content-Length": "12"}, b'{"title": 1}')
+    assert body.json() == {"title": 1}
+
+
+# -- Chunked
+def test_chunked_body():
+    body = make_body(
+        {"Transfer-Encoding": "chunked"}, chunked(b"hello ", b"world"), chunk_size=64
+    )
+    assert body.raw() == b"hello world"
+
+
+def test_chunk_extensions_are_ignored():
+    body = make_body(
+        {"Transfer-Encoding": "Chunked"}, b"5;name=value\r\nhello\r\n0\r\n\r\n"
+    )
+    assert body.raw() == b"hello"
+
+
+def test_trailers_are_discarded():
+    body = make_body(
+        {"Transfer-Encoding": "chunked"},
+        chunked(b"data", trailers=b"Checksum: abc\r\nOther: 1\r\n"),
+    )
+    assert body.raw() == b"data"
+
+
+def test_too_many_trailers():
+    trailers = b"X: 1\r\n" * MAX_TRAILER_LINES
+    body = make_body(
+        {"Transfer-Encoding": "chunked"}, chunked(b"data", trailers=trailers)
+    )
+    with pytest.raises(MalformedBodyError):
+        body.raw()
+
+
+def test_chunked_and_content_length_together_are_rejected():
+    with pytest.raises(MalformedBodyError):
+        make_body({"Transfer-Encoding": "chunked", "Content-Length": "4"})
+
+
+def test_unsupported_transfer_encoding():
+    with pytest.raises(MalformedBodyError):
+        make_body({"Transfer-Encoding": "gzip"})
+
+
+@pytest.mark.parametrize(
+    "framed",
+    [
+        b"zz\r\nhello\r\n0\r\n\r\n",  # Not hex
+        b"-5\r\nhello\r\n0\r\n\r\n",  # Negative
+        b"3\r\nhello\r\n0\r\n\r\n",  # Longer than its size
+        b"5\r\nhel",  # Closed mid-chunk
+        b"5\r\nhello\r\n",  # Closed before the last chunk
+        b"1" * 2000 + b"\r\n",  # Chunk line too long
+    ],
+)
+def test_malformed_chunked_bodies(framed):
+    body = make_body({"Transfer-Encoding": "chunked"}, framed)
+    with pytest.raises(MalformedBodyError):
+        body.raw()
+
+
+def test_chunked_body_over_the_limit():
+    body = make_body(
+        {"Transfer-Encoding": "chunked"}, chunked(b"a" * 8, b"b" * 8), max_size=10
+    )
+    chunks = body.iter_chunks()
+    # The first chunk is within the limit and already handed out.
+    assert b"".join(next(chunks) for _ in range(2)) == b"a" * 8
+    with pytest.raises(BodyTooLargeError):
+        list(chunks)
+
+
+# -- Deadline
+def test_reads_share_one_deadline():
+    request = FakeRequest(
+        {"Content-Length": "100"}, b"", rfile=SlowReader(b"x" * 100, 0.02)
+    )
+    body = RequestBody(request, max_size=1024, timeout=0.1, chunk_size=64)
+    body.inspect_headers()
+    with pytest.raises(BodyTimeoutError):
+        body.raw()
+    timeouts = request.connection.timeouts[:-1]
+    # Every read gets what's left of the deadline, not a fresh timeout.
+    assert len(timeouts) > 1
+    assert timeouts == sorted(timeouts, reverse=True)
+    assert all(timeout <= 0.1 for timeout in timeouts)
+    # The connection's own timeout is restored.
+    assert request.connection.timeout == 60.0
+
+
+def test_socket_timeout_is_a_body_timeout():
+    class TimingOutReader(io.BufferedReader):
+        def read1(self, size=-1):
+            raise socket.timeout("timed out")
+
+    request = FakeRequest(
+        {"Content-Length": "4"}, b"", rfile=TimingOutReader(io.BytesIO(b""))
+    )
+    body = RequestBody(request, max_size=1024, timeout=5, chunk_size=64)
+    body.inspect_headers()
+    with pytest.raises(BodyTimeoutError):
+        body.raw()
+
+
+# -- Lines
+def lines(data: bytes, max_line_length: int, chunk_size: int = 4):
+    body = make_body(
+        {"Content-Length": str(len(data))}, data, chunk_size=chunk_size
+    )
+    return list(body.iter_lines(max_line_length))
+
+
+def test_lines_across_chunks():
+    assert lines(b"one\r\ntwo\nthree", 10) == [b"one", b"two", b"three"]
+    assert lines(b"one\ntwo\n", 10) == [b"one", b"two"]
+
+
+def test_long_line_is_yielded_as_none():
+    assert lines(b"ab\ntoolongline\ncd", 5) == [b"ab", None, b"cd"]
+
+
+def test_long_line_within_one_chunk():
+    assert lines(b"ab\ntoolongline\ncd", 5, chunk_size=64) == [b"ab", None, b"cd"]
+
+
+def test_long_last_line():
+    assert lines(b"ab\n0123456789", 5) == [b"ab", None]
+
+
+def test_long_lines_keep_their_line_numbers():
+    result = lines(b"0123456789\n0123456789abcdef\nok\n", 5)
+    assert result == [None, None, b"ok"]
+
+
+# -- Limits
+LIMITS = {
+    "POST": {
+        "/api/tasks": 8,
+        "/api/tasks/import": 64,
+        "/api/*": 16,
+        "/api/tasks/*": 32,
+    }
+}
+
+
+@pytest.mark.parametrize(
+    "method, path, limit",
+    [
+        ("POST", "/api/tasks", 8),
+        ("POST", "/api/tasks/import", 64),
+        ("POST", "/api/tasks/7", 32),
+        ("POST", "/api/other", 16),
+        ("POST", "/session", 4),
+        ("PATCH", "/api/tasks/7", 4),
+    ],
+)
+def test_get_max_body_size(method, path, limit):
+    assert get_max_body_size(LIMITS, method, path, 4) == limit
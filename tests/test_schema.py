@@ -0,0 +1,83 @@
+"""Tests for backend.schema."""
+
+import pytest
+from backend.schema import (
+    ListOf,
+    MapOf,
+    NotRequired,
+    Nullable,
+    Object,
+    SchemaDefinitionError,
+    SchemaViolation,
+    compile_schema,
+)
+
+TASK_SCHEMA = compile_schema(
+    {
+        "title": str,
+        "completed": NotRequired(bool),
+        "labels": NotRequired(ListOf(str, max_length=3)),
+        "due": NotRequired(Nullable(float)),
+    }
+)
+
+
+def test_valid_value_has_no_violations():
+    value = {"title": "Milk", "completed": False, "labels": ["home"], "due": None}
+    assert TASK_SCHEMA(value) == []
+    assert TASK_SCHEMA.is_valid(value)
+
+
+def test_required_unknown_and_mistyped_fields():
+    violations = TASK_SCHEMA({"completed": 1, "colour": "red"})
+    assert violations == [
+        SchemaViolation("title", "Field is required"),
+        SchemaViolation("completed", "Expected boolean, got integer"),
+        SchemaViolation("colour", "Unknown field"),
+    ]
+    assert not TASK_SCHEMA.is_valid({"completed": 1})
+
+
+def test_bool_is_not_an_integer_but_an_integer_is_a_number():
+    assert not compile_schema(int).is_valid(True)
+    assert compile_schema(float).is_valid(3)
+    assert not compile_schema(float).is_valid("3")
+
+
+def test_paths_of_nested_items():
+    schema = compile_schema({"tasks": ListOf({"labels": MapOf(int)})})
+    violations = schema({"tasks": [{"labels": {"a": 1}}, {"labels": {"b": "x"}}]})
+    assert [str(violation) for violation in violations] == [
+        "tasks[1].labels.b: Expected integer, got string"
+    ]
+
+
+def test_top_level_violation_has_no_path():
+    violations = TASK_SCHEMA([])
+    assert violations == [SchemaViolation("", "Expected object, got array")]
+    assert str(violations[0]) == "Expected object, got array"
+
+
+def test_list_and_map_lengths():
+    assert TASK_SCHEMA({"title": "a", "labels": ["1", "2", "3", "4"]}) == [
+        SchemaViolation("labels", "Expected at most 3 items, got 4")
+    ]
+    assert compile_schema(ListOf(int, min_length=1))([]) == [
+        SchemaViolation("", "Expected at least 1 items, got 0")
+    ]
+    assert not compile_schema(MapOf(str, max_length=1)).is_valid({"a": "", "b": ""})
+
+
+def test_extra_keys_allowed_by_object():
+    schema = compile_schema(Object({"id": int}, allow_extra=True))
+    assert schema.is_valid({"id": 1, "anything": []})
+    assert schema({}) == [SchemaViolation("id", "Field is required")]
+
+
+@pytest.mark.parametrize(
+    "declaration",
+    [list, NotRequired(str), {1: str}, "str", ListOf(bytes)],
+)
+def test_invalid_declarations(declaration):
+    with pytest.raises(SchemaDefinitionError):
+        compile_schema(declaration)